@@ -0,0 +1,146 @@
+-- Migration v1.2.4: Add Session Activity Rollup
+-- Description: Trigger-maintained hourly session/metric counters so pipeline freshness checks read a fixed number of rows instead of scanning audio sessions
+
+-- Check if migration has been applied
+DO $$
+BEGIN
+    IF NOT migration_applied('v1.2.4') THEN
+
+        RAISE NOTICE 'Applying migration v1.2.4: Session Activity Rollup';
+
+        -- Set schema
+        SET search_path TO analytics, core, public;
+
+        -- One row per hour of session creation.
+        -- latest_teachers counts teachers whose most recent session falls in the bucket, so the number
+        -- of distinct teachers active in a window is the sum of latest_teachers over its buckets.
+        CREATE TABLE IF NOT EXISTS analytics.session_activity_hourly (
+            bucket_start TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+            sessions_created INTEGER NOT NULL DEFAULT 0,
+            metrics_changed INTEGER NOT NULL DEFAULT 0,
+            latest_teachers INTEGER NOT NULL DEFAULT 0,
+            latest_session_at TIMESTAMP WITH TIME ZONE,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+
+        -- Most recent session bucket per teacher
+        CREATE TABLE IF NOT EXISTS analytics.teacher_last_activity (
+            teacher_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+            last_bucket TIMESTAMP WITH TIME ZONE
+        );
+
+        -- Maintain counters on session insert/delete
+        CREATE OR REPLACE FUNCTION analytics.record_session_activity()
+        RETURNS TRIGGER AS $fn$
+        DECLARE
+            v_bucket TIMESTAMP WITH TIME ZONE;
+            v_previous TIMESTAMP WITH TIME ZONE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE analytics.session_activity_hourly
+                SET sessions_created = GREATEST(0, sessions_created - 1),
+                    updated_at = NOW()
+                WHERE bucket_start = date_trunc('hour', OLD.created_at);
+                RETURN NULL;
+            END IF;
+
+            v_bucket := date_trunc('hour', NEW.created_at);
+
+            INSERT INTO analytics.session_activity_hourly (bucket_start, sessions_created, latest_session_at)
+            VALUES (v_bucket, 1, NEW.created_at)
+            ON CONFLICT (bucket_start) DO UPDATE
+            SET sessions_created = session_activity_hourly.sessions_created + 1,
+                latest_session_at = GREATEST(session_activity_hourly.latest_session_at, EXCLUDED.latest_session_at),
+                updated_at = NOW();
+
+            -- Move the teacher's "latest" mark forward; the row lock serializes concurrent sessions per teacher
+            INSERT INTO analytics.teacher_last_activity (teacher_id)
+            VALUES (NEW.teacher_id)
+            ON CONFLICT (teacher_id) DO NOTHING;
+
+            SELECT last_bucket INTO v_previous
+            FROM analytics.teacher_last_activity
+            WHERE teacher_id = NEW.teacher_id
+            FOR UPDATE;
+
+            IF v_previous IS NULL OR v_previous < v_bucket THEN
+                UPDATE analytics.teacher_last_activity
+                SET last_bucket = v_bucket
+                WHERE teacher_id = NEW.teacher_id;
+
+                IF v_previous IS NOT NULL THEN
+                    UPDATE analytics.session_activity_hourly
+                    SET latest_teachers = GREATEST(0, latest_teachers - 1)
+                    WHERE bucket_start = v_previous;
+                END IF;
+
+                UPDATE analytics.session_activity_hourly
+                SET latest_teachers = latest_teachers + 1
+                WHERE bucket_start = v_bucket;
+            END IF;
+
+            RETURN NULL;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        -- Count CIQ metric writes in the hour they happen (drives the hourly sync probe)
+        CREATE OR REPLACE FUNCTION analytics.record_metrics_activity()
+        RETURNS TRIGGER AS $fn$
+        BEGIN
+            INSERT INTO analytics.session_activity_hourly (bucket_start, metrics_changed)
+            VALUES (date_trunc('hour', NOW()), 1)
+            ON CONFLICT (bucket_start) DO UPDATE
+            SET metrics_changed = session_activity_hourly.metrics_changed + 1,
+                updated_at = NOW();
+            RETURN NULL;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS record_session_activity ON core.audio_sessions;
+        CREATE TRIGGER record_session_activity
+            AFTER INSERT OR DELETE ON core.audio_sessions
+            FOR EACH ROW EXECUTE FUNCTION analytics.record_session_activity();
+
+        DROP TRIGGER IF EXISTS record_metrics_activity ON analytics.ciq_metrics;
+        CREATE TRIGGER record_metrics_activity
+            AFTER INSERT OR UPDATE ON analytics.ciq_metrics
+            FOR EACH ROW EXECUTE FUNCTION analytics.record_metrics_activity();
+
+        -- Backfill from existing data
+        INSERT INTO analytics.session_activity_hourly (bucket_start, sessions_created, latest_session_at)
+        SELECT date_trunc('hour', created_at), COUNT(*), MAX(created_at)
+        FROM core.audio_sessions
+        GROUP BY date_trunc('hour', created_at)
+        ON CONFLICT (bucket_start) DO NOTHING;
+
+        INSERT INTO analytics.session_activity_hourly (bucket_start, metrics_changed)
+        SELECT date_trunc('hour', created_at), COUNT(*)
+        FROM analytics.ciq_metrics
+        GROUP BY date_trunc('hour', created_at)
+        ON CONFLICT (bucket_start) DO UPDATE
+        SET metrics_changed = EXCLUDED.metrics_changed;
+
+        INSERT INTO analytics.teacher_last_activity (teacher_id, last_bucket)
+        SELECT teacher_id, date_trunc('hour', MAX(created_at))
+        FROM core.audio_sessions
+        GROUP BY teacher_id
+        ON CONFLICT (teacher_id) DO NOTHING;
+
+        UPDATE analytics.session_activity_hourly h
+        SET latest_teachers = t.teachers
+        FROM (
+            SELECT last_bucket, COUNT(*) AS teachers
+            FROM analytics.teacher_last_activity
+            GROUP BY last_bucket
+        ) t
+        WHERE h.bucket_start = t.last_bucket;
+
+        -- Record migration as applied
+        PERFORM public.record_migration('v1.2.4', 'Trigger-maintained hourly session activity rollup for pipeline freshness checks');
+
+        RAISE NOTICE 'Migration v1.2.4 applied successfully - Session activity rollup created';
+
+    ELSE
+        RAISE NOTICE 'Migration v1.2.4 already applied, skipping';
+    END IF;
+END $$;
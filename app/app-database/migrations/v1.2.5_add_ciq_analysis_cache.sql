@@ -0,0 +1,42 @@
+-- Migration v1.2.5: Add CIQ Analysis Cache
+-- Description: Content-hash cache of per-segment analyzer results so re-analysing identical transcript segments skips the model
+
+-- Check if migration has been applied
+DO $$
+BEGIN
+    IF NOT migration_applied('v1.2.5') THEN
+
+        RAISE NOTICE 'Applying migration v1.2.5: CIQ Analysis Cache';
+
+        -- Set schema
+        SET search_path TO analytics, core, public;
+
+        -- One row per distinct (model, prompt version, segment text); segment_hash covers all three
+        CREATE TABLE IF NOT EXISTS analytics.ciq_analysis_cache (
+            segment_hash CHAR(32) PRIMARY KEY,
+            llm_model_version VARCHAR(50) NOT NULL,
+            prompt_version VARCHAR(20) NOT NULL,
+            segment_chars INTEGER NOT NULL,
+            result JSONB NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            last_used_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+
+        -- Pruning of entries no longer referenced by recent runs
+        CREATE INDEX IF NOT EXISTS idx_ciq_analysis_cache_last_used ON analytics.ciq_analysis_cache(last_used_at);
+
+        -- Pending-analysis scan: sessions with a transcript and no metrics yet
+        CREATE INDEX IF NOT EXISTS idx_audio_sessions_pending_analysis
+            ON core.audio_sessions(created_at)
+            WHERE transcript IS NOT NULL AND status IN ('processing', 'completed');
+
+        -- Record migration as applied
+        PERFORM public.record_migration('v1.2.5', 'Content-hash cache for batched CIQ transcript analysis');
+
+        RAISE NOTICE 'Migration v1.2.5 applied successfully - CIQ analysis cache created';
+
+    ELSE
+        RAISE NOTICE 'Migration v1.2.5 already applied, skipping';
+    END IF;
+END $$;
@@ -0,0 +1,29 @@
+-- Migration v1.2.6: Add Forum Event Keyset Indexes
+-- Description: (created_at, id) indexes so the warehouse event-stream loader pages forum votes and bookmarks without full scans
+
+-- Check if migration has been applied
+DO $$
+BEGIN
+    IF NOT migration_applied('v1.2.6') THEN
+
+        RAISE NOTICE 'Applying migration v1.2.6: Forum Event Keyset Indexes';
+
+        -- Set schema
+        SET search_path TO community, core, public;
+
+        -- Event-stream keyset pagination: WHERE (created_at, id) > (...) ORDER BY created_at, id LIMIT n
+        CREATE INDEX IF NOT EXISTS idx_forum_votes_created_at_id
+            ON community.forum_votes(created_at, id);
+
+        CREATE INDEX IF NOT EXISTS idx_forum_bookmarks_created_at_id
+            ON community.forum_bookmarks(created_at, id);
+
+        -- Record migration as applied
+        PERFORM public.record_migration('v1.2.6', 'Keyset pagination indexes for forum vote and bookmark event streams');
+
+        RAISE NOTICE 'Migration v1.2.6 applied successfully - forum keyset indexes created';
+
+    ELSE
+        RAISE NOTICE 'Migration v1.2.6 already applied, skipping';
+    END IF;
+END $$;
@@ -0,0 +1,38 @@
+-- Migration v1.2.7: Add CIQ Analysis Failures
+-- Description: Per-session record of permanent analyzer failures so unanalyzable transcripts stop being re-picked every hour
+
+-- Check if migration has been applied
+DO $$
+BEGIN
+    IF NOT migration_applied('v1.2.7') THEN
+
+        RAISE NOTICE 'Applying migration v1.2.7: CIQ Analysis Failures';
+
+        -- Set schema
+        SET search_path TO analytics, core, public;
+
+        -- One row per session the analyzer could not score (blank transcript or a segment the model rejected);
+        -- the pending-analysis scan skips sessions at the attempt limit for the current model and prompt version
+        CREATE TABLE IF NOT EXISTS analytics.ciq_analysis_failures (
+            session_id UUID PRIMARY KEY REFERENCES core.audio_sessions(id) ON DELETE CASCADE,
+            reason VARCHAR(50) NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            last_error TEXT,
+            llm_model_version VARCHAR(50) NOT NULL,
+            prompt_version VARCHAR(20) NOT NULL,
+            first_failed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            last_failed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+
+        -- Review of sessions given up on
+        CREATE INDEX IF NOT EXISTS idx_ciq_analysis_failures_last_failed ON analytics.ciq_analysis_failures(last_failed_at);
+
+        -- Record migration as applied
+        PERFORM public.record_migration('v1.2.7', 'Terminal failure markers for batched CIQ transcript analysis');
+
+        RAISE NOTICE 'Migration v1.2.7 applied successfully - CIQ analysis failures table created';
+
+    ELSE
+        RAISE NOTICE 'Migration v1.2.7 already applied, skipping';
+    END IF;
+END $$;
@@ -0,0 +1,189 @@
+-- Migration v1.2.8: Rework Session Activity Rollup
+-- Description: Spread the hourly activity counters over per-backend slots and keep them correct on session deletes and on updates that move a session
+
+-- Check if migration has been applied
+DO $$
+BEGIN
+    IF NOT migration_applied('v1.2.8') THEN
+
+        RAISE NOTICE 'Applying migration v1.2.8: Rework Session Activity Rollup';
+
+        -- Set schema
+        SET search_path TO analytics, core, public;
+
+        -- No session writes while the counters are rebuilt below
+        LOCK TABLE core.audio_sessions IN SHARE MODE;
+
+        -- Each backend adds into its own slot row of the hour, so concurrent writers no longer
+        -- queue on one row lock; readers SUM over the slots. A slot may go negative (a session
+        -- counted in one slot and removed from another), only the sum over slots is meaningful.
+        ALTER TABLE analytics.session_activity_hourly ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+        ALTER TABLE analytics.session_activity_hourly DROP CONSTRAINT IF EXISTS session_activity_hourly_pkey;
+        ALTER TABLE analytics.session_activity_hourly ADD PRIMARY KEY (bucket_start, slot);
+
+        CREATE OR REPLACE FUNCTION analytics.add_session_activity(
+            p_bucket TIMESTAMP WITH TIME ZONE,
+            p_sessions INTEGER,
+            p_metrics INTEGER,
+            p_latest_teachers INTEGER,
+            p_latest_at TIMESTAMP WITH TIME ZONE
+        )
+        RETURNS VOID AS $fn$
+        BEGIN
+            INSERT INTO analytics.session_activity_hourly (
+                bucket_start, slot, sessions_created, metrics_changed, latest_teachers, latest_session_at
+            )
+            VALUES (p_bucket, pg_backend_pid() % 16, p_sessions, p_metrics, p_latest_teachers, p_latest_at)
+            ON CONFLICT (bucket_start, slot) DO UPDATE
+            SET sessions_created = session_activity_hourly.sessions_created + EXCLUDED.sessions_created,
+                metrics_changed = session_activity_hourly.metrics_changed + EXCLUDED.metrics_changed,
+                latest_teachers = session_activity_hourly.latest_teachers + EXCLUDED.latest_teachers,
+                -- An upper bound: removing a bucket's newest session does not lower it
+                latest_session_at = GREATEST(session_activity_hourly.latest_session_at, EXCLUDED.latest_session_at),
+                updated_at = NOW();
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        -- latest_teachers follows every change of a teacher's latest bucket, including rows removed
+        -- by ON DELETE CASCADE from auth.users
+        CREATE OR REPLACE FUNCTION analytics.record_teacher_latest()
+        RETURNS TRIGGER AS $fn$
+        BEGIN
+            -- OLD / NEW are only referenced under the TG_OP that defines them
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.last_bucket IS NOT DISTINCT FROM NEW.last_bucket THEN
+                    RETURN NULL;
+                END IF;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                IF OLD.last_bucket IS NOT NULL THEN
+                    PERFORM analytics.add_session_activity(OLD.last_bucket, 0, 0, -1, NULL);
+                END IF;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                IF NEW.last_bucket IS NOT NULL THEN
+                    PERFORM analytics.add_session_activity(NEW.last_bucket, 0, 0, 1, NULL);
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        -- Teacher's latest bucket after one of their sessions was removed or moved
+        CREATE OR REPLACE FUNCTION analytics.refresh_teacher_latest(p_teacher_id UUID)
+        RETURNS VOID AS $fn$
+        DECLARE
+            v_latest TIMESTAMP WITH TIME ZONE;
+        BEGIN
+            -- Lock first so the MAX below sees any session inserted concurrently for this teacher
+            PERFORM 1 FROM analytics.teacher_last_activity WHERE teacher_id = p_teacher_id FOR UPDATE;
+            IF NOT FOUND THEN
+                RETURN;
+            END IF;
+
+            SELECT date_trunc('hour', MAX(created_at)) INTO v_latest
+            FROM core.audio_sessions
+            WHERE teacher_id = p_teacher_id;
+
+            IF v_latest IS NULL THEN
+                DELETE FROM analytics.teacher_last_activity WHERE teacher_id = p_teacher_id;
+            ELSE
+                UPDATE analytics.teacher_last_activity
+                SET last_bucket = v_latest
+                WHERE teacher_id = p_teacher_id AND last_bucket IS DISTINCT FROM v_latest;
+            END IF;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        -- Inserts and updates count NEW, deletes and updates un-count OLD
+        CREATE OR REPLACE FUNCTION analytics.record_session_activity()
+        RETURNS TRIGGER AS $fn$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM analytics.add_session_activity(date_trunc('hour', OLD.created_at), -1, 0, 0, NULL);
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM analytics.add_session_activity(date_trunc('hour', NEW.created_at), 1, 0, 0, NEW.created_at);
+
+                -- Move the teacher's latest mark forward; the row lock serializes sessions per teacher
+                INSERT INTO analytics.teacher_last_activity (teacher_id, last_bucket)
+                VALUES (NEW.teacher_id, date_trunc('hour', NEW.created_at))
+                ON CONFLICT (teacher_id) DO UPDATE
+                SET last_bucket = EXCLUDED.last_bucket
+                WHERE teacher_last_activity.last_bucket IS NULL
+                   OR teacher_last_activity.last_bucket < EXCLUDED.last_bucket;
+            END IF;
+
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM analytics.refresh_teacher_latest(OLD.teacher_id);
+            END IF;
+
+            RETURN NULL;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION analytics.record_metrics_activity()
+        RETURNS TRIGGER AS $fn$
+        BEGIN
+            PERFORM analytics.add_session_activity(date_trunc('hour', NOW()), 0, 1, 0, NULL);
+            RETURN NULL;
+        END;
+        $fn$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS record_session_activity ON core.audio_sessions;
+        CREATE TRIGGER record_session_activity
+            AFTER INSERT OR DELETE ON core.audio_sessions
+            FOR EACH ROW EXECUTE FUNCTION analytics.record_session_activity();
+
+        DROP TRIGGER IF EXISTS record_session_activity_move ON core.audio_sessions;
+        CREATE TRIGGER record_session_activity_move
+            AFTER UPDATE OF created_at, teacher_id ON core.audio_sessions
+            FOR EACH ROW
+            WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at OR OLD.teacher_id IS DISTINCT FROM NEW.teacher_id)
+            EXECUTE FUNCTION analytics.record_session_activity();
+
+        -- Rebuild counters the previous triggers let drift (deletes, moved sessions)
+        DELETE FROM analytics.teacher_last_activity t
+        WHERE NOT EXISTS (SELECT 1 FROM core.audio_sessions s WHERE s.teacher_id = t.teacher_id);
+
+        INSERT INTO analytics.teacher_last_activity (teacher_id, last_bucket)
+        SELECT teacher_id, date_trunc('hour', MAX(created_at))
+        FROM core.audio_sessions
+        GROUP BY teacher_id
+        ON CONFLICT (teacher_id) DO UPDATE
+        SET last_bucket = EXCLUDED.last_bucket;
+
+        UPDATE analytics.session_activity_hourly
+        SET sessions_created = 0, latest_teachers = 0;
+
+        INSERT INTO analytics.session_activity_hourly (bucket_start, slot, sessions_created, latest_session_at)
+        SELECT date_trunc('hour', created_at), 0, COUNT(*), MAX(created_at)
+        FROM core.audio_sessions
+        GROUP BY date_trunc('hour', created_at)
+        ON CONFLICT (bucket_start, slot) DO UPDATE
+        SET sessions_created = EXCLUDED.sessions_created,
+            latest_session_at = EXCLUDED.latest_session_at;
+
+        INSERT INTO analytics.session_activity_hourly (bucket_start, slot, latest_teachers)
+        SELECT last_bucket, 0, COUNT(*)
+        FROM analytics.teacher_last_activity
+        GROUP BY last_bucket
+        ON CONFLICT (bucket_start, slot) DO UPDATE
+        SET latest_teachers = EXCLUDED.latest_teachers;
+
+        -- Created after the rebuild so it does not count the rebuilt marks twice
+        DROP TRIGGER IF EXISTS record_teacher_latest ON analytics.teacher_last_activity;
+        CREATE TRIGGER record_teacher_latest
+            AFTER INSERT OR UPDATE OF last_bucket OR DELETE ON analytics.teacher_last_activity
+            FOR EACH ROW EXECUTE FUNCTION analytics.record_teacher_latest();
+
+        -- Record migration as applied
+        PERFORM public.record_migration('v1.2.8', 'Slotted session activity counters with delete and update handling');
+
+        RAISE NOTICE 'Migration v1.2.8 applied successfully - Session activity rollup reworked';
+
+    ELSE
+        RAISE NOTICE 'Migration v1.2.8 already applied, skipping';
+    END IF;
+END $$;
@@ -17,6 +17,17 @@ from airflow.utils.dates import days_ago
 # Add shared utilities to path
 sys.path.append('/opt/airflow/shared')
 from utils import send_pipeline_alert, ETLMetrics, setup_logging
+from profiling import profile_task, task_stage
+from run_history import record_pipeline_run
+from eci_facts import load_eci_facts
+from part_maintenance import merge_fragmented_partitions
+from event_streams import sync_event_streams
+from metric_anomalies import run_anomaly_detection
+from source_freshness import count_changes_since
+from connections import db_connections, work_priority, PRIORITY_SYNC, SYNC_PRIORITY_WEIGHT
+from resilience import call_with_retries, task_deadline, fail_fast_if_permanent
+from xcom_spool import store_uuids, pull_uuids, purge_spool
+from ciq_analyzer import analyze_pending_sessions
 
 # DAG Configuration
 DAG_ID = 'andi_ciq_sync'
@@ -32,7 +43,13 @@ default_args = {
     'email_on_retry': False,
     'retries': 3,
     'retry_delay': timedelta(minutes=2),
+    # Exponential, per-task-instance jittered delays so overlapping runs don't retry in lockstep
+    'retry_exponential_backoff': True,
+    'max_retry_delay': timedelta(minutes=10),
     'execution_timeout': timedelta(minutes=15),
+    # Latency-sensitive: takes free andi_postgres / andi_clickhouse pool slots before bulk daily work
+    'priority_weight': SYNC_PRIORITY_WEIGHT,
+    'weight_rule': 'absolute',
     'sla': timedelta(minutes=30),
     'email': ['data-team@andilabs.ai']
 }
@@ -47,19 +64,48 @@ dag = DAG(
     catchup=False,
     max_active_runs=3,  # Allow some overlap for high-frequency syncs
     tags=['andi', 'ciq', 'hourly', 'realtime'],
+    params={'profile': False},  # Set to true in a manual trigger to profile Python tasks
     doc_md=__doc__
 )
 
+AFFECTED_IDS_QUERY = """
+SELECT DISTINCT s.id, s.teacher_id
+FROM audio.audio_sessions s
+JOIN analytics.ciq_metrics m ON s.id = m.session_id
+WHERE (s.created_at > %s OR m.created_at > %s OR m.updated_at > %s)
+  AND s.status = 'completed'
+"""
+
+@profile_task(DAG_ID, 'check_new_data')
 def check_new_ciq_data(**context):
     """Check for new CIQ metrics since last sync"""
     logger = setup_logging('ciq_data_check')
+    metrics = ETLMetrics('ciq_data_check')
     
     try:
         pg_hook = PostgresHook(postgres_conn_id='postgres_andi')
+        pg_endpoint = db_connections.postgres_endpoint
         
         # Get last sync time (1 hour ago as fallback)
         last_sync = context['execution_date'] - timedelta(hours=1)
         
+        # The rollup answers "anything new?" in constant time; the join below only runs when it says yes
+        with task_deadline(context), task_stage('change_counter_query'):
+            changes = call_with_retries(count_changes_since, pg_hook, last_sync, endpoint=pg_endpoint, metrics=metrics)
+        
+        if changes['sessions_created'] == 0 and changes['metrics_changed'] == 0:
+            sync_info = {
+                'new_sessions': 0,
+                'affected_teachers': 0,
+                'has_new_data': False,
+                'last_sync': last_sync.isoformat(),
+                'earliest_session': None,
+                'latest_session': None
+            }
+            context['task_instance'].xcom_push(key='sync_info', value=sync_info)
+            logger.info("No session or metric writes since last sync, skipping sync")
+            return sync_info
+        
         # Check for new CIQ metrics
         query = """
         SELECT 
@@ -73,8 +119,13 @@ def check_new_ciq_data(**context):
           AND s.status = 'completed'
         """
         
-        result = pg_hook.get_first(query, parameters=[last_sync, last_sync, last_sync])
+        with task_deadline(context), task_stage('new_data_query'):
+            result = call_with_retries(
+                pg_hook.get_first, query, parameters=[last_sync, last_sync, last_sync],
+                endpoint=pg_endpoint, metrics=metrics
+            )
         new_sessions, affected_teachers, earliest_session, latest_session = result
+        metrics.record_extraction(new_sessions)
         
         sync_info = {
             'new_sessions': new_sessions,
@@ -87,6 +138,16 @@ def check_new_ciq_data(**context):
         
         context['task_instance'].xcom_push(key='sync_info', value=sync_info)
         
+        if new_sessions > 0:
+            # Id sets go through the spool; XCom only carries the reference
+            with task_deadline(context), task_stage('affected_ids_query'):
+                rows = call_with_retries(
+                    pg_hook.get_records, AFFECTED_IDS_QUERY, parameters=[last_sync, last_sync, last_sync],
+                    endpoint=pg_endpoint, metrics=metrics
+                )
+            store_uuids(context, 'affected_sessions', (row[0] for row in rows))
+            store_uuids(context, 'affected_teacher_ids', (row[1] for row in rows))
+        
         if new_sessions == 0:
             logger.info("No new CIQ data found, skipping sync")
         else:
@@ -96,8 +157,12 @@ def check_new_ciq_data(**context):
         
     except Exception as e:
         logger.error(f"Failed to check new CIQ data: {e}")
+        metrics.record_error(str(e))
         send_pipeline_alert('CIQ Data Check', 'failure', str(e))
+        fail_fast_if_permanent(e)
         raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'check_new_data', context)
 
 def sync_ciq_incremental(**context):
     """Sync new CIQ data incrementally"""
@@ -137,6 +202,112 @@ def update_realtime_aggregates(**context):
     
     return update_cmd
 
+def load_eci_facts_incremental(**context):
+    """Load the day's new ECI component facts as one coalesced insert"""
+    logger = setup_logging('eci_facts_sync')
+    metrics = ETLMetrics('eci_facts_sync')
+    
+    try:
+        sync_info = context['task_instance'].xcom_pull(key='sync_info', task_ids='check_new_data')
+        
+        if not sync_info.get('has_new_data', False):
+            logger.info("No new data, skipping ECI facts load")
+            return
+        
+        # Coalescing keeps hourly inserts from fragmenting aggregates_daily_ciq_metrics
+        result = load_eci_facts(context['ds'], metrics=metrics, batch_id=context['run_id'], coalesce=True)
+        logger.info(f"ECI facts sync completed: {result}")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('ECI Facts Sync', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'load_eci_facts', context)
+
+def detect_metric_anomalies(**context):
+    """Score the new batch's CIQ metric distribution against running baselines"""
+    logger = setup_logging('metric_anomalies')
+    metrics = ETLMetrics('metric_anomalies')
+    
+    try:
+        sync_info = context['task_instance'].xcom_pull(key='sync_info', task_ids='check_new_data') or {}
+        
+        if not sync_info.get('has_new_data', False):
+            logger.info("No new data, skipping anomaly detection")
+            return
+        
+        # Score exactly this run's interval so overlapping or catch-up runs never fold a session in twice
+        result = run_anomaly_detection(
+            context['data_interval_start'], context['data_interval_end'],
+            metrics=metrics, batch_id=context['run_id']
+        )
+        logger.info(
+            f"Anomaly detection completed: {len(result['anomalies'])} anomalies, "
+            f"quarantined metrics: {result['quarantined_metrics']}"
+        )
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('CIQ Metric Anomaly Detection', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'detect_metric_anomalies', context)
+
+def maintain_table_parts(**context):
+    """Merge warehouse partitions that have accumulated too many parts and purge old spool files"""
+    logger = setup_logging('part_maintenance')
+    
+    try:
+        actions = merge_fragmented_partitions(max_merges=5)
+        logger.info(f"Part maintenance triggered {len(actions)} merges")
+        purge_spool()
+    except Exception as e:
+        logger.error(f"Part maintenance failed: {e}")
+        # Don't fail the sync for maintenance issues
+
+def sync_event_stream_group(task_id: str, stream_names: list, **context):
+    """Append new app events to the warehouse from each stream's watermark"""
+    logger = setup_logging(f'event_streams.{task_id}')
+    metrics = ETLMetrics(task_id)
+    
+    try:
+        # Cap each run so a large backlog is worked off over several hourly runs
+        with task_deadline(context), work_priority(PRIORITY_SYNC):
+            results = sync_event_streams(
+                stream_names, metrics=metrics, batch_id=context['run_id'], max_rows_per_stream=2_000_000
+            )
+        logger.info(f"Event stream sync completed: {results}")
+        return results
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('Event Stream Sync', 'failure', f"{task_id}: {e}")
+        fail_fast_if_permanent(e)
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, task_id, context)
+
+def analyze_transcripts(**context):
+    """Score pending session transcripts with the local CIQ analyzer model"""
+    logger = setup_logging('ciq_analyzer')
+    metrics = ETLMetrics('ciq_analyzer')
+    
+    try:
+        # Stops between session groups near the deadline; the rest is picked up next hour
+        with task_deadline(context):
+            result = analyze_pending_sessions(metrics=metrics, batch_id=context['run_id'], max_sessions=200)
+        logger.info(f"Transcript analysis completed: {result}")
+        return result
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('CIQ Transcript Analysis', 'failure', str(e))
+        fail_fast_if_permanent(e)
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'analyze_transcripts', context)
+
 def validate_sync_quality(**context):
     """Quick validation of sync quality"""
     logger = setup_logging('sync_validation')
@@ -150,7 +321,8 @@ def validate_sync_quality(**context):
         
         # Quick validation checks
         # In real implementation, compare source vs target counts
-        expected_sessions = sync_info.get('new_sessions', 0)
+        affected_sessions = pull_uuids(context, 'affected_sessions', task_ids='check_new_data')
+        expected_sessions = len(affected_sessions) if affected_sessions is not None else sync_info.get('new_sessions', 0)
         
         # Mock validation for now
         validation_result = {
@@ -223,16 +395,28 @@ def send_sync_summary(**context):
 
 # Task Definitions
 
+# One slot: overlapping runs would otherwise pick the same pending sessions
+analyze_task = PythonOperator(
+    task_id='analyze_transcripts',
+    python_callable=analyze_transcripts,
+    pool='andi_ollama',
+    dag=dag,
+    doc_md="Score pending transcripts with the CIQ analyzer model, reusing cached segment results"
+)
+
 check_data_task = PythonOperator(
     task_id='check_new_data',
     python_callable=check_new_ciq_data,
     dag=dag,
+    # Sync what is already scored even if the model server is down
+    trigger_rule='all_done',
     doc_md="Check for new CIQ metrics since last sync"
 )
 
 sync_task = BashOperator(
     task_id='sync_ciq_data',
     bash_command=sync_ciq_incremental(),
+    pool='andi_postgres',
     dag=dag,
     doc_md="Incrementally sync new CIQ data to ClickHouse"
 )
@@ -240,10 +424,19 @@ sync_task = BashOperator(
 aggregate_task = BashOperator(
     task_id='update_realtime_aggregates',
     bash_command=update_realtime_aggregates(),
+    pool='andi_clickhouse',
     dag=dag,
     doc_md="Update real-time aggregation tables"
 )
 
+eci_facts_task = PythonOperator(
+    task_id='load_eci_facts',
+    python_callable=load_eci_facts_incremental,
+    pool='andi_postgres',
+    dag=dag,
+    doc_md="Load new ECI component facts in one coalesced insert"
+)
+
 validate_task = PythonOperator(
     task_id='validate_sync',
     python_callable=validate_sync_quality,
@@ -259,5 +452,49 @@ summary_task = PythonOperator(
     doc_md="Send sync completion summary"
 )
 
+# Watermark-driven event streams run independently of the CIQ chain
+resource_usage_task = PythonOperator(
+    task_id='sync_resource_usage',
+    python_callable=sync_event_stream_group,
+    op_kwargs={'task_id': 'sync_resource_usage', 'stream_names': ['core.resource_interactions']},
+    pool='andi_postgres',
+    dag=dag,
+    doc_md="Append new resource interactions to facts_resource_usage"
+)
+
+community_activity_task = PythonOperator(
+    task_id='sync_community_activity',
+    python_callable=sync_event_stream_group,
+    op_kwargs={
+        'task_id': 'sync_community_activity',
+        'stream_names': [
+            'community.forum_questions', 'community.forum_answers',
+            'community.forum_votes', 'community.forum_bookmarks'
+        ]
+    },
+    pool='andi_postgres',
+    dag=dag,
+    doc_md="Append new forum posts, votes and bookmarks to facts_community_activity"
+)
+
+anomaly_task = PythonOperator(
+    task_id='detect_metric_anomalies',
+    python_callable=detect_metric_anomalies,
+    dag=dag,
+    doc_md="Flag batches whose CIQ score or talk-time distribution shifted from the running baselines"
+)
+
+maintenance_task = PythonOperator(
+    task_id='maintain_table_parts',
+    python_callable=maintain_table_parts,
+    pool='andi_clickhouse',
+    dag=dag,
+    trigger_rule='all_done',
+    doc_md="Merge fact/aggregate partitions with too many active parts and purge expired XCom spool files"
+)
+
 # Task Dependencies
-check_data_task >> sync_task >> aggregate_task >> validate_task >> summary_task
\ No newline at end of file
+analyze_task >> check_data_task
+check_data_task >> sync_task >> eci_facts_task >> aggregate_task >> validate_task >> summary_task
+summary_task >> maintenance_task
+check_data_task >> anomaly_task
\ No newline at end of file
@@ -19,6 +19,15 @@ from airflow.utils.task_group import TaskGroup
 # Add shared utilities to path
 sys.path.append('/opt/airflow/shared')
 from utils import send_pipeline_alert, ETLMetrics, setup_logging
+from profiling import profile_task, task_stage
+from run_history import record_pipeline_run, check_throughput_regressions
+from eci_facts import load_eci_facts
+from rolling_trends import update_rolling_trends
+from report_snapshots import materialize_report_snapshots
+from outcome_correlations import update_outcome_correlations
+from partition_archive import archive_cold_partitions
+from source_freshness import get_source_freshness, hours_since
+from connections import BULK_PRIORITY_WEIGHT
 
 # DAG Configuration
 DAG_ID = 'andi_daily_etl'
@@ -35,6 +44,9 @@ default_args = {
     'retries': 2,
     'retry_delay': timedelta(minutes=5),
     'execution_timeout': timedelta(hours=2),
+    # Bulk work yields pool slots to the hourly sync
+    'priority_weight': BULK_PRIORITY_WEIGHT,
+    'weight_rule': 'absolute',
     'sla': timedelta(hours=4),
     'email': ['data-team@andilabs.ai']
 }
@@ -49,9 +61,11 @@ dag = DAG(
     catchup=False,
     max_active_runs=1,
     tags=['andi', 'etl', 'daily', 'warehouse'],
+    params={'profile': False},  # Set to true in a manual trigger to profile Python tasks
     doc_md=__doc__
 )
 
+@profile_task(DAG_ID, 'validate_source_data')
 def check_source_data(**context):
     """Validate source data before starting ETL"""
     logger = setup_logging('data_validation')
@@ -61,18 +75,12 @@ def check_source_data(**context):
         # Check PostgreSQL connectivity
         pg_hook = PostgresHook(postgres_conn_id='postgres_andi')
         
-        # Validate data freshness
-        query = """
-        SELECT 
-            COUNT(*) as total_sessions,
-            MAX(created_at) as latest_session,
-            COUNT(DISTINCT teacher_id) as active_teachers
-        FROM audio.audio_sessions 
-        WHERE created_at >= NOW() - INTERVAL '7 days'
-        """
-        
-        result = pg_hook.get_first(query)
-        total_sessions, latest_session, active_teachers = result
+        # Validate data freshness from the trigger-maintained hourly rollup
+        with task_stage('freshness_query'):
+            freshness = get_source_freshness(pg_hook, window=timedelta(days=7))
+        total_sessions = freshness['total_sessions']
+        latest_session = freshness['latest_session']
+        active_teachers = freshness['active_teachers']
         
         # Data quality checks
         if total_sessions < 10:
@@ -82,7 +90,7 @@ def check_source_data(**context):
             raise ValueError(f"Too few active teachers: {active_teachers}")
         
         # Check for data gaps
-        hours_since_latest = (datetime.now() - latest_session).total_seconds() / 3600
+        hours_since_latest = hours_since(latest_session)
         if hours_since_latest > 48:
             logger.warning(f"Latest session is {hours_since_latest:.1f} hours old")
         
@@ -101,6 +109,8 @@ def check_source_data(**context):
         metrics.record_error(str(e))
         send_pipeline_alert('Source Data Validation', 'failure', str(e))
         raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'validate_source_data', context)
 
 def extract_ciq_data(**context):
     """Extract CIQ session data"""
@@ -141,6 +151,24 @@ def transform_and_load_data(**context):
     
     return transform_cmd
 
+def load_eci_component_facts(**context):
+    """Load ECI component scores into facts_ciq_comprehensive"""
+    logger = setup_logging('eci_facts_load')
+    metrics = ETLMetrics('eci_facts_load')
+    execution_date = context['ds']
+    
+    try:
+        result = load_eci_facts(execution_date, metrics=metrics, batch_id=context['run_id'])
+        context['task_instance'].xcom_push(key='eci_facts_result', value=result)
+        logger.info(f"ECI facts load completed: {result}")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('ECI Facts Load', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'load_eci_facts', context)
+
 def validate_target_data(**context):
     """Validate data in ClickHouse after load"""
     logger = setup_logging('target_validation')
@@ -181,6 +209,8 @@ def validate_target_data(**context):
         metrics.record_error(str(e))
         send_pipeline_alert('Target Data Validation', 'failure', str(e))
         raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'validate_target_data', context)
 
 def update_aggregations(**context):
     """Update aggregation tables and materialized views"""
@@ -194,6 +224,74 @@ def update_aggregations(**context):
     
     return agg_cmd
 
+def refresh_rolling_trends(**context):
+    """Recompute rolling teacher/school trend windows touched by new sessions"""
+    logger = setup_logging('rolling_trends')
+    metrics = ETLMetrics('rolling_trends')
+    
+    try:
+        result = update_rolling_trends(metrics=metrics, batch_id=context['run_id'])
+        logger.info(f"Rolling trends refreshed: {result}")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('Rolling Trends Refresh', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'update_rolling_trends', context)
+
+def refresh_report_snapshots(**context):
+    """Rewrite coach and teacher report snapshots whose inputs changed"""
+    logger = setup_logging('report_snapshots')
+    metrics = ETLMetrics('report_snapshots')
+    
+    try:
+        result = materialize_report_snapshots(metrics=metrics, batch_id=context['run_id'])
+        logger.info(f"Report snapshots materialized: {result}")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('Report Snapshots', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'materialize_report_snapshots', context)
+
+def refresh_outcome_correlations(**context):
+    """Fold classroom-weeks with new ECI or outcome facts into the correlation statistics"""
+    logger = setup_logging('outcome_correlations')
+    metrics = ETLMetrics('outcome_correlations')
+    
+    try:
+        result = update_outcome_correlations(metrics=metrics, batch_id=context['run_id'])
+        logger.info(f"Outcome correlations refreshed: {result}")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('Outcome Correlations Refresh', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'update_outcome_correlations', context)
+
+def archive_fact_partitions(**context):
+    """Export fact partitions nearing their TTL to the Parquet archive"""
+    logger = setup_logging('partition_archive')
+    metrics = ETLMetrics('partition_archive')
+    
+    try:
+        exported = archive_cold_partitions(
+            metrics=metrics,
+            batch_id=context['run_id'],
+            drop_after_archive=os.getenv('ARCHIVE_DROP_PARTITIONS', 'false').lower() == 'true'
+        )
+        logger.info(f"Archived {len(exported)} partitions ({sum(entry['rows'] for entry in exported):,} rows)")
+        
+    except Exception as e:
+        metrics.record_error(str(e))
+        send_pipeline_alert('Partition Archive', 'failure', str(e))
+        raise
+    finally:
+        record_pipeline_run(metrics, DAG_ID, 'archive_cold_partitions', context)
+
 def send_completion_notification(**context):
     """Send pipeline completion notification"""
     logger = setup_logging('notification')
@@ -235,6 +333,17 @@ def send_completion_notification(**context):
         logger.error(f"Failed to send completion notification: {e}")
         # Don't fail the pipeline for notification issues
 
+def check_pipeline_regressions(**context):
+    """Flag task runs whose throughput (or duration, for checks) regressed versus their trailing median"""
+    logger = setup_logging('pipeline_regressions')
+    
+    try:
+        regressions = check_throughput_regressions(threshold=0.3, window=14)
+        logger.info(f"Throughput regression check found {len(regressions)} regressed runs")
+    except Exception as e:
+        logger.error(f"Failed to check pipeline regressions: {e}")
+        # Don't fail the pipeline for monitoring issues
+
 
 # Task Definitions
 
@@ -251,6 +360,8 @@ with TaskGroup('extract_data', dag=dag) as extract_group:
     extract_ciq_task = BashOperator(
         task_id='extract_ciq_sessions',
         bash_command=extract_ciq_data(),
+        pool='andi_postgres',
+        pool_slots=2,
         dag=dag,
         doc_md="Extract CIQ session data from PostgreSQL"
     )
@@ -258,6 +369,7 @@ with TaskGroup('extract_data', dag=dag) as extract_group:
     extract_dims_task = BashOperator(
         task_id='extract_dimensions',
         bash_command=extract_dimension_data(),
+        pool='andi_postgres',
         dag=dag,
         doc_md="Extract dimension data (teachers, schools, districts)"
     )
@@ -266,10 +378,21 @@ with TaskGroup('extract_data', dag=dag) as extract_group:
 transform_load_task = BashOperator(
     task_id='transform_and_load',
     bash_command=transform_and_load_data(),
+    pool='andi_clickhouse',
+    pool_slots=2,
     dag=dag,
     doc_md="Transform data and load to ClickHouse"
 )
 
+# ECI component facts (feeds mv_realtime_ciq_dashboard)
+load_eci_facts_task = PythonOperator(
+    task_id='load_eci_facts',
+    python_callable=load_eci_component_facts,
+    pool='andi_postgres',
+    dag=dag,
+    doc_md="Load ECI component scores into facts_ciq_comprehensive in large insert blocks"
+)
+
 # Validation tasks
 validate_target_task = PythonOperator(
     task_id='validate_target_data',
@@ -282,10 +405,43 @@ validate_target_task = PythonOperator(
 update_aggs_task = BashOperator(
     task_id='update_aggregations',
     bash_command=update_aggregations(),
+    pool='andi_clickhouse',
     dag=dag,
     doc_md="Update aggregation tables and materialized views"
 )
 
+rolling_trends_task = PythonOperator(
+    task_id='update_rolling_trends',
+    python_callable=refresh_rolling_trends,
+    pool='andi_clickhouse',
+    dag=dag,
+    doc_md="Incrementally refresh rolling 4/12-week teacher and school trends"
+)
+
+report_snapshots_task = PythonOperator(
+    task_id='materialize_report_snapshots',
+    python_callable=refresh_report_snapshots,
+    pool='andi_clickhouse',
+    dag=dag,
+    doc_md="Materialize Coach My Teachers and Teacher Performance report payloads"
+)
+
+outcome_correlations_task = PythonOperator(
+    task_id='update_outcome_correlations',
+    python_callable=refresh_outcome_correlations,
+    pool='andi_clickhouse',
+    dag=dag,
+    doc_md="Incrementally update ECI vs student outcome correlation statistics and coefficients"
+)
+
+archive_task = PythonOperator(
+    task_id='archive_cold_partitions',
+    python_callable=archive_fact_partitions,
+    pool='andi_clickhouse',
+    dag=dag,
+    doc_md="Archive fact partitions nearing TTL expiry to Parquet"
+)
+
 # Notification task
 notify_task = PythonOperator(
     task_id='send_completion_notification',
@@ -295,5 +451,17 @@ notify_task = PythonOperator(
     doc_md="Send pipeline completion notification"
 )
 
+# Performance regression check
+regression_check_task = PythonOperator(
+    task_id='check_pipeline_regressions',
+    python_callable=check_pipeline_regressions,
+    dag=dag,
+    trigger_rule='all_done',
+    doc_md="Compare run throughput in pipeline_runs against the trailing median"
+)
+
 # Task Dependencies
-validate_source_task >> extract_group >> transform_load_task >> validate_target_task >> update_aggs_task >> notify_task
\ No newline at end of file
+validate_source_task >> extract_group >> transform_load_task >> load_eci_facts_task >> validate_target_task >> update_aggs_task >> rolling_trends_task >> report_snapshots_task >> notify_task
+validate_target_task >> archive_task >> notify_task
+validate_target_task >> outcome_correlations_task >> notify_task
+notify_task >> regression_check_task
\ No newline at end of file
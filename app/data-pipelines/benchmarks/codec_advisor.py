@@ -0,0 +1,379 @@
+"""
+ANDI Warehouse Column Codec Advisor
+
+Samples recent partitions of the warehouse fact tables, rewrites each column
+into scratch tables under candidate encodings (LowCardinality, Delta /
+DoubleDelta, Gorilla, T64, ZSTD levels) and measures compressed size and
+scan time against the column's current encoding. Every candidate sees the
+same rows in the table's sort order, so Delta-style codecs are judged on
+the data layout they would actually get.
+
+Recommendations are ranked by estimated bytes saved on the full table, and
+written as a JSON report plus ``ALTER TABLE ... MODIFY COLUMN`` migration DDL:
+
+    python benchmarks/codec_advisor.py --output codec_report.json --ddl codec_migration.sql
+    python benchmarks/codec_advisor.py --tables facts_ciq_sessions --sample-rows 2000000
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'shared'))
+
+from utils import format_bytes  # noqa: E402
+from connections import DatabaseConnections  # noqa: E402
+
+DEFAULT_TABLES = ['facts_ciq_sessions', 'facts_community_activity', 'facts_resource_usage']
+
+# A recommendation must shrink the column by this fraction of its current size ...
+MIN_SAVING = 0.10
+# ... without scanning more than this much slower
+MAX_SLOWDOWN = 1.5
+# LowCardinality dictionaries beyond this many distinct values cost more than they save
+MAX_LOW_CARDINALITY = 10_000
+SCAN_REPEATS = 3
+
+INTEGER_TYPES = re.compile(r'^U?Int(8|16|32|64)$')
+FLOAT_TYPES = re.compile(r'^Float(32|64)$')
+TIME_TYPES = re.compile(r'^(Date|Date32|DateTime|DateTime64)(\(.*\))?$')
+STRING_TYPES = re.compile(r'^(Nullable\(String\)|String|Array\(String\))$')
+
+# Scratch tables keep wide parts so system.columns reports per-column sizes
+SCRATCH_SETTINGS = 'min_bytes_for_wide_part = 0, min_rows_for_wide_part = 0'
+SINGLE_THREAD = {'max_threads': 1, 'max_insert_threads': 1}
+
+
+def low_cardinality_type(column_type: str) -> Optional[str]:
+    if column_type == 'String':
+        return 'LowCardinality(String)'
+    if column_type == 'Nullable(String)':
+        return 'LowCardinality(Nullable(String))'
+    if column_type == 'Array(String)':
+        return 'Array(LowCardinality(String))'
+    return None
+
+
+def candidate_encodings(column_type: str, cardinality: int, type_locked: bool) -> List[Tuple[str, str]]:
+    """(type, codec) pairs worth trying for a column; codec '' means the server default (LZ4)"""
+    candidates = [(column_type, 'ZSTD(1)'), (column_type, 'ZSTD(3)'), (column_type, 'ZSTD(9)')]
+    if INTEGER_TYPES.match(column_type):
+        candidates += [(column_type, 'T64, ZSTD(1)'), (column_type, 'Delta, ZSTD(1)'), (column_type, 'DoubleDelta')]
+    elif TIME_TYPES.match(column_type):
+        candidates += [(column_type, 'Delta, ZSTD(1)'), (column_type, 'DoubleDelta'), (column_type, 'DoubleDelta, ZSTD(1)')]
+    elif FLOAT_TYPES.match(column_type):
+        candidates += [(column_type, 'Gorilla'), (column_type, 'Gorilla, ZSTD(1)'), (column_type, 'FPC')]
+    elif STRING_TYPES.match(column_type) and not type_locked and cardinality <= MAX_LOW_CARDINALITY:
+        lc_type = low_cardinality_type(column_type)
+        candidates += [(lc_type, ''), (lc_type, 'ZSTD(1)')]
+    return candidates
+
+
+def column_definition(name: str, column_type: str, codec: str, default_kind: str = '', default_expression: str = '') -> str:
+    definition = f'`{name}` {column_type}'
+    if default_kind:
+        definition += f' {default_kind} {default_expression}'
+    if codec:
+        definition += f' CODEC({codec})'
+    return definition
+
+
+def describe_table(client, database: str, table: str) -> Dict[str, Any]:
+    info = client.query(
+        "SELECT sorting_key, total_rows FROM system.tables WHERE database = %(db)s AND name = %(table)s",
+        parameters={'db': database, 'table': table}
+    ).result_rows
+    if not info:
+        raise ValueError(f"{database}.{table} does not exist")
+    columns = client.query(
+        """
+        SELECT name, type, default_kind, default_expression, compression_codec,
+               data_compressed_bytes, data_uncompressed_bytes,
+               is_in_sorting_key OR is_in_primary_key OR is_in_partition_key
+        FROM system.columns
+        WHERE database = %(db)s AND table = %(table)s AND default_kind != 'ALIAS'
+        ORDER BY position
+        """,
+        parameters={'db': database, 'table': table}
+    ).result_rows
+    return {
+        'sorting_key': info[0][0],
+        'total_rows': info[0][1] or 0,
+        'columns': [
+            {
+                'name': name, 'type': column_type, 'default_kind': default_kind,
+                'default_expression': default_expression,
+                # system.columns reports 'CODEC(ZSTD(1))'; keep just the codec list
+                'codec': re.sub(r'^CODEC\((.*)\)$', r'\1', codec or ''),
+                'compressed_bytes': compressed, 'uncompressed_bytes': uncompressed,
+                'type_locked': bool(locked)
+            }
+            for name, column_type, default_kind, default_expression, codec, compressed, uncompressed, locked in columns
+        ]
+    }
+
+
+def create_sample(client, database: str, table: str, scratch: str, sorting_key: str,
+                  columns: List[Dict[str, Any]], rows: int, partitions: int) -> str:
+    """Copy up to ``rows`` rows of the newest partitions, in sort-key order, into a scratch table"""
+    sample = f'{scratch}.{table}__sample'
+    client.command(f'DROP TABLE IF EXISTS {sample}')
+    definitions = ', '.join(column_definition(c['name'], c['type'], c['codec']) for c in columns)
+    client.command(f'CREATE TABLE {sample} ({definitions}) ENGINE = MergeTree ORDER BY tuple() SETTINGS {SCRATCH_SETTINGS}')
+    names = ', '.join(f"`{c['name']}`" for c in columns)
+    client.command(
+        f"""
+        INSERT INTO {sample} ({names})
+        SELECT {names}
+        FROM {database}.{table}
+        WHERE _partition_id IN (
+            SELECT partition_id FROM system.parts
+            WHERE database = '{database}' AND table = '{table}' AND active
+            GROUP BY partition_id ORDER BY partition_id DESC LIMIT {int(partitions)}
+        )
+        ORDER BY {sorting_key or 'tuple()'}
+        LIMIT {int(rows)}
+        """,
+        settings={'max_insert_threads': 1}
+    )
+    client.command(f'OPTIMIZE TABLE {sample} FINAL')
+    return sample
+
+
+def column_cardinalities(client, sample: str, columns: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Distinct values per String-like column (array columns count distinct elements)"""
+    cardinalities = {}
+    # One query per column: arrayJoin would multiply the rows seen by the other columns
+    for column in columns:
+        if not STRING_TYPES.match(column['type']):
+            continue
+        values = f"arrayJoin(`{column['name']}`)" if column['type'].startswith('Array') else f"`{column['name']}`"
+        cardinalities[column['name']] = int(client.query(f'SELECT uniqExact({values}) FROM {sample}').result_rows[0][0])
+    return cardinalities
+
+
+def measure_round(client, sample: str, round_table: str, encodings: Dict[str, Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+    """Rewrite the sample under one encoding per column; sizes and median scan time per column"""
+    client.command(f'DROP TABLE IF EXISTS {round_table}')
+    definitions = ', '.join(column_definition(name, column_type, codec) for name, (column_type, codec) in encodings.items())
+    client.command(f'CREATE TABLE {round_table} ({definitions}) ENGINE = MergeTree ORDER BY tuple() SETTINGS {SCRATCH_SETTINGS}')
+    names = ', '.join(f'`{name}`' for name in encodings)
+    client.command(f'INSERT INTO {round_table} ({names}) SELECT {names} FROM {sample}', settings=SINGLE_THREAD)
+    client.command(f'OPTIMIZE TABLE {round_table} FINAL')
+
+    database, table = round_table.split('.', 1)
+    sizes = {
+        name: (compressed, uncompressed)
+        for name, compressed, uncompressed in client.query(
+            """
+            SELECT name, data_compressed_bytes, data_uncompressed_bytes
+            FROM system.columns WHERE database = %(db)s AND table = %(table)s
+            """,
+            parameters={'db': database, 'table': table}
+        ).result_rows
+    }
+
+    results = {}
+    for name, (column_type, codec) in encodings.items():
+        timings = []
+        for _ in range(SCAN_REPEATS):
+            started = time.perf_counter()
+            client.query(
+                f'SELECT count() FROM {round_table} WHERE NOT ignore(`{name}`)',
+                settings={'use_uncompressed_cache': 0, **SINGLE_THREAD}
+            )
+            timings.append(time.perf_counter() - started)
+        compressed, uncompressed = sizes.get(name, (0, 0))
+        results[name] = {
+            'type': column_type,
+            'codec': codec,
+            'compressed_bytes': compressed,
+            'uncompressed_bytes': uncompressed,
+            'scan_ms': round(statistics.median(timings) * 1000, 2)
+        }
+    return results
+
+
+def recommend(column: Dict[str, Any], measured: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Smallest candidate that saves MIN_SAVING without scanning MAX_SLOWDOWN slower than the current encoding"""
+    baseline = measured[0]
+    if not baseline['compressed_bytes']:
+        return None
+    acceptable = [
+        candidate for candidate in measured[1:]
+        if candidate['compressed_bytes'] <= baseline['compressed_bytes'] * (1 - MIN_SAVING)
+        and candidate['scan_ms'] <= max(baseline['scan_ms'] * MAX_SLOWDOWN, baseline['scan_ms'] + 1.0)
+    ]
+    if not acceptable:
+        return None
+    best = min(acceptable, key=lambda candidate: (candidate['compressed_bytes'], candidate['scan_ms']))
+    ratio = best['compressed_bytes'] / baseline['compressed_bytes']
+    return {
+        **best,
+        'sample_saving': round(1 - ratio, 4),
+        # Scale the sample ratio to the column's current on-disk size
+        'estimated_saved_bytes': int(column['compressed_bytes'] * (1 - ratio))
+    }
+
+
+def advise_table(client, database: str, table: str, scratch: str, sample_rows: int,
+                 partitions: int, keep_scratch: bool = False) -> Dict[str, Any]:
+    description = describe_table(client, database, table)
+    columns = description['columns']
+    sample = create_sample(client, database, table, scratch, description['sorting_key'], columns, sample_rows, partitions)
+    sampled_rows = int(client.query(f'SELECT count() FROM {sample}').result_rows[0][0])
+    cardinalities = column_cardinalities(client, sample, columns)
+
+    # Round 0 is every column's current encoding; round k tries each column's k-th candidate
+    plans = {
+        c['name']: [(c['type'], c['codec'])] + [
+            encoding for encoding in candidate_encodings(c['type'], cardinalities.get(c['name'], 0), c['type_locked'])
+            if encoding != (c['type'], c['codec'])
+        ]
+        for c in columns
+    }
+    measured: Dict[str, List[Dict[str, Any]]] = {name: [] for name in plans}
+    rounds = max(len(plan) for plan in plans.values())
+    for index in range(rounds):
+        encodings = {name: plan[index] for name, plan in plans.items() if index < len(plan)}
+        round_table = f'{scratch}.{table}__round{index}'
+        for name, result in measure_round(client, sample, round_table, encodings).items():
+            measured[name].append(result)
+        if not keep_scratch:
+            client.command(f'DROP TABLE IF EXISTS {round_table}')
+    if not keep_scratch:
+        client.command(f'DROP TABLE IF EXISTS {sample}')
+
+    report_columns = []
+    for column in columns:
+        candidates = measured[column['name']]
+        report_columns.append({
+            'name': column['name'],
+            'current': {**candidates[0], 'table_compressed_bytes': column['compressed_bytes']},
+            'cardinality': cardinalities.get(column['name']),
+            'default_kind': column['default_kind'],
+            'default_expression': column['default_expression'],
+            'type_locked': column['type_locked'],
+            'candidates': sorted(candidates[1:], key=lambda candidate: candidate['compressed_bytes']),
+            'recommendation': recommend(column, candidates)
+        })
+    return {
+        'table': table,
+        'total_rows': description['total_rows'],
+        'sampled_rows': sampled_rows,
+        'columns': report_columns
+    }
+
+
+def ranked_recommendations(tables: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ranked = [
+        {
+            'table': table['table'], 'column': column['name'],
+            'from': f"{column['current']['type']} CODEC({column['current']['codec'] or 'default'})",
+            'to': f"{column['recommendation']['type']} CODEC({column['recommendation']['codec'] or 'default'})",
+            'sample_saving': column['recommendation']['sample_saving'],
+            'estimated_saved_bytes': column['recommendation']['estimated_saved_bytes'],
+            'scan_ms': [column['current']['scan_ms'], column['recommendation']['scan_ms']]
+        }
+        for table in tables for column in table['columns'] if column['recommendation']
+    ]
+    return sorted(ranked, key=lambda item: item['estimated_saved_bytes'], reverse=True)
+
+
+def migration_ddl(database: str, tables: List[Dict[str, Any]]) -> str:
+    lines = [
+        '-- ANDI Data Warehouse - Column codec migration',
+        f'-- Generated by benchmarks/codec_advisor.py on {datetime.now():%Y-%m-%d %H:%M}',
+        '-- Type changes (LowCardinality) rewrite the column as a mutation; codec-only changes apply to',
+        '-- new parts and to existing parts as they merge (OPTIMIZE ... FINAL per partition to force it).',
+        '',
+        f'USE {database};',
+        ''
+    ]
+    for table in tables:
+        for column in table['columns']:
+            recommendation = column['recommendation']
+            if not recommendation:
+                continue
+            rewrite = recommendation['type'] != column['current']['type']
+            lines.append(
+                f"-- {column['name']}: {recommendation['sample_saving']:.0%} smaller on sample, "
+                f"~{format_bytes(recommendation['estimated_saved_bytes'])} saved{' (mutation)' if rewrite else ''}"
+            )
+            # MODIFY COLUMN replaces the whole definition, so DEFAULT / MATERIALIZED expressions are restated
+            definition = column_definition(
+                column['name'], recommendation['type'], recommendation['codec'] or 'LZ4',
+                column['default_kind'] if column['default_expression'] else '', column['default_expression']
+            )
+            lines.append(f"ALTER TABLE {table['table']} MODIFY COLUMN {definition};")
+            lines.append('')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='ANDI warehouse column codec advisor')
+    parser.add_argument('--tables', nargs='+', default=DEFAULT_TABLES)
+    parser.add_argument('--database', default=os.getenv('CLICKHOUSE_DB', 'andi_warehouse'))
+    parser.add_argument('--scratch-database', default='andi_codec_scratch')
+    parser.add_argument('--sample-rows', type=int, default=1_000_000)
+    parser.add_argument('--partitions', type=int, default=2, help='Newest partitions to sample from')
+    parser.add_argument('--keep-scratch', action='store_true', help='Leave scratch tables for inspection')
+    parser.add_argument('--output', help='Write the JSON report to this path (default: stdout)')
+    parser.add_argument('--ddl', help='Write migration DDL to this path')
+    args = parser.parse_args(argv)
+
+    connections = DatabaseConnections()
+    report: Dict[str, Any] = {
+        'tool': 'codec_advisor',
+        'timestamp': datetime.now().isoformat(),
+        'database': args.database,
+        'config': {
+            'sample_rows': args.sample_rows, 'partitions': args.partitions,
+            'min_saving': MIN_SAVING, 'max_slowdown': MAX_SLOWDOWN
+        },
+        'tables': []
+    }
+
+    with connections.get_clickhouse_connection() as client:
+        client.command(f'CREATE DATABASE IF NOT EXISTS {args.scratch_database}')
+        for table in args.tables:
+            print(f"Sampling {args.database}.{table} ...", file=sys.stderr)
+            report['tables'].append(advise_table(
+                client, args.database, table, args.scratch_database,
+                args.sample_rows, args.partitions, args.keep_scratch
+            ))
+        if not args.keep_scratch:
+            client.command(f'DROP DATABASE IF EXISTS {args.scratch_database}')
+
+    report['ranked'] = ranked_recommendations(report['tables'])
+    report['estimated_saved_bytes'] = sum(item['estimated_saved_bytes'] for item in report['ranked'])
+
+    payload = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(payload)
+    else:
+        print(payload)
+
+    if args.ddl:
+        with open(args.ddl, 'w') as ddl_file:
+            ddl_file.write(migration_ddl(args.database, report['tables']))
+
+    for item in report['ranked'][:10]:
+        print(
+            f"{item['table']}.{item['column']}: {item['from']} -> {item['to']} "
+            f"({item['sample_saving']:.0%}, ~{format_bytes(item['estimated_saved_bytes'])})",
+            file=sys.stderr
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
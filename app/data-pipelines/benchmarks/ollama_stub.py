@@ -0,0 +1,108 @@
+"""
+Stand-in for the Ollama model server
+
+Answers ``/api/generate`` with deterministic ECI scores derived from a hash
+of the prompt, after a configurable delay, so the CIQ analyzer stage can be
+run and timed without a GPU or model weights:
+
+    python benchmarks/ollama_stub.py --port 11435 --latency 0.5
+    OLLAMA_URL=http://localhost:11435 python -c "from ciq_analyzer import analyze_pending_sessions; ..."
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+COMPONENT_KEYS = ['e1', 'e2', 'e3', 'e4', 'e5', 'c6', 'c7', 'c8', 'c9', 'c10', 'i11', 'i12', 'i13', 'i14', 'i15']
+
+
+def fake_analysis(prompt: str) -> Dict[str, Any]:
+    """Stable pseudo-scores: the same prompt always gets the same answer"""
+    digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+    teacher_talk = 40 + digest[15] % 41
+    return {
+        'components': {key: round(digest[index] / 25.5, 1) for index, key in enumerate(COMPONENT_KEYS)},
+        'teacher_talk_percentage': teacher_talk,
+        'student_talk_percentage': 100 - teacher_talk,
+        'question_count': digest[16] % 12,
+        'confidence': round(0.5 + digest[17] / 510, 2)
+    }
+
+
+class StubState:
+    def __init__(self, latency: float, max_parallel: int):
+        self.latency = latency
+        self.slots = threading.BoundedSemaphore(max_parallel)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status: int, body: Dict[str, Any]):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/api/version':
+                self._send(200, {'version': 'stub'})
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/api/generate':
+                self._send(404, {'error': 'not found'})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            started = time.monotonic()
+            # Like OLLAMA_NUM_PARALLEL: requests beyond the limit queue
+            with state.slots:
+                time.sleep(state.latency)
+            with state.lock:
+                state.requests += 1
+            self._send(200, {
+                'model': request.get('model'),
+                'response': json.dumps(fake_analysis(request.get('prompt', ''))),
+                'done': True,
+                'total_duration': int((time.monotonic() - started) * 1e9)
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Deterministic stand-in for the Ollama analyzer model')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds per generate request')
+    parser.add_argument('--parallel', type=int, default=2, help='Requests served concurrently')
+    args = parser.parse_args(argv)
+
+    state = StubState(args.latency, args.parallel)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Ollama stub listening on http://{args.host}:{args.port} ({args.latency}s/request, {args.parallel} parallel)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {state.requests} generate requests")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
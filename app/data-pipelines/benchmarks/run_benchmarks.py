@@ -0,0 +1,278 @@
+"""
+ANDI ETL Benchmark Runner
+
+Seeds a scratch PostgreSQL/ClickHouse pair with synthetic CIQ data and
+measures extract, transform, validate and load throughput plus peak RSS
+for the CIQ sessions pipeline. Results are written as JSON so runs can be
+compared between commits:
+
+    python benchmarks/run_benchmarks.py --sessions 100000 --output results.json
+    python benchmarks/run_benchmarks.py --skip-seed --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'shared'))
+
+from utils import ETLMetrics, get_rss_bytes, get_peak_rss_bytes, validate_data_quality, format_bytes  # noqa: E402
+from connections import DatabaseConnections  # noqa: E402
+from batching import fetch_in_batches, postgres_fetch_controller  # noqa: E402
+from synthetic_data import SyntheticConfig, SyntheticCIQDataset, seed_postgres  # noqa: E402
+
+CIQ_SESSIONS_SCHEMA = os.path.join(
+    BENCH_DIR, '..', '..', 'data-warehouse', 'clickhouse', 'schemas', '02-facts', 'ciq_sessions.sql'
+)
+
+EXTRACT_QUERY = """
+SELECT
+    s.id, s.teacher_id, tp.school_id, sc.district_id,
+    s.recorded_at,
+    EXTRACT(EPOCH FROM (s.ended_at - s.recorded_at))::integer AS duration_seconds,
+    COALESCE(m.equity_score, 0), COALESCE(m.wait_time_avg, 0),
+    COALESCE(m.student_engagement, 0), COALESCE(m.overall_score, 0),
+    COALESCE(m.student_talk_time, 0), COALESCE(m.teacher_talk_time, 0),
+    COALESCE(m.silence_time, 0), COALESCE(m.question_count, 0),
+    COALESCE(m.response_count, 0), s.created_at
+FROM audio.audio_sessions s
+JOIN analytics.ciq_metrics m ON s.id = m.session_id
+LEFT JOIN core.teacher_profiles tp ON s.teacher_id = tp.user_id
+LEFT JOIN core.schools sc ON tp.school_id = sc.id
+WHERE s.status = 'completed'
+"""
+
+LOAD_COLUMNS = [
+    'session_id', 'teacher_id', 'school_id', 'district_id', 'session_date', 'session_timestamp',
+    'duration_seconds', 'equity_score', 'wait_time_avg', 'student_engagement', 'overall_score',
+    'student_talk_time', 'teacher_talk_time', 'silence_time', 'question_count', 'response_count',
+    'created_at', 'etl_batch_id', 'data_source'
+]
+
+VALIDATION_RULES = {
+    'required_fields': ['session_id', 'teacher_id', 'session_date'],
+    'ranges': {
+        'equity_score': (0, 100),
+        'overall_score': (0, 100),
+        'student_engagement': (0, 100)
+    }
+}
+
+NIL_UUID = '00000000-0000-0000-0000-000000000000'
+
+
+class StageTimer:
+    """Accumulates wall time and row counts for one pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+
+    def measure(self, rows: int, started: float) -> None:
+        self.seconds += time.perf_counter() - started
+        self.rows += rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rows': self.rows,
+            'seconds': round(self.seconds, 4),
+            'rows_per_second': round(self.rows / self.seconds, 1) if self.seconds > 0 else None
+        }
+
+
+class RSSSampler:
+    """Background sampler tracking the peak RSS observed during a block"""
+
+    def __init__(self, interval_seconds: float = 0.05):
+        self.interval_seconds = interval_seconds
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, get_rss_bytes())
+            self._stop.wait(self.interval_seconds)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, get_rss_bytes())
+
+
+def transform_row(row: tuple, batch_id: str) -> List[Any]:
+    """Map an extracted source row to the facts_ciq_sessions column order"""
+    (session_id, teacher_id, school_id, district_id, recorded_at, duration_seconds,
+     equity, wait_time, engagement, overall, student_talk, teacher_talk, silence,
+     questions, responses, created_at) = row
+    return [
+        session_id, teacher_id, school_id or NIL_UUID, district_id or NIL_UUID,
+        recorded_at.date(), recorded_at,
+        max(int(duration_seconds or 0), 0), float(equity), float(wait_time), float(engagement), float(overall),
+        float(student_talk), float(teacher_talk), float(silence), int(questions), int(responses),
+        created_at, batch_id, 'benchmark'
+    ]
+
+
+def ensure_clickhouse_table(client, database: str) -> None:
+    """Create facts_ciq_sessions in the benchmark database from the warehouse schema file"""
+    with open(CIQ_SESSIONS_SCHEMA) as schema_file:
+        sql = schema_file.read()
+    create_stmt = next(
+        stmt for stmt in sql.split(';') if 'CREATE TABLE IF NOT EXISTS facts_ciq_sessions' in stmt
+    )
+    create_stmt = re.sub(r'--[^\n]*', '', create_stmt).strip()
+    client.command(f'CREATE DATABASE IF NOT EXISTS {database}')
+    client.command(create_stmt.replace('facts_ciq_sessions', f'{database}.facts_ciq_sessions', 1))
+    client.command(f'TRUNCATE TABLE IF EXISTS {database}.facts_ciq_sessions')
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_pipeline(connections: DatabaseConnections, ch_database: str, metrics: ETLMetrics) -> Dict[str, Any]:
+    """Stream extract -> transform -> validate -> load, timing each stage separately"""
+    stages = {name: StageTimer(name) for name in ('extract', 'transform', 'validate', 'load')}
+    batch_id = f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    fetch_controller = postgres_fetch_controller('ciq_sessions', metrics)
+    validation_failures = 0
+    table = f'{ch_database}.facts_ciq_sessions'
+
+    with connections.get_postgres_connection() as conn, connections.get_clickhouse_connection() as client:
+        batches = fetch_in_batches(conn, EXTRACT_QUERY, controller=fetch_controller, cursor_name='bench_extract')
+        while True:
+            started = time.perf_counter()
+            raw = next(batches, None)
+            if raw is None:
+                break
+            stages['extract'].measure(len(raw), started)
+
+            started = time.perf_counter()
+            transformed = [transform_row(row, batch_id) for row in raw]
+            stages['transform'].measure(len(transformed), started)
+
+            started = time.perf_counter()
+            records = [dict(zip(LOAD_COLUMNS, row)) for row in transformed]
+            result = validate_data_quality(records, VALIDATION_RULES)
+            validation_failures += result['failed']
+            stages['validate'].measure(len(records), started)
+
+            started = time.perf_counter()
+            client.insert(table, transformed, column_names=LOAD_COLUMNS)
+            metrics.record_batch(f'clickhouse.{table}', len(transformed), 0, time.perf_counter() - started)
+            stages['load'].measure(len(transformed), started)
+
+    metrics.record_extraction(stages['extract'].rows)
+    metrics.record_transformation(stages['transform'].rows)
+    metrics.record_load(stages['load'].rows)
+
+    return {
+        'stages': {name: timer.to_dict() for name, timer in stages.items()},
+        'validation_failures': validation_failures
+    }
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """List stages whose throughput dropped more than threshold versus the baseline"""
+    regressions = []
+    for stage, result in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('rows_per_second')
+        after = result.get('rows_per_second')
+        if before and after and after < before * (1 - threshold):
+            regressions.append(f"{stage}: {before:,.0f} -> {after:,.0f} rows/s ({(after / before - 1):+.1%})")
+
+    before_rss = baseline.get('peak_rss_bytes')
+    if before_rss and current['peak_rss_bytes'] > before_rss * (1 + threshold):
+        regressions.append(
+            f"peak_rss: {format_bytes(before_rss)} -> {format_bytes(current['peak_rss_bytes'])}"
+        )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='ANDI ETL benchmark runner')
+    parser.add_argument('--sessions', type=int, default=10_000, help='Synthetic sessions to generate')
+    parser.add_argument('--districts', type=int, default=20)
+    parser.add_argument('--district-skew', type=float, default=1.1, help='Zipf exponent for district sizes')
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse data already in the scratch Postgres')
+    parser.add_argument('--clickhouse-database', default=os.getenv('BENCH_CLICKHOUSE_DB', 'andi_bench'))
+    parser.add_argument('--output', help='Write JSON results to this path (default: stdout)')
+    parser.add_argument('--baseline', help='Previous JSON result to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Regression tolerance (fraction)')
+    args = parser.parse_args(argv)
+
+    config = SyntheticConfig(
+        sessions=args.sessions,
+        districts=args.districts,
+        district_skew=args.district_skew,
+        days=args.days,
+        seed=args.seed
+    )
+    connections = DatabaseConnections()
+    metrics = ETLMetrics('etl_benchmark')
+    results: Dict[str, Any] = {
+        'benchmark': 'ciq_sessions_etl',
+        'git_commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'config': config.to_dict(),
+        'stages': {}
+    }
+
+    with RSSSampler() as sampler:
+        if not args.skip_seed:
+            started = time.perf_counter()
+            dataset = SyntheticCIQDataset(config)
+            with connections.get_postgres_connection() as conn:
+                counts = seed_postgres(conn, dataset)
+            seconds = time.perf_counter() - started
+            results['seed'] = {
+                'counts': counts,
+                'seconds': round(seconds, 4),
+                'rows_per_second': round(counts['sessions'] / seconds, 1) if seconds > 0 else None
+            }
+
+        with connections.get_clickhouse_connection() as client:
+            ensure_clickhouse_table(client, args.clickhouse_database)
+
+        results.update(run_pipeline(connections, args.clickhouse_database, metrics))
+
+    results['peak_rss_bytes'] = max(sampler.peak_bytes, get_peak_rss_bytes())
+    results['batch_sizes'] = metrics.get_batch_summary()
+
+    payload = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(payload)
+    else:
+        print(payload)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+Synthetic CIQ data generator for ANDI pipeline benchmarks
+
+Fabricates districts, schools, teachers, audio sessions and CIQ metrics
+at configurable scale with Zipf-skewed district sizes, and streams them
+into a scratch PostgreSQL database with COPY. Rows are produced lazily so
+50M-session runs never hold more than one COPY chunk in memory.
+"""
+
+import io
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+
+# Minimal source schema matching the columns the extractors read
+SOURCE_DDL = """
+CREATE SCHEMA IF NOT EXISTS core;
+CREATE SCHEMA IF NOT EXISTS audio;
+CREATE SCHEMA IF NOT EXISTS analytics;
+
+CREATE TABLE IF NOT EXISTS core.districts (
+    id UUID PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    state VARCHAR(2) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS core.schools (
+    id UUID PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    district_id UUID,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS core.teacher_profiles (
+    user_id UUID PRIMARY KEY,
+    school_id UUID,
+    years_experience INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS audio.audio_sessions (
+    id UUID PRIMARY KEY,
+    teacher_id UUID NOT NULL,
+    status VARCHAR(32) NOT NULL,
+    recorded_at TIMESTAMP NOT NULL,
+    ended_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS analytics.ciq_metrics (
+    id UUID PRIMARY KEY,
+    session_id UUID NOT NULL,
+    teacher_id UUID NOT NULL,
+    equity_score NUMERIC(5,2),
+    creativity_score NUMERIC(5,2),
+    innovation_score NUMERIC(5,2),
+    overall_score NUMERIC(5,2),
+    wait_time_avg NUMERIC(6,2),
+    student_engagement NUMERIC(5,2),
+    student_talk_time NUMERIC(10,2),
+    teacher_talk_time NUMERIC(10,2),
+    silence_time NUMERIC(10,2),
+    question_count INTEGER,
+    response_count INTEGER,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_bench_sessions_recorded_at ON audio.audio_sessions(recorded_at);
+CREATE INDEX IF NOT EXISTS idx_bench_ciq_session_id ON analytics.ciq_metrics(session_id);
+"""
+
+SOURCE_TABLES = [
+    'analytics.ciq_metrics',
+    'audio.audio_sessions',
+    'core.teacher_profiles',
+    'core.schools',
+    'core.districts',
+]
+
+STATES = ['CA', 'TX', 'NY', 'FL', 'IL', 'PA', 'OH', 'GA', 'NC', 'MI', 'WA', 'AZ']
+
+
+class SyntheticConfig:
+    """Scale and shape of a synthetic dataset"""
+
+    def __init__(
+        self,
+        sessions: int = 10_000,
+        districts: int = 20,
+        schools_per_district: int = 12,
+        teachers_per_school: int = 30,
+        district_skew: float = 1.1,
+        days: int = 180,
+        end_date: Optional[datetime] = None,
+        seed: int = 42
+    ):
+        self.sessions = sessions
+        self.districts = districts
+        self.schools_per_district = schools_per_district
+        self.teachers_per_school = teachers_per_school
+        self.district_skew = district_skew
+        self.days = days
+        self.end_date = end_date or datetime(2025, 6, 30)
+        self.seed = seed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'sessions': self.sessions,
+            'districts': self.districts,
+            'schools_per_district': self.schools_per_district,
+            'teachers_per_school': self.teachers_per_school,
+            'district_skew': self.district_skew,
+            'days': self.days,
+            'end_date': self.end_date.date().isoformat(),
+            'seed': self.seed
+        }
+
+
+class SyntheticCIQDataset:
+    """Deterministic generator for the organisational hierarchy and CIQ sessions"""
+
+    def __init__(self, config: SyntheticConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.districts: List[Tuple[str, str, str]] = []
+        self.schools: List[Tuple[str, str, str]] = []
+        self.teachers: List[Tuple[str, str, int]] = []
+        self._teacher_weights: List[float] = []
+        self._build_hierarchy()
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _district_weights(self) -> List[float]:
+        # Zipf-like skew: a few large districts, a long tail of small ones
+        raw = [1.0 / math.pow(rank, self.config.district_skew) for rank in range(1, self.config.districts + 1)]
+        total = sum(raw)
+        return [weight / total for weight in raw]
+
+    def _build_hierarchy(self) -> None:
+        cfg = self.config
+        weights = self._district_weights()
+        average_schools = cfg.schools_per_district
+
+        for index, weight in enumerate(weights):
+            district_id = self._uuid()
+            self.districts.append((district_id, f'Synthetic District {index + 1}', self.rng.choice(STATES)))
+
+            # Bigger districts get proportionally more schools (at least one)
+            school_count = max(1, round(weight * cfg.districts * average_schools))
+            for school_index in range(school_count):
+                school_id = self._uuid()
+                self.schools.append((school_id, f'School {index + 1}-{school_index + 1}', district_id))
+
+                teacher_count = max(1, int(self.rng.gauss(cfg.teachers_per_school, cfg.teachers_per_school / 4)))
+                for _ in range(teacher_count):
+                    self.teachers.append((self._uuid(), school_id, self.rng.randint(0, 35)))
+                    # Per-teacher recording frequency varies; heavy recorders exist in every district
+                    self._teacher_weights.append(self.rng.lognormvariate(0, 0.75))
+
+    def iter_sessions(self) -> Iterator[Tuple[tuple, tuple]]:
+        """Yield (audio_session_row, ciq_metrics_row) pairs"""
+        cfg = self.config
+        rng = self.rng
+        start = cfg.end_date - timedelta(days=cfg.days)
+        window_seconds = cfg.days * 86400
+        teacher_ids = [teacher[0] for teacher in self.teachers]
+        cumulative = []
+        running = 0.0
+        for weight in self._teacher_weights:
+            running += weight
+            cumulative.append(running)
+
+        # Draw teachers in chunks to keep the per-row overhead low
+        remaining = cfg.sessions
+        while remaining > 0:
+            chunk = min(remaining, 10_000)
+            remaining -= chunk
+            for teacher_id in rng.choices(teacher_ids, cum_weights=cumulative, k=chunk):
+                session_id = self._uuid()
+                recorded_at = start + timedelta(seconds=rng.randrange(window_seconds))
+                duration = rng.randint(15 * 60, 75 * 60)
+                ended_at = recorded_at + timedelta(seconds=duration)
+                created_at = ended_at + timedelta(minutes=rng.randint(1, 90))
+
+                overall = min(100.0, max(0.0, rng.gauss(74, 9)))
+                equity = min(100.0, max(0.0, overall + rng.gauss(0, 6)))
+                creativity = min(100.0, max(0.0, overall + rng.gauss(0, 7)))
+                innovation = min(100.0, max(0.0, overall + rng.gauss(0, 7)))
+                student_share = min(0.8, max(0.05, rng.gauss(0.35, 0.1)))
+                silence_share = min(0.2, max(0.0, rng.gauss(0.08, 0.03)))
+                student_talk = duration * student_share
+                silence = duration * silence_share
+                teacher_talk = max(0.0, duration - student_talk - silence)
+                questions = max(0, int(rng.gauss(duration / 90, 6)))
+
+                session_row = (session_id, teacher_id, 'completed', recorded_at, ended_at, created_at)
+                metrics_row = (
+                    self._uuid(), session_id, teacher_id,
+                    round(equity, 2), round(creativity, 2), round(innovation, 2), round(overall, 2),
+                    round(max(0.5, rng.gauss(3.2, 1.1)), 2),
+                    round(min(100.0, max(0.0, rng.gauss(70, 12))), 2),
+                    round(student_talk, 2), round(teacher_talk, 2), round(silence, 2),
+                    questions, max(0, int(questions * rng.uniform(0.5, 1.1))),
+                    created_at, created_at
+                )
+                yield session_row, metrics_row
+
+
+def _copy_rows(cursor, table: str, columns: List[str], rows: Iterator[tuple], chunk_rows: int = 100_000) -> int:
+    """COPY rows into a table in bounded-size chunks"""
+    total = 0
+    buffer = io.StringIO()
+    pending = 0
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)"
+
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+        pending += 1
+        if pending >= chunk_rows:
+            flush()
+            total += pending
+            pending = 0
+
+    if pending:
+        flush()
+        total += pending
+    return total
+
+
+def seed_postgres(conn, dataset: SyntheticCIQDataset, truncate: bool = True) -> Dict[str, int]:
+    """Create the source schema and stream the synthetic dataset into PostgreSQL"""
+    counts = {}
+    with conn.cursor() as cursor:
+        cursor.execute(SOURCE_DDL)
+        if truncate:
+            cursor.execute(f"TRUNCATE {', '.join(SOURCE_TABLES)}")
+
+        counts['districts'] = _copy_rows(cursor, 'core.districts', ['id', 'name', 'state'], iter(dataset.districts))
+        counts['schools'] = _copy_rows(cursor, 'core.schools', ['id', 'name', 'district_id'], iter(dataset.schools))
+        counts['teachers'] = _copy_rows(
+            cursor, 'core.teacher_profiles', ['user_id', 'school_id', 'years_experience'], iter(dataset.teachers)
+        )
+
+        # Sessions and metrics are written in lock-step so neither list is ever materialized
+        session_columns = ['id', 'teacher_id', 'status', 'recorded_at', 'ended_at', 'created_at']
+        metric_columns = [
+            'id', 'session_id', 'teacher_id', 'equity_score', 'creativity_score', 'innovation_score',
+            'overall_score', 'wait_time_avg', 'student_engagement', 'student_talk_time',
+            'teacher_talk_time', 'silence_time', 'question_count', 'response_count',
+            'created_at', 'updated_at'
+        ]
+        counts['sessions'] = 0
+        pending_metrics: List[tuple] = []
+        sessions_chunk: List[tuple] = []
+        for session_row, metrics_row in dataset.iter_sessions():
+            sessions_chunk.append(session_row)
+            pending_metrics.append(metrics_row)
+            if len(sessions_chunk) >= 100_000:
+                counts['sessions'] += _copy_rows(cursor, 'audio.audio_sessions', session_columns, iter(sessions_chunk))
+                _copy_rows(cursor, 'analytics.ciq_metrics', metric_columns, iter(pending_metrics))
+                sessions_chunk, pending_metrics = [], []
+        if sessions_chunk:
+            counts['sessions'] += _copy_rows(cursor, 'audio.audio_sessions', session_columns, iter(sessions_chunk))
+            _copy_rows(cursor, 'analytics.ciq_metrics', metric_columns, iter(pending_metrics))
+
+        cursor.execute('ANALYZE audio.audio_sessions')
+        cursor.execute('ANALYZE analytics.ciq_metrics')
+    conn.commit()
+    return counts
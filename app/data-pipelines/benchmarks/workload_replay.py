@@ -0,0 +1,604 @@
+"""
+ANDI Warehouse Workload Replay
+
+Captures the query families the dashboards and reports actually send to the
+warehouse, then replays them against a scratch ClickHouse built from the
+schemas in data-warehouse/clickhouse/schemas and loaded with synthetic CIQ
+data. Each run reports p50/p95/p99 latency plus rows and bytes read per
+family, so a schema, codec or projection change can be checked for latency
+regressions before it reaches production:
+
+    python benchmarks/workload_replay.py capture --days 7 --output workload.json
+    python benchmarks/workload_replay.py load --sessions 200000
+    python benchmarks/workload_replay.py replay --workload workload.json --concurrency 8 --output replay.json
+    python benchmarks/workload_replay.py replay --workload workload.json --baseline replay.json
+
+String literals in captured queries become parameters. A parameter compared
+against a column is re-bound at replay time: dates are shifted so the
+recorded window lands on the synthetic data, and ids / categories are drawn
+from the values present locally. ``capture`` also accepts a recorded .sql
+file (statements separated by ';') instead of system.query_log.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, '..', 'shared'))
+
+from utils import format_bytes  # noqa: E402
+from connections import DatabaseConnections  # noqa: E402
+from synthetic_data import SyntheticConfig, SyntheticCIQDataset  # noqa: E402
+from run_benchmarks import LOAD_COLUMNS, transform_row, git_commit  # noqa: E402
+
+SCHEMA_DIR = os.path.join(BENCH_DIR, '..', '..', 'data-warehouse', 'clickhouse', 'schemas')
+WAREHOUSE_DATABASE = 'andi_warehouse'
+
+# Replayed queries carry this log_comment so a later capture never records them
+REPLAY_COMMENT = 'andi_workload_replay'
+MAX_INSTANCES = 20
+MAX_POOL_VALUES = 1000
+
+CAPTURE_QUERY = """
+SELECT
+    toString(normalized_query_hash) as family,
+    count() as executions,
+    quantile(0.5)(query_duration_ms) as p50_ms,
+    quantile(0.99)(query_duration_ms) as p99_ms,
+    avg(read_rows) as avg_read_rows,
+    avg(read_bytes) as avg_read_bytes,
+    groupArraySample(%(samples)s)(query) as samples
+FROM system.query_log
+WHERE type = 'QueryFinish'
+  AND query_kind = 'Select'
+  AND event_date >= today() - %(days)s
+  AND has(databases, %(database)s)
+  AND NOT has(databases, 'system')
+  AND log_comment != %(replay_comment)s
+GROUP BY normalized_query_hash
+HAVING executions >= %(min_executions)s
+ORDER BY executions DESC
+LIMIT %(max_families)s
+"""
+
+LITERAL = r"'(?:[^'\\]|\\.|'')*'"
+STRING_LITERAL = re.compile(LITERAL)
+# Column on the left of the literal: col = 'x', col >= toDate('x'), col LIKE 'x', col IN ('x'
+COMPARED_COLUMN = re.compile(
+    r"([A-Za-z_][\w.]*)\s*(=|!=|<>|>=|<=|>|<|\bLIKE\b|\bIN\s*\()\s*(?:\w+\(\s*)?$", re.IGNORECASE
+)
+# ... or further along an IN list, or the upper bound of a BETWEEN
+IN_LIST_COLUMN = re.compile(
+    r"([A-Za-z_][\w.]*)\s+IN\s*\(\s*(?:" + LITERAL + r"\s*,\s*)+$", re.IGNORECASE
+)
+BETWEEN_COLUMN = re.compile(
+    r"([A-Za-z_][\w.]*)\s+BETWEEN\s+(?:\w+\(\s*)?" + LITERAL + r"\s*\)?\s+AND\s+(?:\w+\(\s*)?$", re.IGNORECASE
+)
+BETWEEN_START = re.compile(r"([A-Za-z_][\w.]*)\s+BETWEEN\s+(?:\w+\(\s*)?$", re.IGNORECASE)
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)', re.IGNORECASE)
+PLACEHOLDER = re.compile(r'\$p(\d+)\b')
+DATE_VALUE = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2}(\.\d+)?)?$')
+
+
+def parameterize(query: str) -> Tuple[str, List[Dict[str, Any]], List[str]]:
+    """Replace string literals with $pN placeholders, noting the column each one is compared to"""
+    params: List[Dict[str, Any]] = []
+    values: List[str] = []
+    parts = []
+    position = 0
+    for match in STRING_LITERAL.finditer(query):
+        prefix = query[:match.start()]
+        column, operator = None, None
+        for pattern, fixed_operator in (
+            (BETWEEN_COLUMN, 'BETWEEN'), (BETWEEN_START, 'BETWEEN'), (IN_LIST_COLUMN, 'IN'), (COMPARED_COLUMN, None)
+        ):
+            found = pattern.search(prefix)
+            if found:
+                column = found.group(1).split('.')[-1]
+                operator = fixed_operator or re.sub(r'\s*\($', '', found.group(2)).upper()
+                break
+
+        parts.append(query[position:match.start()])
+        parts.append(f'$p{len(params)}')
+        params.append({'column': column, 'operator': operator})
+        values.append(re.sub(r"\\(.)|''", lambda m: m.group(1) or "'", match.group(0)[1:-1]))
+        position = match.end()
+    parts.append(query[position:])
+    template = re.sub(r'\s+', ' ', ''.join(parts)).strip().rstrip(';')
+    return template, params, values
+
+
+def referenced_tables(template: str) -> List[str]:
+    tables = []
+    for name in TABLE_REFERENCE.findall(template):
+        table = name.split('.')[-1]
+        if table not in tables and not name.startswith('system.'):
+            tables.append(table)
+    return tables
+
+
+def build_family(family_id: str, queries: List[str], weight: int, recorded: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Group sample queries that share one template into a replayable family"""
+    template, params, instances = None, [], []
+    for query in queries:
+        query_template, query_params, values = parameterize(query)
+        if template is None:
+            template, params = query_template, query_params
+        if query_template == template and len(instances) < MAX_INSTANCES:
+            instances.append(values)
+    if template is None:
+        return None
+
+    family = {
+        'family': family_id,
+        'tables': referenced_tables(template),
+        'template': template,
+        'weight': weight,
+        'params': params,
+        'instances': instances
+    }
+    if recorded:
+        family['recorded'] = recorded
+    return family
+
+
+def capture_query_log(client, days: int, min_executions: int, max_families: int) -> List[Dict[str, Any]]:
+    """Read the busiest SELECT families against the warehouse from system.query_log"""
+    result = client.query(
+        CAPTURE_QUERY,
+        parameters={
+            'days': days, 'database': WAREHOUSE_DATABASE, 'replay_comment': REPLAY_COMMENT,
+            'min_executions': min_executions, 'max_families': max_families, 'samples': MAX_INSTANCES * 2
+        }
+    )
+    families = []
+    for row in result.result_rows:
+        record = dict(zip(result.column_names, row))
+        recorded = {
+            'executions': int(record['executions']),
+            'p50_ms': float(record['p50_ms']),
+            'p99_ms': float(record['p99_ms']),
+            'avg_read_rows': round(float(record['avg_read_rows'])),
+            'avg_read_bytes': round(float(record['avg_read_bytes']))
+        }
+        family = build_family(record['family'], record['samples'], recorded['executions'], recorded)
+        if family:
+            families.append(family)
+    return families
+
+
+def capture_recorded_file(path: str) -> List[Dict[str, Any]]:
+    """Build families from a recorded .sql file; each statement counts as one execution"""
+    with open(path) as recorded_file:
+        sql = re.sub(r'--[^\n]*', '', recorded_file.read())
+
+    grouped: Dict[str, List[str]] = {}
+    for statement in sql.split(';'):
+        statement = statement.strip()
+        if statement.upper().startswith(('SELECT', 'WITH')):
+            template = parameterize(statement)[0]
+            family_id = hashlib.blake2b(template.encode(), digest_size=8).hexdigest()
+            grouped.setdefault(family_id, []).append(statement)
+    return [
+        build_family(family_id, queries, len(queries))
+        for family_id, queries in sorted(grouped.items(), key=lambda item: -len(item[1]))
+    ]
+
+
+def schema_statements() -> List[Tuple[str, str]]:
+    """(file, statement) pairs for the DDL under data-warehouse/clickhouse/schemas, in init order"""
+    statements = []
+    for root, dirs, files in os.walk(SCHEMA_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith('.sql'):
+                continue
+            path = os.path.join(root, name)
+            with open(path) as schema_file:
+                sql = re.sub(r'--[^\n]*', '', schema_file.read())
+            for statement in sql.split(';'):
+                statement = statement.strip()
+                # Only DDL: USE/SET/CREATE DATABASE target the production warehouse, the rest is smoke checks
+                if statement.upper().startswith(('CREATE TABLE', 'CREATE VIEW', 'CREATE MATERIALIZED VIEW', 'ALTER TABLE')):
+                    statements.append((os.path.relpath(path, SCHEMA_DIR), statement))
+    return statements
+
+
+def schema_fingerprint() -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    for path, statement in schema_statements():
+        digest.update(path.encode())
+        digest.update(statement.encode())
+    return digest.hexdigest()
+
+
+def load_schema(client, database: str) -> Dict[str, Any]:
+    """Recreate the scratch database from the warehouse schema files"""
+    if database == WAREHOUSE_DATABASE:
+        raise ValueError(f"Refusing to rebuild the production database {database}")
+
+    # The client may be pointed at the scratch database itself; issue the rebuild from default
+    client.database = 'default'
+    client.command(f'DROP DATABASE IF EXISTS {database}')
+    client.command(f'CREATE DATABASE {database}')
+    client.database = database
+
+    applied, failed = 0, []
+    qualified = re.compile(rf'\b{WAREHOUSE_DATABASE}\.')
+    for path, statement in schema_statements():
+        try:
+            client.command(qualified.sub(f'{database}.', statement))
+            applied += 1
+        except Exception as e:
+            failed.append({'file': path, 'statement': statement.split('\n', 1)[0][:120], 'error': str(e)[:300]})
+    return {'applied': applied, 'failed': failed}
+
+
+def load_synthetic_data(client, database: str, config: SyntheticConfig, chunk_rows: int = 100_000) -> Dict[str, int]:
+    """Insert synthetic dimensions and CIQ session facts; aggregate MVs populate from the facts"""
+    dataset = SyntheticCIQDataset(config)
+    now = datetime.now()
+    effective_date = (config.end_date - timedelta(days=config.days)).date()
+    district_names = {district_id: name for district_id, name, _ in dataset.districts}
+    schools = {school_id: (name, district_id) for school_id, name, district_id in dataset.schools}
+
+    client.insert(
+        f'{database}.dims_districts',
+        [[district_id, name, state, effective_date, now, now] for district_id, name, state in dataset.districts],
+        column_names=['district_id', 'district_name', 'state', 'effective_date', 'created_at', 'updated_at']
+    )
+    client.insert(
+        f'{database}.dims_schools',
+        [[school_id, name, district_id, district_names[district_id], effective_date, now, now]
+         for school_id, name, district_id in dataset.schools],
+        column_names=['school_id', 'school_name', 'district_id', 'district_name', 'effective_date', 'created_at', 'updated_at']
+    )
+    teacher_rows = []
+    teacher_orgs = {}
+    for teacher_id, school_id, years in dataset.teachers:
+        school_name, district_id = schools[school_id]
+        teacher_orgs[teacher_id] = (school_id, district_id)
+        teacher_rows.append([
+            teacher_id, f'Teacher {len(teacher_rows) + 1}', school_id, school_name,
+            district_id, district_names[district_id], years, effective_date, now, now
+        ])
+    client.insert(
+        f'{database}.dims_teachers', teacher_rows,
+        column_names=['teacher_id', 'full_name', 'school_id', 'school_name', 'district_id', 'district_name',
+                      'years_experience', 'effective_date', 'created_at', 'updated_at']
+    )
+
+    batch_id = f"replay_{now.strftime('%Y%m%d_%H%M%S')}"
+    sessions = 0
+    chunk = []
+    for session_row, metrics_row in dataset.iter_sessions():
+        session_id, teacher_id, _, recorded_at, ended_at, created_at = session_row
+        school_id, district_id = teacher_orgs[teacher_id]
+        extracted = (
+            session_id, teacher_id, school_id, district_id, recorded_at,
+            int((ended_at - recorded_at).total_seconds()),
+            metrics_row[3], metrics_row[7], metrics_row[8], metrics_row[6],
+            metrics_row[9], metrics_row[10], metrics_row[11], metrics_row[12], metrics_row[13], created_at
+        )
+        chunk.append(transform_row(extracted, batch_id))
+        if len(chunk) >= chunk_rows:
+            client.insert(f'{database}.facts_ciq_sessions', chunk, column_names=LOAD_COLUMNS)
+            sessions += len(chunk)
+            chunk = []
+    if chunk:
+        client.insert(f'{database}.facts_ciq_sessions', chunk, column_names=LOAD_COLUMNS)
+        sessions += len(chunk)
+
+    return {
+        'districts': len(dataset.districts),
+        'schools': len(dataset.schools),
+        'teachers': len(dataset.teachers),
+        'sessions': sessions
+    }
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def shift_date(value: str, days: int) -> str:
+    day = datetime.strptime(value[:10], '%Y-%m-%d').date() + timedelta(days=days)
+    return day.isoformat() + value[10:]
+
+
+class ParameterBinder:
+    """Re-binds captured literals to values that exist in the scratch database"""
+
+    def __init__(self, client, database: str):
+        self.client = client
+        self.database = database
+        self._column_tables: Dict[Tuple[str, str], Optional[str]] = {}
+        self._pools: Dict[Tuple[str, str], List[str]] = {}
+        self._latest: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def _table_for(self, tables: List[str], column: str) -> Optional[str]:
+        key = (','.join(tables), column)
+        if key not in self._column_tables:
+            result = self.client.query(
+                "SELECT table FROM system.columns WHERE database = %(database)s AND name = %(column)s "
+                "AND has(%(tables)s, table) ORDER BY indexOf(%(tables)s, table) LIMIT 1",
+                parameters={'database': self.database, 'column': column, 'tables': tables}
+            )
+            self._column_tables[key] = result.result_rows[0][0] if result.result_rows else None
+        return self._column_tables[key]
+
+    def _pool(self, table: str, column: str) -> List[str]:
+        if (table, column) not in self._pools:
+            result = self.client.query(
+                f"SELECT DISTINCT toString({column}) FROM {self.database}.{table} LIMIT {MAX_POOL_VALUES}"
+            )
+            self._pools[(table, column)] = [row[0] for row in result.result_rows]
+        return self._pools[(table, column)]
+
+    def _latest_date(self, table: str, column: str) -> Optional[str]:
+        if (table, column) not in self._latest:
+            result = self.client.query(f"SELECT toString(toDate(max({column}))) FROM {self.database}.{table}")
+            latest = result.result_rows[0][0] if result.result_rows else None
+            self._latest[(table, column)] = None if latest in (None, '1970-01-01') else latest
+        return self._latest[(table, column)]
+
+    def bind(self, family: Dict[str, Any], values: List[str], rng: random.Random) -> str:
+        """Render one executable query from a recorded instance"""
+        bound = list(values)
+
+        # Move every date in the instance by the same offset, so windows keep their width
+        dates = [index for index, value in enumerate(values) if DATE_VALUE.match(value)]
+        shift = 0
+        for index in dates:
+            column = family['params'][index]['column']
+            table = column and self._table_for(family['tables'], column)
+            latest = table and self._latest_date(table, column)
+            if latest:
+                recorded_latest = max(values[i][:10] for i in dates)
+                shift = (datetime.strptime(latest, '%Y-%m-%d') - datetime.strptime(recorded_latest, '%Y-%m-%d')).days
+                break
+        for index in dates:
+            bound[index] = shift_date(values[index], shift)
+
+        for index, param in enumerate(family['params']):
+            if index in dates or param['column'] is None or param['operator'] not in ('=', '!=', '<>', 'IN'):
+                continue
+            table = self._table_for(family['tables'], param['column'])
+            pool = self._pool(table, param['column']) if table else []
+            if pool:
+                bound[index] = rng.choice(pool)
+
+        query = PLACEHOLDER.sub(lambda match: quote(bound[int(match.group(1))]), family['template'])
+        return re.sub(rf'\b{WAREHOUSE_DATABASE}\.', f'{self.database}.', query)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # Nearest-rank, so p99 of a small family is an observed latency rather than an interpolation
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    succeeded = [sample for sample in samples if sample['error'] is None]
+    latencies = sorted(sample['ms'] for sample in succeeded)
+    summary = {
+        'executions': len(samples),
+        'errors': len(samples) - len(succeeded),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+        'avg_read_rows': round(statistics.mean(s['read_rows'] for s in succeeded)) if succeeded else None,
+        'avg_read_bytes': round(statistics.mean(s['read_bytes'] for s in succeeded)) if succeeded else None
+    }
+    errors = [sample['error'] for sample in samples if sample['error']]
+    if errors:
+        summary['first_error'] = errors[0]
+    return summary
+
+
+def replay(connections: DatabaseConnections, database: str, families: List[Dict[str, Any]],
+           queries: int, concurrency: int, warmup: int, seed: int) -> Dict[str, Any]:
+    """Run a weighted, seeded sequence of family instances at the given concurrency"""
+    rng = random.Random(seed)
+    with connections.get_clickhouse_connection() as client:
+        client.database = database
+        binder = ParameterBinder(client, database)
+        plan = []
+        for family in rng.choices(families, weights=[f['weight'] for f in families], k=warmup + queries):
+            plan.append((family['family'], binder.bind(family, rng.choice(family['instances']), rng)))
+
+    local = threading.local()
+    clients = []
+    clients_lock = threading.Lock()
+    settings = {'use_query_cache': 0, 'log_comment': REPLAY_COMMENT}
+
+    def execute(item: Tuple[str, str]) -> Dict[str, Any]:
+        family_id, query = item
+        if not hasattr(local, 'client'):
+            local.context = connections.get_clickhouse_connection()
+            local.client = local.context.__enter__()
+            local.client.database = database
+            with clients_lock:
+                clients.append(local.context)
+        started = time.perf_counter()
+        try:
+            result = local.client.query(query, settings=settings)
+            summary = result.summary or {}
+            return {
+                'family': family_id, 'ms': round((time.perf_counter() - started) * 1000, 3), 'error': None,
+                'read_rows': int(summary.get('read_rows', 0)), 'read_bytes': int(summary.get('read_bytes', 0))
+            }
+        except Exception as e:
+            return {'family': family_id, 'ms': round((time.perf_counter() - started) * 1000, 3), 'error': str(e)[:300],
+                    'read_rows': 0, 'read_bytes': 0}
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(execute, plan[:warmup]))
+            started = time.perf_counter()
+            samples = list(executor.map(execute, plan[warmup:]))
+            wall_seconds = time.perf_counter() - started
+    finally:
+        for context in clients:
+            context.__exit__(None, None, None)
+
+    by_family: Dict[str, List[Dict[str, Any]]] = {}
+    for sample in samples:
+        by_family.setdefault(sample['family'], []).append(sample)
+
+    return {
+        'overall': dict(summarize(samples), wall_seconds=round(wall_seconds, 3),
+                        queries_per_second=round(len(samples) / wall_seconds, 1) if wall_seconds > 0 else None),
+        'families': {
+            family['family']: dict(summarize(by_family[family['family']]), tables=family['tables'])
+            for family in families if family['family'] in by_family
+        }
+    }
+
+
+def table_rows(client, database: str) -> Dict[str, int]:
+    result = client.query(
+        "SELECT table, sum(rows) FROM system.parts WHERE database = %(database)s AND active GROUP BY table",
+        parameters={'database': database}
+    )
+    return {table: int(rows) for table, rows in sorted(result.result_rows)}
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """List families whose tail latency or rows read grew more than threshold versus the baseline"""
+    regressions = []
+    if current.get('schema_fingerprint') != baseline.get('schema_fingerprint'):
+        print("NOTE schema changed since the baseline run", file=sys.stderr)
+
+    for family_id, result in current['families'].items():
+        before = baseline.get('families', {}).get(family_id)
+        if not before:
+            continue
+        for key in ('p95_ms', 'p99_ms'):
+            if before.get(key) and result.get(key) and result[key] > before[key] * (1 + threshold):
+                regressions.append(f"{family_id} {key}: {before[key]:.1f} -> {result[key]:.1f} ms")
+        # Rows read is deterministic for a fixed seed, so it catches lost index / projection use reliably
+        if before.get('avg_read_rows') and (result.get('avg_read_rows') or 0) > before['avg_read_rows'] * (1 + threshold):
+            regressions.append(
+                f"{family_id} read_rows: {before['avg_read_rows']:,} -> {result['avg_read_rows']:,} "
+                f"({format_bytes(before['avg_read_bytes'] or 0)} -> {format_bytes(result['avg_read_bytes'] or 0)})"
+            )
+        if result['errors'] > before.get('errors', 0):
+            regressions.append(f"{family_id} errors: {before.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def write_json(payload: Dict[str, Any], path: Optional[str]) -> None:
+    text = json.dumps(payload, indent=2, default=str)
+    if path:
+        with open(path, 'w') as output_file:
+            output_file.write(text)
+    else:
+        print(text)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='ANDI warehouse workload capture and replay')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    capture_parser = commands.add_parser('capture', help='Record query families from system.query_log or a .sql file')
+    capture_parser.add_argument('--days', type=int, default=7)
+    capture_parser.add_argument('--min-executions', type=int, default=5)
+    capture_parser.add_argument('--max-families', type=int, default=50)
+    capture_parser.add_argument('--from-file', help='Recorded .sql file to parameterize instead of query_log')
+    capture_parser.add_argument('--output', help='Write the workload JSON to this path (default: stdout)')
+
+    load_parser = commands.add_parser('load', help='Rebuild the scratch database from schemas + synthetic data')
+    load_parser.add_argument('--sessions', type=int, default=100_000)
+    load_parser.add_argument('--districts', type=int, default=20)
+    load_parser.add_argument('--district-skew', type=float, default=1.1)
+    load_parser.add_argument('--days', type=int, default=180)
+    load_parser.add_argument('--seed', type=int, default=42)
+
+    replay_parser = commands.add_parser('replay', help='Replay a captured workload against the scratch database')
+    replay_parser.add_argument('--workload', required=True)
+    replay_parser.add_argument('--queries', type=int, default=1000, help='Measured executions across all families')
+    replay_parser.add_argument('--warmup', type=int, default=50)
+    replay_parser.add_argument('--concurrency', type=int, default=4)
+    replay_parser.add_argument('--seed', type=int, default=42)
+    replay_parser.add_argument('--output', help='Write JSON results to this path (default: stdout)')
+    replay_parser.add_argument('--baseline', help='Previous replay result to compare against')
+    replay_parser.add_argument('--threshold', type=float, default=0.20, help='Regression tolerance (fraction)')
+
+    for sub in (load_parser, replay_parser):
+        sub.add_argument('--clickhouse-database', default=os.getenv('REPLAY_CLICKHOUSE_DB', 'andi_replay'))
+    args = parser.parse_args(argv)
+
+    connections = DatabaseConnections()
+
+    if args.command == 'capture':
+        if args.from_file:
+            families = capture_recorded_file(args.from_file)
+            source = args.from_file
+        else:
+            with connections.get_clickhouse_connection() as client:
+                families = capture_query_log(client, args.days, args.min_executions, args.max_families)
+            source = 'system.query_log'
+        write_json({'source': source, 'captured_at': datetime.now().isoformat(), 'families': families}, args.output)
+        return 0
+
+    if args.command == 'load':
+        config = SyntheticConfig(
+            sessions=args.sessions, districts=args.districts,
+            district_skew=args.district_skew, days=args.days, seed=args.seed
+        )
+        with connections.get_clickhouse_connection() as client:
+            schema = load_schema(client, args.clickhouse_database)
+            for failure in schema['failed']:
+                print(f"WARNING {failure['file']}: {failure['statement']}: {failure['error']}", file=sys.stderr)
+            counts = load_synthetic_data(client, args.clickhouse_database, config)
+        write_json({'schema': schema, 'loaded': counts, 'config': config.to_dict()}, None)
+        return 0
+
+    with open(args.workload) as workload_file:
+        workload = json.load(workload_file)
+    families = [family for family in workload['families'] if family.get('instances')]
+    if not families:
+        print("Workload has no replayable families", file=sys.stderr)
+        return 1
+
+    results: Dict[str, Any] = {
+        'benchmark': 'warehouse_workload_replay',
+        'git_commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'schema_fingerprint': schema_fingerprint(),
+        'workload': {'source': workload.get('source'), 'captured_at': workload.get('captured_at'), 'families': len(families)},
+        'config': {'queries': args.queries, 'warmup': args.warmup, 'concurrency': args.concurrency, 'seed': args.seed}
+    }
+    with connections.get_clickhouse_connection() as client:
+        results['table_rows'] = table_rows(client, args.clickhouse_database)
+    results.update(replay(
+        connections, args.clickhouse_database, families, args.queries, args.concurrency, args.warmup, args.seed
+    ))
+    write_json(results, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
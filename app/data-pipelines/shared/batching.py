@@ -0,0 +1,255 @@
+"""
+Adaptive streaming batcher for ANDI data pipelines
+
+Batches are sized by a row/byte budget and tuned AIMD-style (additive
+increase, multiplicative decrease) from observed insert latency and
+process memory, so each table converges on its own sweet spot. Batches
+shrink while process RSS is above ``BATCH_RSS_LIMIT_MB`` (default
+``TRANSFORM_RSS_LIMIT_MB``, else 75% of physical memory).
+"""
+
+import os
+import sys
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from utils import ETLMetrics, get_rss_bytes
+from connections import governor
+
+
+def _default_rss_limit_bytes() -> Optional[int]:
+    limit_mb = int(os.getenv('BATCH_RSS_LIMIT_MB', os.getenv('TRANSFORM_RSS_LIMIT_MB', '0')) or 0)
+    if limit_mb > 0:
+        return limit_mb * 1024 * 1024
+    try:
+        return int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.75)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+BATCH_RSS_LIMIT_BYTES = _default_rss_limit_bytes()
+# A batch closed at the byte budget overshoots it by at most its last row; only larger overshoots shrink batches
+BYTES_OVERSHOOT_MARGIN = 1.25
+
+
+def estimate_row_bytes(row: Any) -> int:
+    """Cheap approximation of the wire size of a row (dict, tuple or list)"""
+    if isinstance(row, dict):
+        values = row.values()
+    elif isinstance(row, (list, tuple)):
+        values = row
+    else:
+        return sys.getsizeof(row)
+
+    size = 0
+    for value in values:
+        if value is None:
+            size += 1
+        elif isinstance(value, (bytes, str)):
+            size += len(value)
+        elif isinstance(value, (int, float, Decimal)):
+            size += 8
+        elif isinstance(value, (datetime, date)):
+            size += 8
+        elif isinstance(value, UUID):
+            size += 16
+        elif isinstance(value, (list, tuple)):
+            size += estimate_row_bytes(value)
+        else:
+            size += len(str(value))
+    return size
+
+
+class AdaptiveBatchController:
+    """AIMD controller that picks the next batch size from observed latency and memory"""
+
+    def __init__(
+        self,
+        name: str,
+        initial_rows: int = 10_000,
+        min_rows: int = 500,
+        max_rows: int = 1_000_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        target_latency_seconds: float = 2.0,
+        memory_limit_bytes: Optional[int] = None,
+        increase_rows: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        metrics: Optional[ETLMetrics] = None
+    ):
+        self.name = name
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.target_latency_seconds = target_latency_seconds
+        self.memory_limit_bytes = memory_limit_bytes
+        self.increase_rows = increase_rows or max(min_rows, initial_rows // 4)
+        self.decrease_factor = decrease_factor
+        self.metrics = metrics
+        self.batch_size = max(min_rows, min(initial_rows, max_rows))
+        self.history: List[Dict[str, Any]] = []
+
+    def _memory_pressure(self) -> bool:
+        if not self.memory_limit_bytes:
+            return False
+        return get_rss_bytes() > self.memory_limit_bytes
+
+    def record(self, rows: int, bytes_processed: int, duration_seconds: float) -> int:
+        """Feed back one completed batch and return the next batch size"""
+        previous = self.batch_size
+        over_latency = duration_seconds > self.target_latency_seconds
+        over_bytes = bytes_processed > self.max_bytes * BYTES_OVERSHOOT_MARGIN
+
+        if over_latency or over_bytes or self._memory_pressure():
+            next_size = int(previous * self.decrease_factor)
+        elif rows >= previous:
+            # Only grow when the batch actually filled; a short final batch says nothing
+            next_size = previous + self.increase_rows
+        else:
+            next_size = previous
+
+        self.batch_size = max(self.min_rows, min(next_size, self.max_rows))
+        self.history.append({
+            'rows': rows,
+            'bytes': bytes_processed,
+            'duration_seconds': duration_seconds,
+            'next_batch_size': self.batch_size
+        })
+
+        if self.metrics is not None:
+            self.metrics.record_batch(self.name, rows, bytes_processed, duration_seconds)
+
+        return self.batch_size
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Get controller summary for logging/alerts"""
+        sizes = [entry['rows'] for entry in self.history]
+        return {
+            'name': self.name,
+            'batches': len(sizes),
+            'current_batch_size': self.batch_size,
+            'min_batch_size': min(sizes) if sizes else 0,
+            'max_batch_size': max(sizes) if sizes else 0,
+            'avg_batch_size': sum(sizes) / len(sizes) if sizes else 0
+        }
+
+
+def clickhouse_insert_controller(table: str, metrics: Optional[ETLMetrics] = None) -> AdaptiveBatchController:
+    """Controller tuned for ClickHouse inserts (large blocks, fewer parts)"""
+    return AdaptiveBatchController(
+        name=f'clickhouse.{table}',
+        initial_rows=50_000,
+        min_rows=5_000,
+        max_rows=1_000_000,
+        max_bytes=256 * 1024 * 1024,
+        target_latency_seconds=5.0,
+        memory_limit_bytes=BATCH_RSS_LIMIT_BYTES,
+        metrics=metrics
+    )
+
+
+def postgres_fetch_controller(table: str, metrics: Optional[ETLMetrics] = None) -> AdaptiveBatchController:
+    """Controller tuned for Postgres fetches (modest pages, low lock/memory impact)"""
+    return AdaptiveBatchController(
+        name=f'postgres.{table}',
+        initial_rows=5_000,
+        min_rows=500,
+        max_rows=50_000,
+        max_bytes=32 * 1024 * 1024,
+        target_latency_seconds=1.0,
+        memory_limit_bytes=BATCH_RSS_LIMIT_BYTES,
+        metrics=metrics
+    )
+
+
+def _sized_batches(
+    items: Iterable[Any],
+    controller: AdaptiveBatchController,
+    size_fn: Callable[[Any], int]
+) -> Iterator[Tuple[List[Any], int]]:
+    batch: List[Any] = []
+    batch_bytes = 0
+
+    for item in items:
+        batch.append(item)
+        batch_bytes += size_fn(item)
+        if len(batch) >= controller.batch_size or batch_bytes >= controller.max_bytes:
+            yield batch, batch_bytes
+            batch = []
+            batch_bytes = 0
+
+    if batch:
+        yield batch, batch_bytes
+
+
+def stream_batches(
+    items: Iterable[Any],
+    controller: AdaptiveBatchController,
+    size_fn: Callable[[Any], int] = estimate_row_bytes
+) -> Iterator[List[Any]]:
+    """Yield batches from any iterator, closing each at the controller's row or byte budget.
+
+    The controller's batch size is re-read for every batch, so feedback
+    recorded between batches takes effect immediately.
+    """
+    for batch, _ in _sized_batches(items, controller, size_fn):
+        yield batch
+
+
+def load_in_batches(
+    items: Iterable[Any],
+    insert_fn: Callable[[List[Any]], Any],
+    controller: AdaptiveBatchController,
+    size_fn: Callable[[Any], int] = estimate_row_bytes
+) -> int:
+    """Stream items into insert_fn in adaptively sized batches; returns rows loaded"""
+    total_rows = 0
+    for batch, batch_bytes in _sized_batches(items, controller, size_fn):
+        started = time.monotonic()
+        insert_fn(batch)
+        controller.record(len(batch), batch_bytes, time.monotonic() - started)
+        total_rows += len(batch)
+    return total_rows
+
+
+def clickhouse_batch_insert(
+    client,
+    table: str,
+    rows: Iterable[List[Any]],
+    column_names: List[str],
+    metrics: Optional[ETLMetrics] = None,
+    controller: Optional[AdaptiveBatchController] = None
+) -> int:
+    """Insert a stream of row lists into a ClickHouse table in adaptively sized blocks"""
+    controller = controller or clickhouse_insert_controller(table, metrics)
+    
+    def insert_block(batch):
+        # One governed slot per block, so waiting higher-priority inserts get in between blocks
+        with governor.slot('clickhouse', controller.metrics):
+            client.insert(table, batch, column_names=column_names)
+    
+    return load_in_batches(rows, insert_block, controller)
+
+
+def fetch_in_batches(
+    conn,
+    query: str,
+    params: Optional[Iterable[Any]] = None,
+    controller: Optional[AdaptiveBatchController] = None,
+    cursor_name: str = 'etl_stream'
+) -> Iterator[List[Any]]:
+    """Stream a Postgres query through a server-side cursor in adaptively sized pages"""
+    controller = controller or postgres_fetch_controller(cursor_name)
+    # The slot is held while the server-side cursor is open
+    with governor.slot('postgres', controller.metrics), conn.cursor(name=cursor_name) as cursor:
+        cursor.execute(query, params)
+        while True:
+            started = time.monotonic()
+            rows = cursor.fetchmany(controller.batch_size)
+            if not rows:
+                break
+            batch_bytes = sum(estimate_row_bytes(row) for row in rows)
+            controller.record(len(rows), batch_bytes, time.monotonic() - started)
+            yield rows
@@ -0,0 +1,509 @@
+"""
+Batched CIQ transcript analysis for ANDI data pipelines
+
+Drives the ``andi-ciq-analyzer`` Ollama model over sessions that have a
+transcript but no ``analytics.ciq_metrics`` row yet. Transcripts are split
+into segments that fit the model's context, and every segment is keyed by a
+content hash of (model, prompt version, text). Results already in
+``analytics.ciq_analysis_cache`` are reused without calling the model, and
+identical segments within a run are analysed once. The remaining segments
+are sent to the model endpoint through a bounded worker pool on a
+keep-alive session (``ANALYZER_CONCURRENCY``, matching ``OLLAMA_NUM_PARALLEL``).
+
+Segment scores are combined per session, weighted by segment length, and
+written back in bulk to ``analytics.ciq_metrics`` and
+``analytics.eci_component_scores``, one transaction per group of sessions.
+Sessions that cannot be scored are recorded in
+``analytics.ciq_analysis_failures``: a blank transcript is terminal at once,
+and a segment the model permanently rejects (invalid JSON, HTTP 4xx) counts
+one attempt. Sessions at ``MAX_ANALYSIS_ATTEMPTS`` for the current model and
+prompt version drop out of the pending scan, so they cannot starve new
+sessions; transient model-server failures are not counted.
+``benchmarks/ollama_stub.py`` serves deterministic fake scores in place of
+the model for local runs.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import requests
+from psycopg2.extras import Json, execute_values
+from requests.adapters import HTTPAdapter
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from resilience import call_with_retries, current_deadline, is_transient
+
+
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://host.docker.internal:11434')
+ANALYZER_MODEL = os.getenv('CIQ_ANALYZER_MODEL', 'andi-ciq-analyzer')
+ANALYZER_CONCURRENCY = int(os.getenv('ANALYZER_CONCURRENCY', '2'))
+PROMPT_VERSION = 'v1'
+
+# ~1.5k tokens per segment leaves room for the prompt and JSON answer in the 8k context
+SEGMENT_CHARS = 6000
+SESSION_GROUP_SIZE = 25
+REQUEST_TIMEOUT = (5, 300)
+# Stop starting new session groups when less than this is left before the task deadline
+GROUP_TIME_RESERVE_SECONDS = 120
+# Permanent analyzer failures before a session is skipped (until the model or prompt version changes)
+MAX_ANALYSIS_ATTEMPTS = int(os.getenv('CIQ_MAX_ANALYSIS_ATTEMPTS', '3'))
+
+COMPONENTS = {
+    'equity': [
+        ('e1', 'e1_identity_recognition'), ('e2', 'e2_psychological_safety'), ('e3', 'e3_access_equity'),
+        ('e4', 'e4_voice_elevation'), ('e5', 'e5_collaboration'),
+    ],
+    'creativity': [
+        ('c6', 'c6_self_expression'), ('c7', 'c7_experimentation'), ('c8', 'c8_active_learning'),
+        ('c9', 'c9_skill_development'), ('c10', 'c10_imagination'),
+    ],
+    'innovation': [
+        ('i11', 'i11_possibility_mindset'), ('i12', 'i12_real_world_connections'), ('i13', 'i13_change_making'),
+        ('i14', 'i14_impact_assessment'), ('i15', 'i15_continuous_improvement'),
+    ],
+}
+COMPONENT_KEYS = [key for group in COMPONENTS.values() for key, _ in group]
+
+PROMPT_TEMPLATE = """Analyze this classroom transcript segment using the ECI framework.
+
+TRANSCRIPT SEGMENT:
+{segment}
+
+Score each ECI component from 0 to 10 based only on evidence in this segment (E1-E5, C6-C10, I11-I15).
+Respond with a JSON object only:
+{{"components": {{"e1": 0, "e2": 0, "e3": 0, "e4": 0, "e5": 0, "c6": 0, "c7": 0, "c8": 0, "c9": 0, "c10": 0,
+"i11": 0, "i12": 0, "i13": 0, "i14": 0, "i15": 0}},
+"teacher_talk_percentage": 0, "student_talk_percentage": 0, "question_count": 0, "confidence": 0.0}}"""
+
+PENDING_SESSIONS_QUERY = """
+SELECT s.id, s.teacher_id, tp.user_id, s.session_date, s.transcript
+FROM core.audio_sessions s
+LEFT JOIN analytics.ciq_metrics m ON m.session_id = s.id
+LEFT JOIN core.teacher_profiles tp ON tp.user_id = s.teacher_id
+LEFT JOIN analytics.ciq_analysis_failures f ON f.session_id = s.id
+WHERE s.transcript IS NOT NULL
+  AND s.status IN ('processing', 'completed')
+  AND m.session_id IS NULL
+  AND (f.session_id IS NULL
+       OR f.attempts < %(max_attempts)s
+       OR f.llm_model_version <> %(model)s
+       OR f.prompt_version <> %(prompt_version)s)
+ORDER BY s.created_at
+LIMIT %(limit)s
+"""
+
+logger = setup_logging('ciq_analyzer')
+
+
+def split_transcript(transcript: str, max_chars: int = SEGMENT_CHARS) -> List[str]:
+    """Split on line boundaries into segments of at most ``max_chars`` (long lines split on spaces)"""
+    segments: List[str] = []
+    current: List[str] = []
+    current_chars = 0
+
+    def flush():
+        nonlocal current, current_chars
+        if current:
+            segments.append('\n'.join(current))
+        current, current_chars = [], 0
+
+    for raw_line in transcript.splitlines():
+        line = ' '.join(raw_line.split())
+        if not line:
+            continue
+        while len(line) > max_chars:
+            cut = line.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            flush()
+            segments.append(line[:cut])
+            line = line[cut:].lstrip()
+        if current_chars + len(line) + 1 > max_chars:
+            flush()
+        current.append(line)
+        current_chars += len(line) + 1
+    flush()
+    return segments
+
+
+def segment_hash(segment: str, model: str = ANALYZER_MODEL) -> str:
+    return hashlib.blake2b(f'{model}\0{PROMPT_VERSION}\0{segment}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _clamp(value: Any, upper: float) -> Optional[float]:
+    try:
+        return min(max(float(value), 0.0), upper)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_segment_result(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize a model answer to clamped component scores and participation fields"""
+    components = payload.get('components') or {}
+    return {
+        'components': {key: _clamp(components.get(key), 10.0) for key in COMPONENT_KEYS},
+        'teacher_talk_percentage': _clamp(payload.get('teacher_talk_percentage'), 100.0),
+        'student_talk_percentage': _clamp(payload.get('student_talk_percentage'), 100.0),
+        'question_count': int(_clamp(payload.get('question_count'), 10_000) or 0),
+        'confidence': _clamp(payload.get('confidence'), 1.0),
+    }
+
+
+class OllamaAnalyzer:
+    """Keep-alive client for the analyzer model with a bounded request pool"""
+
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = ANALYZER_MODEL,
+                 concurrency: int = ANALYZER_CONCURRENCY):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.concurrency = max(concurrency, 1)
+        self.endpoint = f'ollama://{self.base_url.split("://", 1)[-1]}'
+        self.session = requests.Session()
+        self.session.mount(self.base_url, HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency))
+
+    def _generate(self, segment: str) -> Dict[str, Any]:
+        try:
+            response = self.session.post(
+                f'{self.base_url}/api/generate',
+                json={
+                    'model': self.model,
+                    'prompt': PROMPT_TEMPLATE.format(segment=segment),
+                    'stream': False,
+                    'format': 'json',
+                    # Deterministic answers keep the content-hash cache valid
+                    'options': {'temperature': 0},
+                    'keep_alive': '24h'
+                },
+                timeout=REQUEST_TIMEOUT
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise ConnectionError(f"Analyzer request failed: {e}") from e
+        # Overloaded or restarting model server: retryable
+        if response.status_code == 429 or response.status_code >= 500:
+            raise ConnectionError(f"Analyzer returned HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            raise ValueError(f"Analyzer rejected request: HTTP {response.status_code}: {response.text[:200]}")
+
+        body = response.json()
+        try:
+            payload = json.loads(body['response'])
+        except (KeyError, json.JSONDecodeError) as e:
+            raise ValueError(f"Analyzer returned invalid JSON: {str(body.get('response'))[:200]}") from e
+        result = parse_segment_result(payload)
+        result['eval_ms'] = round((body.get('total_duration') or 0) / 1e6)
+        return result
+
+    def analyze(self, segment: str, metrics: Optional[ETLMetrics] = None) -> Dict[str, Any]:
+        return call_with_retries(self._generate, segment, endpoint=self.endpoint, metrics=metrics)
+
+    def analyze_many(self, segments: Dict[str, str],
+                     metrics: Optional[ETLMetrics] = None) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        """hash -> result for each segment, plus hash -> exception for segments that failed"""
+        results: Dict[str, Any] = {}
+        errors: Dict[str, Exception] = {}
+        if not segments:
+            return results, errors
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(segments)), thread_name_prefix='ciq-analyzer') as pool:
+            futures = {digest: pool.submit(self.analyze, text, metrics) for digest, text in segments.items()}
+            for digest, future in futures.items():
+                try:
+                    results[digest] = future.result()
+                except Exception as e:
+                    errors[digest] = e
+        return results, errors
+
+    def close(self):
+        self.session.close()
+
+
+def load_cached_results(conn, digests: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Cached segment results by hash; marks them used"""
+    digests = list(digests)
+    if not digests:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE analytics.ciq_analysis_cache
+            SET hits = hits + 1, last_used_at = NOW()
+            WHERE segment_hash = ANY(%s)
+            RETURNING segment_hash, result
+            """,
+            (digests,)
+        )
+        return {digest: result for digest, result in cursor.fetchall()}
+
+
+def store_cached_results(conn, results: Dict[str, Dict[str, Any]], segments: Dict[str, str], model: str) -> None:
+    rows = [
+        (digest, model, PROMPT_VERSION, len(segments[digest]), Json(result))
+        for digest, result in results.items()
+    ]
+    if not rows:
+        return
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            """
+            INSERT INTO analytics.ciq_analysis_cache (segment_hash, llm_model_version, prompt_version, segment_chars, result)
+            VALUES %s
+            ON CONFLICT (segment_hash) DO NOTHING
+            """,
+            rows
+        )
+
+
+def _weighted_mean(pairs: List[Tuple[Optional[float], int]]) -> Optional[float]:
+    scored = [(value, weight) for value, weight in pairs if value is not None]
+    total_weight = sum(weight for _, weight in scored)
+    if not total_weight:
+        return None
+    return sum(value * weight for value, weight in scored) / total_weight
+
+
+def combine_segments(results: List[Tuple[Dict[str, Any], int]]) -> Dict[str, Any]:
+    """Session scores from (segment result, segment chars) pairs"""
+    components = {
+        key: _weighted_mean([(result['components'].get(key), chars) for result, chars in results])
+        for key in COMPONENT_KEYS
+    }
+    groups = {}
+    for group, members in COMPONENTS.items():
+        values = [components[key] for key, _ in members if components[key] is not None]
+        groups[group] = sum(values) / len(values) * 10 if values else None
+    present = [value for value in components.values() if value is not None]
+
+    return {
+        'components': components,
+        'equity_score': groups['equity'],
+        'creativity_score': groups['creativity'],
+        'innovation_score': groups['innovation'],
+        'overall_score': sum(present) / len(present) * 10 if present else None,
+        'teacher_talk_percentage': _weighted_mean([(result['teacher_talk_percentage'], chars) for result, chars in results]),
+        'student_talk_percentage': _weighted_mean([(result['student_talk_percentage'], chars) for result, chars in results]),
+        'question_count': sum(result['question_count'] for result, _ in results),
+        'confidence': _weighted_mean([(result['confidence'], chars) for result, chars in results]),
+        'analysis_ms': sum(result.get('eval_ms', 0) for result, _ in results),
+    }
+
+
+def write_session_scores(conn, scored: List[Dict[str, Any]], model: str, batch_id: str) -> None:
+    """Upsert combined scores into ciq_metrics and eci_component_scores and clear earlier failure markers"""
+    now = datetime.now()
+    metrics_rows = []
+    component_rows = []
+    for session in scored:
+        scores = session['scores']
+        detailed = {
+            group: {key: scores['components'][key] for key, _ in members}
+            for group, members in COMPONENTS.items()
+        }
+        metrics_rows.append((
+            session['session_id'], session['teacher_id'], session['session_date'],
+            scores['equity_score'], scores['creativity_score'], scores['innovation_score'], scores['overall_score'],
+            scores['teacher_talk_percentage'], scores['student_talk_percentage'], scores['question_count'],
+            Json(detailed),
+            Json({'source': 'ciq_analyzer', 'model': model, 'prompt_version': PROMPT_VERSION,
+                  'segments': session['segments'], 'cached_segments': session['cached_segments'],
+                  'etl_batch_id': batch_id}),
+            now
+        ))
+        component_rows.append((
+            session['session_id'], session['profile_id'], session['session_date'],
+            *[scores['components'][key] or 0.0 for key in COMPONENT_KEYS],
+            scores['confidence'] or 0.0, scores['analysis_ms'], model,
+            Json({'prompt_version': PROMPT_VERSION, 'segments': session['segments']})
+        ))
+
+    component_columns = [column for group in COMPONENTS.values() for _, column in group]
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            """
+            INSERT INTO analytics.ciq_metrics (
+                session_id, teacher_id, calculation_date,
+                equity_score, creativity_score, innovation_score, overall_score,
+                teacher_talk_percentage, student_talk_percentage, question_count,
+                eci_detailed_scores, calculation_metadata, calculated_at
+            ) VALUES %s
+            ON CONFLICT (session_id) DO UPDATE SET
+                equity_score = EXCLUDED.equity_score,
+                creativity_score = EXCLUDED.creativity_score,
+                innovation_score = EXCLUDED.innovation_score,
+                overall_score = EXCLUDED.overall_score,
+                teacher_talk_percentage = EXCLUDED.teacher_talk_percentage,
+                student_talk_percentage = EXCLUDED.student_talk_percentage,
+                question_count = EXCLUDED.question_count,
+                eci_detailed_scores = EXCLUDED.eci_detailed_scores,
+                calculation_metadata = EXCLUDED.calculation_metadata,
+                calculated_at = EXCLUDED.calculated_at
+            """,
+            metrics_rows
+        )
+        execute_values(
+            cursor,
+            f"""
+            INSERT INTO analytics.eci_component_scores (
+                session_id, teacher_id, calculation_date, {', '.join(component_columns)},
+                analyzer_confidence, analysis_duration_ms, llm_model_version, analysis_prompts_used
+            ) VALUES %s
+            ON CONFLICT (session_id) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in component_columns)},
+                analyzer_confidence = EXCLUDED.analyzer_confidence,
+                analysis_duration_ms = EXCLUDED.analysis_duration_ms,
+                llm_model_version = EXCLUDED.llm_model_version,
+                analysis_prompts_used = EXCLUDED.analysis_prompts_used,
+                updated_at = NOW()
+            """,
+            component_rows
+        )
+        # Sessions that failed earlier and have now scored are no longer failures
+        cursor.execute(
+            "DELETE FROM analytics.ciq_analysis_failures WHERE session_id = ANY(%s::uuid[])",
+            ([str(session['session_id']) for session in scored],)
+        )
+
+
+def record_session_failures(conn, failures: List[Tuple[Any, str, int, str]], model: str) -> List[Any]:
+    """Upsert (session_id, reason, attempts, error) failures; returns the sessions now at the attempt limit"""
+    if not failures:
+        return []
+    with conn.cursor() as cursor:
+        given_up = execute_values(
+            cursor,
+            """
+            INSERT INTO analytics.ciq_analysis_failures AS f (
+                session_id, reason, attempts, last_error, llm_model_version, prompt_version
+            ) VALUES %s
+            ON CONFLICT (session_id) DO UPDATE SET
+                -- A new model or prompt version starts the count over
+                attempts = CASE
+                    WHEN f.llm_model_version = EXCLUDED.llm_model_version
+                         AND f.prompt_version = EXCLUDED.prompt_version
+                    THEN f.attempts ELSE 0
+                END + EXCLUDED.attempts,
+                reason = EXCLUDED.reason,
+                last_error = EXCLUDED.last_error,
+                llm_model_version = EXCLUDED.llm_model_version,
+                prompt_version = EXCLUDED.prompt_version,
+                last_failed_at = NOW()
+            RETURNING session_id, attempts
+            """,
+            [(session_id, reason, attempts, error[:1000], model, PROMPT_VERSION)
+             for session_id, reason, attempts, error in failures],
+            fetch=True
+        )
+    return [session_id for session_id, attempts in given_up if attempts >= MAX_ANALYSIS_ATTEMPTS]
+
+
+def analyze_session_group(conn, analyzer: OllamaAnalyzer, sessions: List[tuple],
+                          metrics: Optional[ETLMetrics], batch_id: str) -> Dict[str, int]:
+    """Analyse one group of pending sessions and write their scores in one transaction"""
+    segmented = []
+    segment_texts: Dict[str, str] = {}
+    for session_id, teacher_id, profile_id, session_date, transcript in sessions:
+        digests = []
+        for segment in split_transcript(transcript):
+            digest = segment_hash(segment, analyzer.model)
+            segment_texts[digest] = segment
+            digests.append(digest)
+        segmented.append((session_id, teacher_id, profile_id, session_date, digests))
+
+    cached = load_cached_results(conn, segment_texts)
+    missing = {digest: text for digest, text in segment_texts.items() if digest not in cached}
+    fresh, errors = analyzer.analyze_many(missing, metrics)
+    store_cached_results(conn, fresh, segment_texts, analyzer.model)
+    results = {**cached, **fresh}
+
+    scored = []
+    failures = []
+    failed = 0
+    for session_id, teacher_id, profile_id, session_date, digests in segmented:
+        if not digests:
+            failed += 1
+            failures.append((session_id, 'empty_transcript', MAX_ANALYSIS_ATTEMPTS, 'Transcript has no text'))
+            continue
+        error = next((errors[digest] for digest in digests if digest in errors), None)
+        if error is not None:
+            failed += 1
+            if metrics is not None:
+                metrics.record_error(f"session {session_id}: {error}")
+            # Model server unavailable: not the session's fault, retried next run without counting
+            if not is_transient(error):
+                failures.append((session_id, 'rejected', 1, str(error)))
+            continue
+        scored.append({
+            'session_id': session_id, 'teacher_id': teacher_id, 'profile_id': profile_id,
+            'session_date': session_date,
+            'scores': combine_segments([(results[digest], len(segment_texts[digest])) for digest in digests]),
+            'segments': len(digests),
+            'cached_segments': sum(1 for digest in digests if digest in cached)
+        })
+
+    if scored:
+        write_session_scores(conn, scored, analyzer.model, batch_id)
+    given_up = record_session_failures(conn, failures, analyzer.model)
+    conn.commit()
+    if given_up:
+        logger.warning(f"Skipping {len(given_up)} sessions after {MAX_ANALYSIS_ATTEMPTS} failed analyses: {given_up}")
+    return {
+        'sessions_scored': len(scored),
+        'sessions_failed': failed,
+        'segments': len(segment_texts),
+        'segments_cached': len(cached),
+        'segments_analyzed': len(fresh)
+    }
+
+
+def analyze_pending_sessions(
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    max_sessions: int = 200,
+    analyzer: Optional[OllamaAnalyzer] = None,
+    connections=None
+) -> Dict[str, int]:
+    """Score up to ``max_sessions`` pending sessions, group by group, until the task deadline nears"""
+    connections = connections or db_connections
+    owns_analyzer = analyzer is None
+    analyzer = analyzer or OllamaAnalyzer()
+    deadline = current_deadline()
+    totals = {'sessions_scored': 0, 'sessions_failed': 0, 'segments': 0, 'segments_cached': 0, 'segments_analyzed': 0}
+
+    try:
+        with connections.get_postgres_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(PENDING_SESSIONS_QUERY, {
+                    'max_attempts': MAX_ANALYSIS_ATTEMPTS,
+                    'model': analyzer.model,
+                    'prompt_version': PROMPT_VERSION,
+                    'limit': max_sessions
+                })
+                pending = cursor.fetchall()
+            conn.commit()
+            if metrics is not None:
+                metrics.record_extraction(len(pending))
+
+            for start in range(0, len(pending), SESSION_GROUP_SIZE):
+                if deadline.remaining() < GROUP_TIME_RESERVE_SECONDS:
+                    logger.warning(f"Stopping analysis with {len(pending) - start} sessions left: task deadline near")
+                    break
+                started = time.monotonic()
+                group = analyze_session_group(conn, analyzer, pending[start:start + SESSION_GROUP_SIZE], metrics, batch_id)
+                for key, value in group.items():
+                    totals[key] += value
+                if metrics is not None:
+                    metrics.record_batch('ciq_analyzer', group['sessions_scored'],
+                                         duration_seconds=time.monotonic() - started)
+                logger.info(f"Analyzed session group: {group}")
+    finally:
+        if owns_analyzer:
+            analyzer.close()
+
+    if metrics is not None:
+        metrics.record_load(totals['sessions_scored'])
+    return totals
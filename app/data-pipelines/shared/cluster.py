@@ -0,0 +1,261 @@
+"""
+Shard-aware ClickHouse insert routing for ANDI data pipelines
+
+When ``CLICKHOUSE_SHARDS`` is set, loaders write sharded fact tables
+directly into each shard's local table instead of through a ``Distributed``
+table, which would buffer and forward every block a second time. Rows are
+grouped by the table's sharding key, mapped to shards with the same
+expression and weights the ``Distributed`` tables use, and each shard's
+rows are inserted on one of its replicas (replication copies them to the
+rest). Replicas that fail are put on a short cooldown and the next replica
+is tried; shards are loaded concurrently, with a per-shard cap on
+in-flight inserts, and every block still takes a ``governor`` ClickHouse
+slot at the caller's ``work_priority``.
+
+``CLICKHOUSE_SHARDS`` lists shards separated by ``;`` and each shard's
+replicas by ``,``, e.g. ``ch-s1r1:8123,ch-s1r2:8123;ch-s2r1:8123,ch-s2r2:8123``.
+Optional ``CLICKHOUSE_SHARD_WEIGHTS`` (``1,1``) mirrors ``<weight>`` in the
+cluster config. Without ``CLICKHOUSE_SHARDS`` everything goes to the single
+configured host as before.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import clickhouse_connect
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections, governor
+from batching import clickhouse_batch_insert, clickhouse_insert_controller, load_in_batches
+
+
+# table -> sharding key column; must match clickhouse/cluster/02-distributed-tables.sql
+SHARDED_TABLES = {
+    'facts_ciq_sessions': 'district_id',
+    'facts_resource_usage': 'user_district_id',
+    'facts_community_activity': 'user_district_id',
+}
+# ClickHouse expression applied to each key, identical to the Distributed sharding_key
+SHARDING_EXPRESSION = 'cityHash64(toUUID(key))'
+
+REPLICA_COOLDOWN_SECONDS = 60.0
+MAX_INSERTS_PER_SHARD = 2
+
+NIL_UUID = '00000000-0000-0000-0000-000000000000'
+
+logger = setup_logging('cluster')
+
+
+def _shard_key(value: Any) -> str:
+    # Missing keys land in the non-Nullable UUID column as the nil UUID
+    return NIL_UUID if value is None else str(value)
+
+
+class Replica:
+    """One shard replica and its failure cooldown"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.unavailable_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+    def mark_failed(self):
+        self.unavailable_until = time.monotonic() + REPLICA_COOLDOWN_SECONDS
+
+    def __repr__(self) -> str:
+        return f'{self.host}:{self.port}'
+
+
+class ClickHouseCluster:
+    """Routes inserts for sharded tables to the owning shard's replicas"""
+
+    def __init__(
+        self,
+        shards: List[List[Tuple[str, int]]],
+        weights: Optional[List[int]] = None,
+        base_config: Optional[Dict[str, Any]] = None,
+        max_inserts_per_shard: int = MAX_INSERTS_PER_SHARD
+    ):
+        if not shards or not all(shards):
+            raise ValueError("Cluster needs at least one shard with at least one replica")
+        weights = weights or [1] * len(shards)
+        if len(weights) != len(shards) or min(weights) < 1:
+            raise ValueError(f"Need one positive weight per shard, got {weights} for {len(shards)} shards")
+
+        self.shards = [[Replica(host, port) for host, port in replicas] for replicas in shards]
+        self.weights = weights
+        self.base_config = base_config or db_connections.clickhouse_config
+        self._slot_owner = [index for index, weight in enumerate(weights) for _ in range(weight)]
+        self._shard_slots = [threading.BoundedSemaphore(max_inserts_per_shard) for _ in shards]
+        self._shard_cache: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional['ClickHouseCluster']:
+        spec = os.getenv('CLICKHOUSE_SHARDS', '').strip()
+        if not spec:
+            return None
+        shards = []
+        for shard_spec in spec.split(';'):
+            replicas = []
+            for replica in filter(None, (part.strip() for part in shard_spec.split(','))):
+                host, _, port = replica.partition(':')
+                replicas.append((host, int(port or db_connections.clickhouse_config['port'])))
+            shards.append(replicas)
+        weights_spec = os.getenv('CLICKHOUSE_SHARD_WEIGHTS', '').strip()
+        weights = [int(weight) for weight in weights_spec.split(',')] if weights_spec else None
+        return cls(shards, weights)
+
+    def _connect(self, shard_index: int) -> Tuple[Replica, Any]:
+        """Client on the first reachable replica of a shard, skipping replicas in cooldown"""
+        replicas = self.shards[shard_index]
+        candidates = [replica for replica in replicas if replica.available] or replicas
+        last_error = None
+        for replica in candidates:
+            try:
+                client = clickhouse_connect.get_client(**{**self.base_config, 'host': replica.host, 'port': replica.port})
+                return replica, client
+            except Exception as e:
+                last_error = e
+                replica.mark_failed()
+                logger.warning(f"Shard {shard_index + 1} replica {replica} unavailable: {e}")
+        raise ConnectionError(f"No reachable replica for shard {shard_index + 1}: {last_error}")
+
+    @contextmanager
+    def shard_client(self, shard_index: int):
+        _, client = self._connect(shard_index)
+        try:
+            yield client
+        finally:
+            client.close()
+
+    def resolve_shards(self, keys: Iterable[Any], client=None) -> Dict[str, int]:
+        """key -> shard index, computed by ClickHouse so it matches the Distributed tables exactly"""
+        keys = {_shard_key(key) for key in keys}
+        missing = sorted(keys - self._shard_cache.keys())
+        if missing:
+            query = f"""
+            SELECT key, {SHARDING_EXPRESSION} % {len(self._slot_owner)} as slot
+            FROM (SELECT arrayJoin(%(keys)s) as key)
+            """
+            if client is not None:
+                result = client.query(query, parameters={'keys': missing})
+            else:
+                with self.shard_client(0) as shard_client:
+                    result = shard_client.query(query, parameters={'keys': missing})
+            for key, slot in result.result_rows:
+                self._shard_cache[key] = self._slot_owner[slot]
+        return {key: self._shard_cache[key] for key in keys}
+
+    def _insert_shard(
+        self,
+        shard_index: int,
+        table: str,
+        rows: List[Any],
+        column_names: List[str],
+        metrics: Optional[ETLMetrics]
+    ) -> int:
+        controller = clickhouse_insert_controller(f'{table}@shard{shard_index + 1}', metrics)
+        loaded = 0
+        last_error = None
+
+        with self._shard_slots[shard_index]:
+            for attempt in range(len(self.shards[shard_index])):
+                replica, client = self._connect(shard_index)
+
+                def insert_block(block, client=client):
+                    nonlocal loaded
+                    # Shard threads share the process-wide ClickHouse slots with every other loader
+                    with governor.slot('clickhouse', controller.metrics):
+                        client.insert(table, block, column_names=column_names)
+                    loaded += len(block)
+
+                try:
+                    # Resume after the last acknowledged block; the failed block is resent unchanged,
+                    # so replicated-table insert deduplication drops it if it did land
+                    load_in_batches(rows[loaded:], insert_block, controller)
+                    return loaded
+                except Exception as e:
+                    last_error = e
+                    replica.mark_failed()
+                    logger.warning(
+                        f"Insert into {table} on shard {shard_index + 1} replica {replica} failed "
+                        f"after {loaded:,} rows (attempt {attempt + 1}): {e}"
+                    )
+                finally:
+                    client.close()
+
+        raise ConnectionError(f"All replicas of shard {shard_index + 1} failed for {table}: {last_error}")
+
+    def insert(
+        self,
+        table: str,
+        rows: Iterable[List[Any]],
+        column_names: List[str],
+        shard_column: Optional[str] = None,
+        metrics: Optional[ETLMetrics] = None
+    ) -> int:
+        """Split rows by owning shard and insert each group on that shard concurrently"""
+        shard_column = shard_column or SHARDED_TABLES[table]
+        key_index = column_names.index(shard_column)
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        owners = self.resolve_shards(row[key_index] for row in rows)
+        by_shard: Dict[int, List[Any]] = {}
+        for row in rows:
+            by_shard.setdefault(owners[_shard_key(row[key_index])], []).append(row)
+
+        with ThreadPoolExecutor(max_workers=len(by_shard), thread_name_prefix='ch-shard') as executor:
+            # Each shard thread runs in a copy of the caller's context, so work_priority carries over
+            futures = {
+                shard_index: executor.submit(
+                    contextvars.copy_context().run,
+                    self._insert_shard, shard_index, table, shard_rows, column_names, metrics
+                )
+                for shard_index, shard_rows in by_shard.items()
+            }
+            loaded = {shard_index: future.result() for shard_index, future in futures.items()}
+
+        logger.info(
+            f"Routed {sum(loaded.values()):,} rows into {table} across {len(loaded)} shards: "
+            + ', '.join(f'shard {index + 1}={count:,}' for index, count in sorted(loaded.items()))
+        )
+        return sum(loaded.values())
+
+
+_cluster: Optional[ClickHouseCluster] = None
+_cluster_loaded = False
+
+
+def get_cluster() -> Optional[ClickHouseCluster]:
+    """Process-wide cluster router, or None when running against a single host"""
+    global _cluster, _cluster_loaded
+    if not _cluster_loaded:
+        _cluster = ClickHouseCluster.from_env()
+        _cluster_loaded = True
+    return _cluster
+
+
+def routed_insert(
+    client,
+    table: str,
+    rows: Iterable[List[Any]],
+    column_names: List[str],
+    metrics: Optional[ETLMetrics] = None,
+    controller=None
+) -> int:
+    """Insert through the shard router for sharded tables on a cluster, else into ``client``"""
+    cluster = get_cluster()
+    if cluster is not None and table in SHARDED_TABLES:
+        return cluster.insert(table, rows, column_names, metrics=metrics)
+    return clickhouse_batch_insert(client, table, rows, column_names, metrics=metrics, controller=controller)
@@ -1,12 +1,139 @@
 """
 Database connections and utilities for ANDI data pipelines
+
+Heavy work is governed at two levels. Across workers, the Airflow pools in
+AIRFLOW_POOLS cap how many heavy tasks run against each database, and the
+hourly sync's higher priority_weight lets it take a free slot before bulk
+daily/backfill tasks. Within a task process, ``governor`` caps concurrent
+heavy reads and inserts per database (threads wait by priority, then
+arrival) and reports the time spent queued as a ``queue_wait.<db>`` stage.
 """
 
+import heapq
+import itertools
 import os
+import threading
+import time
 import psycopg2
 import clickhouse_connect
 from typing import Optional, Dict, Any
 from contextlib import contextmanager
+from contextvars import ContextVar
+
+from resilience import call_with_retries
+from utils import setup_logging
+
+logger = setup_logging('connections')
+
+
+# Airflow pools: name -> (slots, description)
+AIRFLOW_POOLS = {
+    'andi_postgres': (
+        int(os.getenv('ANDI_POSTGRES_POOL_SLOTS', '4')),
+        'Heavy reads against the Postgres primary (extracts, syncs, event streams)'
+    ),
+    'andi_clickhouse': (
+        int(os.getenv('ANDI_CLICKHOUSE_POOL_SLOTS', '6')),
+        'Heavy ClickHouse inserts, rebuilds and maintenance'
+    ),
+    'andi_ollama': (
+        int(os.getenv('ANDI_OLLAMA_POOL_SLOTS', '1')),
+        'CIQ transcript analysis against the local model server'
+    ),
+}
+
+# Lower value is served first, in Airflow priority_weight terms the reverse
+PRIORITY_SYNC = 0
+PRIORITY_BULK = 10
+SYNC_PRIORITY_WEIGHT = 10
+BULK_PRIORITY_WEIGHT = 1
+
+# Concurrent heavy operations per database within one process
+HEAVY_CONCURRENCY = {
+    'postgres': int(os.getenv('ANDI_POSTGRES_HEAVY_CONCURRENCY', '2')),
+    'clickhouse': int(os.getenv('ANDI_CLICKHOUSE_HEAVY_CONCURRENCY', '4')),
+}
+QUEUE_WAIT_LOG_SECONDS = 1.0
+
+_work_priority: ContextVar[int] = ContextVar('andi_work_priority', default=PRIORITY_BULK)
+
+
+@contextmanager
+def work_priority(priority: int):
+    """Run the block's governed operations at ``priority`` (PRIORITY_SYNC or PRIORITY_BULK)"""
+    token = _work_priority.set(priority)
+    try:
+        yield
+    finally:
+        _work_priority.reset(token)
+
+
+class PriorityGate:
+    """Counting semaphore that admits waiters by (priority, arrival order)"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 1)
+        self._in_use = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+    
+    def acquire(self, priority: int) -> float:
+        """Block until admitted; returns seconds spent waiting"""
+        started = time.monotonic()
+        with self._condition:
+            if self._in_use < self.capacity and not self._waiters:
+                self._in_use += 1
+                return 0.0
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                self._condition.wait_for(lambda: self._waiters[0] == entry and self._in_use < self.capacity)
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self._in_use += 1
+            # The next waiter may also fit if several slots freed at once
+            self._condition.notify_all()
+        return time.monotonic() - started
+    
+    def release(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify_all()
+
+
+class ConcurrencyGovernor:
+    """Per-database caps on concurrent heavy operations in this process"""
+    
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        self._gates = {database: PriorityGate(limit) for database, limit in (limits or HEAVY_CONCURRENCY).items()}
+        self._lock = threading.Lock()
+        self.wait_seconds: Dict[str, float] = {database: 0.0 for database in self._gates}
+    
+    @contextmanager
+    def slot(self, database: str, metrics=None, priority: Optional[int] = None):
+        """Hold one heavy-operation slot for ``database`` for the duration of the block"""
+        gate = self._gates[database]
+        waited = gate.acquire(_work_priority.get() if priority is None else priority)
+        if waited:
+            with self._lock:
+                self.wait_seconds[database] += waited
+            if metrics is not None:
+                metrics.record_stage_time(f'queue_wait.{database}', waited)
+            if waited >= QUEUE_WAIT_LOG_SECONDS:
+                logger.info(f"Waited {waited:.1f}s for a {database} heavy-operation slot")
+        try:
+            yield
+        finally:
+            gate.release()
+
+
+# Process-wide governor used by the batched readers and loaders
+governor = ConcurrencyGovernor()
 
 
 class DatabaseConnections:
@@ -42,12 +169,22 @@ class DatabaseConnections:
             }
         return self._ch_config
     
+    @property
+    def postgres_endpoint(self) -> str:
+        """Circuit breaker key for the PostgreSQL server"""
+        return f"postgres://{self.postgres_config['host']}:{self.postgres_config['port']}"
+    
+    @property
+    def clickhouse_endpoint(self) -> str:
+        """Circuit breaker key for the ClickHouse server"""
+        return f"clickhouse://{self.clickhouse_config['host']}:{self.clickhouse_config['port']}"
+    
     @contextmanager
     def get_postgres_connection(self):
-        """Get PostgreSQL connection context manager"""
+        """Get PostgreSQL connection context manager (connect retried with jittered backoff)"""
         conn = None
         try:
-            conn = psycopg2.connect(**self.postgres_config)
+            conn = call_with_retries(psycopg2.connect, endpoint=self.postgres_endpoint, **self.postgres_config)
             yield conn
         finally:
             if conn:
@@ -55,10 +192,12 @@ class DatabaseConnections:
     
     @contextmanager
     def get_clickhouse_connection(self):
-        """Get ClickHouse connection context manager"""
+        """Get ClickHouse connection context manager (connect retried with jittered backoff)"""
         client = None
         try:
-            client = clickhouse_connect.get_client(**self.clickhouse_config)
+            client = call_with_retries(
+                clickhouse_connect.get_client, endpoint=self.clickhouse_endpoint, **self.clickhouse_config
+            )
             yield client
         finally:
             if client:
@@ -115,6 +254,22 @@ def get_clickhouse_hook():
         return None
 
 
+def create_airflow_pools():
+    """Create or resize the Airflow pools used by heavy pipeline tasks"""
+    try:
+        from airflow.models import Pool
+        
+        for name, (slots, description) in AIRFLOW_POOLS.items():
+            Pool.create_or_update_pool(name=name, slots=slots, description=description, include_deferred=False)
+        
+        print(f"Airflow pools ready: {', '.join(f'{name}={slots}' for name, (slots, _) in AIRFLOW_POOLS.items())}")
+        
+    except ImportError:
+        print("Airflow not available, skipping pool creation")
+    except Exception as e:
+        print(f"Failed to create Airflow pools: {e}")
+
+
 def create_airflow_connections():
     """Create Airflow connections programmatically"""
     try:
@@ -176,5 +331,6 @@ if __name__ == '__main__':
         status = "✅ SUCCESS" if success else "❌ FAILED"
         print(f"{db}: {status}")
     
-    # Create Airflow connections
-    create_airflow_connections()
\ No newline at end of file
+    # Create Airflow connections and pools
+    create_airflow_connections()
+    create_airflow_pools()
\ No newline at end of file
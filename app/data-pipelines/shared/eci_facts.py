@@ -0,0 +1,317 @@
+"""
+ECI facts loader for ANDI data pipelines
+
+Extracts the 15 ECI component scores (E1-E5, C6-C10, I11-I15) with their
+SIS/LMS, survey and adaptive-weight context from PostgreSQL, derives the
+group averages, weighted scores and performance tier column-wise with
+pandas, and loads ``facts_ciq_comprehensive`` in large column-oriented
+blocks. ``mv_realtime_ciq_dashboard`` fires once per inserted block, so
+transformed pages are accumulated up to the insert controller's block size
+before each insert rather than being written page by page.
+
+In coalesce mode (used by the hourly sync) the whole run is sorted by the
+dashboard aggregate key before it is inserted, so each
+``(metric_date, classroom_sk, teacher_sk)`` produces one aggregate row per
+run instead of one per block. The sort runs within the transform memory
+budget and spills sorted runs to local disk for large days; the merged
+output is inserted in blocks sized from the same budget.
+
+Loads of the same date are serialized with a PostgreSQL advisory lock,
+since skipping already-loaded sessions is a read-then-insert check.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from batching import clickhouse_insert_controller, postgres_fetch_controller, fetch_in_batches
+from surrogate_keys import get_key_service
+from memory_budget import ExternalSorter
+
+
+FACTS_TABLE = 'facts_ciq_comprehensive'
+
+ECI_COMPONENTS = {
+    'equity': [
+        'e1_identity_recognition', 'e2_psychological_safety', 'e3_access_equity',
+        'e4_voice_elevation', 'e5_collaboration'
+    ],
+    'creativity': [
+        'c6_self_expression', 'c7_experimentation', 'c8_active_learning',
+        'c9_skill_development', 'c10_imagination'
+    ],
+    'innovation': [
+        'i11_possibility_mindset', 'i12_real_world_connections', 'i13_change_making',
+        'i14_impact_assessment', 'i15_continuous_improvement'
+    ]
+}
+COMPONENT_COLUMNS = [column for columns in ECI_COMPONENTS.values() for column in columns]
+
+# Defaults from analytics.ciq_adaptive_weights, used when a classroom has no active config
+DEFAULT_WEIGHTS = {
+    'sis_lms_weight': 0.5,
+    'survey_weight': 0.2,
+    'eci_blueprint_weight': 0.3,
+    'equity_component_weight': 0.333,
+    'creativity_component_weight': 0.333,
+    'innovation_component_weight': 0.334
+}
+
+SURVEY_COLUMNS = [
+    'teacher_confidence', 'teacher_satisfaction', 'perceived_student_engagement',
+    'student_wellbeing', 'student_belonging', 'learning_effectiveness'
+]
+
+SOURCE_COLUMNS = [
+    'session_id', 'classroom_id', 'teacher_id', 'session_date',
+    'overall_ciq_score', 'equity_score', 'creativity_score', 'innovation_score',
+    *COMPONENT_COLUMNS,
+    'class_average_grade', 'attendance_rate', 'positive_behavior_ratio',
+    *SURVEY_COLUMNS,
+    'teacher_talk_percentage', 'student_talk_percentage', 'total_questions', 'wait_time_avg',
+    *DEFAULT_WEIGHTS,
+    'analyzer_confidence', 'transcript_quality_score', 'analysis_duration_ms',
+    'subject_area', 'academic_year'
+]
+
+EXTRACT_QUERY = f"""
+SELECT DISTINCT ON (v.session_id)
+    v.session_id, v.classroom_id, v.teacher_id, v.calculation_date,
+    v.legacy_overall_score, v.legacy_equity_score, v.legacy_creativity_score, v.legacy_innovation_score,
+    {', '.join(f'v.{column}' for column in COMPONENT_COLUMNS)},
+    v.avg_class_grade, v.attendance_rate, v.positive_behavior_ratio,
+    v.teacher_confidence_avg, v.teacher_satisfaction_avg, v.perceived_engagement_avg,
+    v.student_wellbeing_avg, v.student_belonging_avg, v.learning_effectiveness_avg,
+    v.teacher_talk_percentage, v.student_talk_percentage, v.question_count, v.wait_time_avg,
+    {', '.join(f'v.{column}' for column in DEFAULT_WEIGHTS)},
+    v.analyzer_confidence, v.transcript_quality_score, ecs.analysis_duration_ms,
+    v.subject, v.academic_year
+FROM analytics.ciq_comprehensive_view v
+JOIN analytics.eci_component_scores ecs ON ecs.session_id = v.session_id
+WHERE v.calculation_date = %s
+ORDER BY v.session_id
+"""
+
+FACT_COLUMNS = [
+    'session_date', 'session_sk', 'classroom_sk', 'teacher_sk',
+    'session_id', 'classroom_id', 'teacher_id',
+    'academic_year', 'semester', 'month', 'week', 'day_of_week',
+    'overall_ciq_score', 'equity_score', 'creativity_score', 'innovation_score',
+    *ECI_COMPONENTS['equity'], 'equity_avg',
+    *ECI_COMPONENTS['creativity'], 'creativity_avg',
+    *ECI_COMPONENTS['innovation'], 'innovation_avg',
+    'teacher_talk_percentage', 'student_talk_percentage', 'total_questions', 'wait_time_avg',
+    'class_average_grade', 'attendance_rate', 'positive_behavior_ratio',
+    *SURVEY_COLUMNS,
+    *DEFAULT_WEIGHTS,
+    'weighted_ciq_score', 'weighted_equity_score', 'weighted_creativity_score', 'weighted_innovation_score',
+    'transcript_quality_score', 'analyzer_confidence', 'data_completeness_score', 'analysis_duration_ms',
+    'subject_area', 'performance_tier', 'trend_direction'
+]
+
+FLOAT_COLUMNS = [
+    'overall_ciq_score', 'equity_score', 'creativity_score', 'innovation_score', *COMPONENT_COLUMNS,
+    'class_average_grade', 'attendance_rate', 'positive_behavior_ratio', *SURVEY_COLUMNS,
+    'teacher_talk_percentage', 'student_talk_percentage', 'wait_time_avg',
+    'analyzer_confidence', 'transcript_quality_score'
+]
+
+# Inputs counted towards data_completeness_score
+COMPLETENESS_COLUMNS = [
+    *COMPONENT_COLUMNS, 'class_average_grade', 'attendance_rate', 'positive_behavior_ratio', *SURVEY_COLUMNS
+]
+
+# Grouping key of mv_realtime_ciq_dashboard -> aggregates_daily_ciq_metrics
+AGGREGATE_KEY = ['session_date', 'classroom_sk', 'teacher_sk']
+
+# Upper bound on rows per coalesced insert block; blocks are also held to half the
+# transform memory budget, leaving the rest for the merge and the insert buffer
+COALESCE_MAX_ROWS = 2_000_000
+
+logger = setup_logging('eci_facts')
+
+
+def _semester(months: np.ndarray) -> np.ndarray:
+    return np.select([months >= 8, months <= 5], ['Fall', 'Spring'], default='Summer')
+
+
+def transform_eci_batch(rows: List[tuple]) -> pd.DataFrame:
+    """Derive averages, weighted scores and time attributes for a page of source rows"""
+    df = pd.DataFrame.from_records(rows, columns=SOURCE_COLUMNS, coerce_float=True)
+    completeness = df[COMPLETENESS_COLUMNS].notna().mean(axis=1)
+
+    df[FLOAT_COLUMNS] = df[FLOAT_COLUMNS].astype('float64').fillna(0.0)
+    for column, default in DEFAULT_WEIGHTS.items():
+        df[column] = df[column].astype('float64').fillna(default)
+
+    for group, columns in ECI_COMPONENTS.items():
+        df[f'{group}_avg'] = df[columns].mean(axis=1)
+
+    # Same blend as analytics.ciq_comprehensive_view: 0-10 component averages are scaled to 0-100
+    sis_lms_score = (
+        df['class_average_grade'] * 0.15
+        + df['attendance_rate'] * 100 * 0.05
+        + df['positive_behavior_ratio'] * 100 * 0.10
+    )
+    survey_score = df[SURVEY_COLUMNS].sum(axis=1) * 2 / len(SURVEY_COLUMNS)
+    for group in ECI_COMPONENTS:
+        df[f'weighted_{group}_score'] = (
+            df[f'{group}_avg'] * 10 * df[f'{group}_component_weight'] * df['eci_blueprint_weight']
+        )
+    eci_score = df['weighted_equity_score'] + df['weighted_creativity_score'] + df['weighted_innovation_score']
+    df['weighted_ciq_score'] = (
+        sis_lms_score * df['sis_lms_weight'] + survey_score * df['survey_weight'] + eci_score
+    ).round(2)
+
+    score = df['weighted_ciq_score'].to_numpy()
+    df['performance_tier'] = np.select(
+        [score >= 85, score >= 75, score >= 65], ['excellent', 'good', 'developing'], default='needs_support'
+    )
+    df['trend_direction'] = 'stable'
+    df['data_completeness_score'] = completeness
+
+    session_dates = pd.to_datetime(df['session_date'])
+    df['session_date'] = session_dates.dt.date
+    df['month'] = session_dates.dt.month.astype('uint8')
+    df['week'] = session_dates.dt.isocalendar().week.astype('uint8').to_numpy()
+    df['day_of_week'] = (session_dates.dt.dayofweek + 1).astype('uint8')
+    df['semester'] = _semester(df['month'].to_numpy())
+
+    df['total_questions'] = df['total_questions'].fillna(0).astype('uint32')
+    df['analysis_duration_ms'] = df['analysis_duration_ms'].fillna(0).astype('uint32')
+    for column in ('session_id', 'classroom_id', 'teacher_id', 'subject_area', 'academic_year'):
+        df[column] = df[column].fillna('').astype(str)
+    return df
+
+
+def assign_surrogate_keys(df: pd.DataFrame, batch_id: str = '') -> pd.DataFrame:
+    """Fill session_sk/teacher_sk/classroom_sk; rows without a natural key get 0"""
+    for key_type in ('session', 'teacher', 'classroom'):
+        natural_keys = df[f'{key_type}_id']
+        present = (natural_keys != '').to_numpy()
+        surrogates = np.zeros(len(df), dtype=np.uint64)
+        if present.any():
+            surrogates[present] = get_key_service(key_type).resolve(natural_keys[present], batch_id=batch_id)
+        df[f'{key_type}_sk'] = surrogates
+    return df
+
+
+def _insert_block(
+    client,
+    frames: List[pd.DataFrame],
+    controller,
+    coalesce: bool = False
+) -> int:
+    block = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    settings = None
+    if coalesce:
+        # Blocks arrive sorted by AGGREGATE_KEY; keep the server from re-splitting
+        # the block, which would split aggregate groups again
+        settings = {'max_insert_block_size': max(len(block), 1_048_576)}
+    # Column arrays as-is: per-column Python lists would roughly double the block in memory
+    data = [block[column].to_numpy() for column in FACT_COLUMNS]
+
+    started = time.monotonic()
+    client.insert(FACTS_TABLE, data, column_names=FACT_COLUMNS, column_oriented=True, settings=settings)
+    controller.record(len(block), int(block.memory_usage(deep=False).sum()), time.monotonic() - started)
+    return len(block)
+
+
+@contextmanager
+def _date_lock(conn, calculation_date: str):
+    """Serialize loads of one date across workers (overlapping hourly runs, the daily run)"""
+    lock_key = f'andi_eci_facts:{calculation_date}'
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(hashtext(%s))', (lock_key,))
+    conn.commit()
+    try:
+        yield
+    finally:
+        # The extract only reads; drop any open transaction so the unlock can run
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', (lock_key,))
+        conn.commit()
+
+
+def load_eci_facts(
+    calculation_date: str,
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    connections=None,
+    coalesce: bool = False
+) -> Dict[str, Any]:
+    """Extract, transform and load one day of ECI component scores into facts_ciq_comprehensive.
+
+    With ``coalesce`` the run's rows are externally sorted (spilling past the
+    memory budget) and inserted grouped by the dashboard aggregate key.
+    """
+    connections = connections or db_connections
+    fetch_controller = postgres_fetch_controller('eci_component_scores', metrics)
+    insert_controller = clickhouse_insert_controller(FACTS_TABLE, metrics)
+    pending: List[pd.DataFrame] = []
+    pending_rows = 0
+    extracted = 0
+    transformed = 0
+    loaded = 0
+    blocks = 0
+    sorter = ExternalSorter('eci_facts', AGGREGATE_KEY, metrics=metrics) if coalesce else None
+
+    # The sorter's context removes its spill files even if the load fails
+    with sorter or nullcontext(), connections.get_postgres_connection() as conn, \
+            connections.get_clickhouse_connection() as client, _date_lock(conn, calculation_date):
+        # Sessions already loaded are skipped rather than deleted: the dashboard MV has
+        # summed them into aggregates_daily_ciq_metrics, so re-inserting would double count.
+        # The check is read-then-insert, hence the per-date lock around the whole load
+        existing = client.query(
+            f"SELECT DISTINCT session_id FROM {FACTS_TABLE} WHERE session_date = %(day)s",
+            parameters={'day': calculation_date}
+        ).result_rows
+        loaded_sessions = {row[0] for row in existing}
+
+        pages = fetch_in_batches(
+            conn, EXTRACT_QUERY, (calculation_date,), controller=fetch_controller, cursor_name='eci_facts_extract'
+        )
+        for rows in pages:
+            extracted += len(rows)
+            frame = transform_eci_batch(rows)
+            if loaded_sessions:
+                frame = frame[~frame['session_id'].isin(loaded_sessions)].reset_index(drop=True)
+                if frame.empty:
+                    continue
+            frame = assign_surrogate_keys(frame, batch_id=batch_id)
+            transformed += len(frame)
+            if sorter is not None:
+                sorter.add(frame)
+                continue
+            pending.append(frame)
+            pending_rows += len(frame)
+
+            if pending_rows >= insert_controller.batch_size:
+                loaded += _insert_block(client, pending, insert_controller)
+                blocks += 1
+                pending, pending_rows = [], 0
+
+        if sorter is not None:
+            block_rows = sorter.rows_within(sorter.budget.limit_bytes // 2, max_rows=COALESCE_MAX_ROWS)
+            for block in sorter.sorted_frames(block_rows=block_rows):
+                loaded += _insert_block(client, [block], insert_controller, coalesce=True)
+                blocks += 1
+            if sorter.spills:
+                logger.info(f"Coalesced ECI facts spilled {sorter.spills} sorted runs ({sorter.spilled_rows:,} rows)")
+        elif pending:
+            loaded += _insert_block(client, pending, insert_controller)
+            blocks += 1
+
+    # ETLMetrics setters overwrite, so the run totals are recorded once
+    if metrics is not None:
+        metrics.record_extraction(extracted)
+        metrics.record_transformation(transformed)
+        metrics.record_load(loaded)
+    logger.info(f"Loaded {loaded:,} ECI fact rows for {calculation_date} in {blocks} blocks")
+    return {'records_loaded': loaded, 'blocks': blocks, 'calculation_date': calculation_date, 'coalesced': coalesce}
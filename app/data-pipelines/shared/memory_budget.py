@@ -0,0 +1,365 @@
+"""
+Memory-budgeted transforms for ANDI data pipelines
+
+Python-side transforms buffer pandas frames (a whole run for coalesced
+inserts, partial aggregates for group-bys), and a large district-month can
+outgrow the Airflow worker. A ``MemoryBudget`` tracks the bytes a stage has
+buffered plus the process RSS; when either crosses its limit the stage
+spills to local disk instead of growing until the OOM killer steps in:
+
+    with ExternalSorter('eci_facts', ['session_date', 'teacher_sk']) as sorter:
+        for frame in frames:
+            sorter.add(frame)
+        for block in sorter.sorted_frames():
+            insert(block)
+
+``ExternalSorter`` writes sorted runs and k-way merges them back in key
+order; ``SpillingAggregator`` combines partial group-by results and, when
+over budget, hash-partitions them to disk so each partition is finished on
+its own. Spill files are LZ4-compressed Arrow IPC streams under
+``TRANSFORM_SPILL_DIR`` and are removed when the context exits. Stages that
+stay within budget never touch disk.
+"""
+
+import bisect
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, Any, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from utils import ETLMetrics, get_rss_bytes, format_bytes, setup_logging
+
+
+SPILL_ROOT = os.getenv('TRANSFORM_SPILL_DIR', tempfile.gettempdir())
+DEFAULT_BUDGET_BYTES = int(os.getenv('TRANSFORM_MEMORY_BUDGET_MB', '512')) * 1024 * 1024
+# Optional ceiling on the whole task process, e.g. the worker's memory divided by its concurrency
+DEFAULT_RSS_LIMIT_BYTES = int(os.getenv('TRANSFORM_RSS_LIMIT_MB', '0')) * 1024 * 1024
+
+# RSS rarely drops after a spill, so RSS pressure only forces a spill once this much is buffered
+MIN_SPILL_BYTES = 16 * 1024 * 1024
+RUN_CHUNK_ROWS = 50_000
+HASH_PARTITIONS = 16
+IPC_OPTIONS = pa.ipc.IpcWriteOptions(compression='lz4')
+
+AGGREGATE_COMBINERS = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+logger = setup_logging('memory_budget')
+
+
+def frame_bytes(frame: pd.DataFrame) -> int:
+    """In-memory size of a frame, including the Python objects behind string columns"""
+    return int(frame.memory_usage(deep=True, index=False).sum())
+
+
+class MemoryBudget:
+    """Buffered-bytes and process-RSS accounting for one transform stage"""
+
+    def __init__(self, name: str, limit_bytes: Optional[int] = None, rss_limit_bytes: Optional[int] = None):
+        self.name = name
+        self.limit_bytes = limit_bytes or DEFAULT_BUDGET_BYTES
+        self.rss_limit_bytes = DEFAULT_RSS_LIMIT_BYTES if rss_limit_bytes is None else rss_limit_bytes
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self.peak_rss_bytes = 0
+
+    def reserve(self, size: int) -> None:
+        self.buffered_bytes += size
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+
+    def release(self, size: Optional[int] = None) -> None:
+        self.buffered_bytes = 0 if size is None else max(0, self.buffered_bytes - size)
+
+    def exceeded(self) -> bool:
+        """True when the stage should spill what it has buffered"""
+        if self.buffered_bytes > self.limit_bytes:
+            return True
+        if self.rss_limit_bytes and self.buffered_bytes >= MIN_SPILL_BYTES:
+            rss = get_rss_bytes()
+            self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+            return rss > self.rss_limit_bytes
+        return False
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'limit_bytes': self.limit_bytes,
+            'rss_limit_bytes': self.rss_limit_bytes,
+            'peak_buffered_bytes': self.peak_buffered_bytes,
+            'peak_rss_bytes': self.peak_rss_bytes
+        }
+
+
+class _SpillStage:
+    """Spill directory, Arrow IPC files and metrics shared by the sorter and the aggregator"""
+
+    def __init__(self, name: str, budget: Optional[MemoryBudget], metrics: Optional[ETLMetrics], spill_dir: Optional[str]):
+        self.name = name
+        self.budget = budget or MemoryBudget(name)
+        self.metrics = metrics
+        self.spill_root = spill_dir or SPILL_ROOT
+        self.spill_dir: Optional[str] = None
+        self.spills = 0
+        self.spilled_rows = 0
+        self.spilled_bytes = 0
+        self._schemas: Dict[str, pa.Schema] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self) -> None:
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def _path(self, filename: str) -> str:
+        if self.spill_dir is None:
+            os.makedirs(self.spill_root, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix=f'andi_spill_{self.name}_', dir=self.spill_root)
+        return os.path.join(self.spill_dir, filename)
+
+    def _table(self, frame: pd.DataFrame, schema_key: str) -> pa.Table:
+        # Every chunk of a stage is written with the first chunk's schema so the files concatenate
+        schema = self._schemas.get(schema_key)
+        table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+        if schema is None:
+            self._schemas[schema_key] = table.schema
+        return table
+
+    def _record_spill(self, rows: int, size: int, started: float) -> None:
+        seconds = time.monotonic() - started
+        self.spills += 1
+        self.spilled_rows += rows
+        self.spilled_bytes += size
+        if self.metrics is not None:
+            self.metrics.record_batch(f'spill.{self.name}', rows, size, seconds)
+        logger.info(
+            f"{self.name}: spilled {rows:,} rows ({format_bytes(size)} in memory) to {self.spill_dir} "
+            f"in {seconds:.2f}s (spill #{self.spills})"
+        )
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            **self.budget.get_summary(),
+            'spills': self.spills,
+            'spilled_rows': self.spilled_rows,
+            'spilled_bytes': self.spilled_bytes
+        }
+
+
+def _read_stream(path: str) -> Iterator[pd.DataFrame]:
+    with pa.OSFile(path, 'rb') as source:
+        for batch in pa.ipc.open_stream(source):
+            yield batch.to_pandas()
+
+
+class ExternalSorter(_SpillStage):
+    """Sorts frames by ``keys`` within a memory budget, spilling sorted runs and merging them back"""
+
+    def __init__(self, name: str, keys: List[str], budget: Optional[MemoryBudget] = None,
+                 metrics: Optional[ETLMetrics] = None, spill_dir: Optional[str] = None):
+        super().__init__(name, budget, metrics, spill_dir)
+        self.keys = keys
+        self.rows = 0
+        self.added_bytes = 0
+        self._buffer: List[pd.DataFrame] = []
+        self._runs: List[str] = []
+
+    def _sorted(self, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        frame = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return frame.sort_values(self.keys, kind='stable', ignore_index=True)
+
+    def add(self, frame: pd.DataFrame) -> None:
+        if frame.empty:
+            return
+        size = frame_bytes(frame)
+        self._buffer.append(frame)
+        self.rows += len(frame)
+        self.added_bytes += size
+        self.budget.reserve(size)
+        if self.budget.exceeded():
+            self.spill()
+
+    def spill(self) -> None:
+        """Write the buffered frames to disk as one sorted run"""
+        if not self._buffer:
+            return
+        started = time.monotonic()
+        run = self._sorted(self._buffer)
+        path = self._path(f'run_{len(self._runs):05d}.arrow')
+        with pa.OSFile(path, 'wb') as sink:
+            table = self._table(run, 'run')
+            with pa.ipc.new_stream(sink, table.schema, options=IPC_OPTIONS) as writer:
+                writer.write_table(table, max_chunksize=RUN_CHUNK_ROWS)
+        self._runs.append(path)
+        size = self.budget.buffered_bytes
+        self._buffer = []
+        self.budget.release()
+        self._record_spill(len(run), size, started)
+
+    def rows_within(self, size: int, max_rows: Optional[int] = None) -> int:
+        """Rows that fit in ``size`` bytes at the average row size added so far (at least 1)"""
+        if not self.rows or not self.added_bytes:
+            return max_rows or 1
+        rows = max(int(size * self.rows // self.added_bytes), 1)
+        return min(rows, max_rows) if max_rows else rows
+
+    def _key_tuples(self, frame: pd.DataFrame) -> List[tuple]:
+        return list(zip(*(frame[key].tolist() for key in self.keys)))
+
+    def _merge_runs(self) -> Iterator[pd.DataFrame]:
+        """K-way merge: rows up to the smallest per-run frontier key can be emitted safely"""
+        readers = {index: _read_stream(path) for index, path in enumerate(self._runs)}
+        frontiers: Dict[int, tuple] = {}
+        pool = []
+
+        def advance(index: int) -> None:
+            chunk = next(readers[index], None)
+            if chunk is None or chunk.empty:
+                del readers[index]
+                frontiers.pop(index, None)
+                return
+            pool.append(chunk)
+            frontiers[index] = self._key_tuples(chunk.tail(1))[0]
+
+        for index in list(readers):
+            advance(index)
+
+        pending = pd.DataFrame()
+        while frontiers:
+            bound = min(frontiers.values())
+            merged = self._sorted([pending, *pool] if len(pending) else pool)
+            cutoff = bisect.bisect_right(self._key_tuples(merged), bound)
+            yield merged.iloc[:cutoff]
+            pending = merged.iloc[cutoff:].reset_index(drop=True)
+            pool = []
+            # Each run whose frontier is the bound has been emitted completely up to it
+            for index in [index for index, frontier in frontiers.items() if frontier == bound]:
+                advance(index)
+        if len(pending):
+            yield pending
+
+    def sorted_frames(self, block_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Yield everything added so far in key order, in blocks of about ``block_rows`` rows"""
+        if not self._runs:
+            source = iter([self._sorted(self._buffer)]) if self._buffer else iter([])
+        else:
+            self.spill()
+            source = self._merge_runs()
+        self._buffer = []
+
+        block: List[pd.DataFrame] = []
+        block_size = 0
+        for frame in source:
+            if block_rows is None:
+                if len(frame):
+                    yield frame
+                continue
+            while len(frame):
+                take = frame.iloc[:block_rows - block_size]
+                frame = frame.iloc[len(take):]
+                block.append(take)
+                block_size += len(take)
+                if block_size >= block_rows:
+                    yield pd.concat(block, ignore_index=True)
+                    block, block_size = [], 0
+        if block:
+            yield pd.concat(block, ignore_index=True)
+        self.budget.release()
+
+
+class SpillingAggregator(_SpillStage):
+    """Hash aggregation of partial group-by results that hash-partitions to disk when over budget.
+
+    ``aggregations`` maps each value column to 'sum', 'count', 'min' or 'max';
+    averages are derived by the caller from a sum and a count.
+    """
+
+    def __init__(self, name: str, keys: List[str], aggregations: Dict[str, str],
+                 budget: Optional[MemoryBudget] = None, metrics: Optional[ETLMetrics] = None,
+                 spill_dir: Optional[str] = None, partitions: int = HASH_PARTITIONS):
+        super().__init__(name, budget, metrics, spill_dir)
+        unknown = set(aggregations.values()) - set(AGGREGATE_COMBINERS)
+        if unknown:
+            raise ValueError(f"Unsupported aggregations for {name}: {sorted(unknown)}")
+        self.keys = keys
+        self.aggregations = aggregations
+        self.combiners = {column: AGGREGATE_COMBINERS[func] for column, func in aggregations.items()}
+        self.partitions = partitions
+        self._partials: List[pd.DataFrame] = []
+        self._writers: Dict[int, Any] = {}
+
+    def _combine(self, partials: List[pd.DataFrame]) -> pd.DataFrame:
+        frame = pd.concat(partials, ignore_index=True) if len(partials) > 1 else partials[0]
+        return frame.groupby(self.keys, sort=False, dropna=False).agg(self.combiners).reset_index()
+
+    def add(self, frame: pd.DataFrame) -> None:
+        """Aggregate one batch of raw rows into the running partial result"""
+        if frame.empty:
+            return
+        partial = frame.groupby(self.keys, sort=False, dropna=False).agg(self.aggregations).reset_index()
+        self._partials.append(partial)
+        self.budget.reserve(frame_bytes(partial))
+        if not self.budget.exceeded():
+            return
+
+        # Collapse the partials first; spill only if the distinct groups themselves don't fit
+        combined = self._combine(self._partials)
+        self._partials = [combined]
+        self.budget.release()
+        self.budget.reserve(frame_bytes(combined))
+        if self.budget.exceeded():
+            self.spill()
+
+    def spill(self) -> None:
+        """Hash-partition the in-memory partial result into per-partition spill files"""
+        if not self._partials:
+            return
+        started = time.monotonic()
+        combined = self._combine(self._partials)
+        buckets = pd.util.hash_pandas_object(combined[self.keys], index=False).to_numpy() % self.partitions
+        for bucket, part in combined.groupby(buckets, sort=False):
+            writer = self._writers.get(bucket)
+            table = self._table(part.reset_index(drop=True), 'partial')
+            if writer is None:
+                sink = pa.OSFile(self._path(f'partition_{bucket:03d}.arrow'), 'wb')
+                writer = (sink, pa.ipc.new_stream(sink, table.schema, options=IPC_OPTIONS))
+                self._writers[bucket] = writer
+            writer[1].write_table(table)
+        size = self.budget.buffered_bytes
+        self._partials = []
+        self.budget.release()
+        self._record_spill(len(combined), size, started)
+
+    def cleanup(self) -> None:
+        for sink, writer in self._writers.values():
+            writer.close()
+            sink.close()
+        self._writers = {}
+        super().cleanup()
+
+    def results(self) -> Iterator[pd.DataFrame]:
+        """Yield the final aggregates, one frame per hash partition once anything was spilled"""
+        if not self._writers:
+            if self._partials:
+                yield self._combine(self._partials)
+            self._partials = []
+            self.budget.release()
+            return
+
+        self.spill()
+        paths = {}
+        for bucket, (sink, writer) in self._writers.items():
+            writer.close()
+            sink.close()
+            paths[bucket] = self._path(f'partition_{bucket:03d}.arrow')
+        self._writers = {}
+        for bucket in sorted(paths):
+            # Each group lives in exactly one partition, so partitions finish independently
+            yield self._combine(list(_read_stream(paths[bucket])))
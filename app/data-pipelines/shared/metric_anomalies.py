@@ -0,0 +1,406 @@
+"""
+Streaming anomaly detection for CIQ metrics
+
+Keeps running distribution state for ``overall_score``, ``equity_score`` and
+the student/teacher talk-time percentages globally, per school and per
+teacher: a Welford weight/mean/M2 triple plus a fixed-bin histogram that
+serves as a mergeable quantile sketch. Each sync batch is summarized once, compared with the
+stored baselines of only the entities it touches, then merged into them, so
+a run costs O(batch) and never re-reads session history. Each run scores the
+sessions last changed within its own data interval, so a session enters the
+baselines once per change even when runs overlap or catch up.
+
+Checks per metric:
+
+- ``mean_shift``: batch mean against the baseline, as a z-score on the
+  standard error of the batch mean
+- ``distribution_shift``: two-sample Kolmogorov-Smirnov distance between the
+  batch and baseline histograms (global scope only)
+- ``floor_spike``: share of values in the lowest bin, which catches an
+  analyzer writing zeroed scores (global scope only)
+
+Metrics that fail a global check are not merged into the baselines, so a
+broken batch cannot drag the reference distribution toward itself. A
+baseline held back for ``REBASELINE_AFTER_BATCHES`` consecutive batches is
+taken to have shifted for good (new analyzer model, rubric change) and
+restarts from the latest batch. ``reset_baselines`` (``python
+shared/metric_anomalies.py --reset METRIC ...``) restarts them on demand
+once a change is known to be legitimate.
+"""
+
+import argparse
+import math
+import sys
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils import ETLMetrics, setup_logging, send_pipeline_alert
+from connections import db_connections
+from batching import clickhouse_batch_insert
+
+
+BASELINES_TABLE = 'metric_baselines'
+ANOMALIES_TABLE = 'metric_anomalies'
+BASELINE_COLUMNS = [
+    'scope', 'entity_id', 'metric', 'weight', 'mean', 'm2', 'histogram', 'flagged_batches', 'etl_batch_id'
+]
+ANOMALY_COLUMNS = [
+    'scope', 'entity_id', 'metric', 'check_name', 'batch_count',
+    'batch_value', 'baseline_value', 'statistic', 'threshold', 'etl_batch_id'
+]
+
+# metric -> value range covered by the histogram sketch
+METRICS = {
+    'overall_score': (0.0, 100.0),
+    'equity_score': (0.0, 100.0),
+    'student_talk_percentage': (0.0, 100.0),
+    'teacher_talk_percentage': (0.0, 100.0),
+}
+HISTOGRAM_BINS = 50
+
+SCOPES = {'global': None, 'school': 'school_id', 'teacher': 'teacher_id'}
+
+Z_THRESHOLD = 4.0
+KS_COEFFICIENT = 1.63  # two-sample KS critical value coefficient for alpha = 0.01
+FLOOR_SPIKE_DELTA = 0.2  # absolute rise in the lowest-bin share
+MIN_GLOBAL_WEIGHT = 200
+MIN_ENTITY_WEIGHT = 20
+MIN_BATCH_DISTRIBUTION = 20  # batch size below which KS and floor checks are too noisy
+# Older observations are down-weighted once a baseline exceeds this weight, so it tracks slow drift
+MAX_BASELINE_WEIGHT = 5000.0
+# Consecutive flagged batches after which a baseline restarts from the latest batch (6 hourly syncs)
+REBASELINE_AFTER_BATCHES = 6
+
+BATCH_QUERY = """
+SELECT
+    s.teacher_id::text as teacher_id,
+    COALESCE(tp.school_id::text, '') as school_id,
+    m.overall_score::float8 as overall_score,
+    m.equity_score::float8 as equity_score,
+    m.student_talk_percentage::float8 as student_talk_percentage,
+    m.teacher_talk_percentage::float8 as teacher_talk_percentage
+FROM audio.audio_sessions s
+JOIN analytics.ciq_metrics m ON s.id = m.session_id
+LEFT JOIN core.teacher_profiles tp ON s.teacher_id = tp.user_id
+WHERE GREATEST(s.created_at, m.created_at, m.updated_at) > %(since)s
+  AND GREATEST(s.created_at, m.created_at, m.updated_at) <= %(until)s
+  AND s.status = 'completed'
+"""
+
+logger = setup_logging('metric_anomalies')
+
+
+class RunningStats:
+    """Mergeable Welford statistics with a fixed-bin histogram sketch"""
+
+    def __init__(self, low: float, high: float, weight: float = 0.0, mean: float = 0.0,
+                 m2: float = 0.0, histogram: Optional[np.ndarray] = None):
+        self.low = low
+        self.high = high
+        self.weight = weight
+        self.mean = mean
+        self.m2 = m2
+        self.histogram = np.zeros(HISTOGRAM_BINS) if histogram is None else np.asarray(histogram, dtype=float)
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, low: float, high: float) -> 'RunningStats':
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return cls(low, high)
+        mean = float(values.mean())
+        histogram, _ = np.histogram(np.clip(values, low, high), bins=HISTOGRAM_BINS, range=(low, high))
+        return cls(low, high, float(len(values)), mean, float(((values - mean) ** 2).sum()), histogram)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.weight - 1) if self.weight > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    @property
+    def floor_share(self) -> float:
+        total = self.histogram.sum()
+        return float(self.histogram[0] / total) if total else 0.0
+
+    def cdf(self) -> np.ndarray:
+        total = self.histogram.sum()
+        return np.cumsum(self.histogram) / total if total else np.zeros(HISTOGRAM_BINS)
+
+    def quantile(self, q: float) -> float:
+        """Quantile estimate, interpolated linearly within the containing bin"""
+        cdf = self.cdf()
+        if not cdf.any():
+            return float('nan')
+        index = int(np.searchsorted(cdf, q))
+        index = min(index, HISTOGRAM_BINS - 1)
+        below = cdf[index - 1] if index else 0.0
+        fraction = (q - below) / (cdf[index] - below) if cdf[index] > below else 0.0
+        width = (self.high - self.low) / HISTOGRAM_BINS
+        return self.low + (index + fraction) * width
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        """Combine two summaries (Chan et al. parallel update), then cap the weight"""
+        weight = self.weight + other.weight
+        if weight == 0:
+            return RunningStats(self.low, self.high)
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.weight / weight
+        m2 = self.m2 + other.m2 + delta * delta * self.weight * other.weight / weight
+        histogram = self.histogram + other.histogram
+        if weight > MAX_BASELINE_WEIGHT:
+            decay = MAX_BASELINE_WEIGHT / weight
+            weight, m2, histogram = MAX_BASELINE_WEIGHT, m2 * decay, histogram * decay
+        return RunningStats(self.low, self.high, weight, mean, m2, histogram)
+
+
+def summarize_batch(df: pd.DataFrame) -> Dict[Tuple[str, str, str], RunningStats]:
+    """(scope, entity_id, metric) -> batch summary, in one pass per scope and metric"""
+    summaries = {}
+    for metric, (low, high) in METRICS.items():
+        present = df[df[metric].notna()]
+        for scope, column in SCOPES.items():
+            if column is None:
+                summaries[(scope, '', metric)] = RunningStats.from_values(present[metric].to_numpy(), low, high)
+                continue
+            for entity_id, values in present[present[column] != ''].groupby(column)[metric]:
+                summaries[(scope, entity_id, metric)] = RunningStats.from_values(values.to_numpy(), low, high)
+    return summaries
+
+
+def load_baselines(
+    client,
+    keys: List[Tuple[str, str, str]]
+) -> Tuple[Dict[Tuple[str, str, str], RunningStats], Dict[Tuple[str, str, str], int]]:
+    """Stored state for just the given (scope, entity_id, metric) keys, plus their consecutive flagged batches"""
+    baselines = {}
+    flagged_batches = {}
+    for scope in SCOPES:
+        entity_ids = sorted({entity_id for key_scope, entity_id, _ in keys if key_scope == scope})
+        if not entity_ids:
+            continue
+        result = client.query(
+            f"""
+            SELECT entity_id, metric, weight, mean, m2, histogram, flagged_batches
+            FROM {BASELINES_TABLE} FINAL
+            WHERE scope = %(scope)s AND entity_id IN %(entity_ids)s
+            """,
+            parameters={'scope': scope, 'entity_ids': entity_ids}
+        )
+        for entity_id, metric, weight, mean, m2, histogram, flagged in result.result_rows:
+            if metric not in METRICS or len(histogram) != HISTOGRAM_BINS:
+                continue
+            low, high = METRICS[metric]
+            baselines[(scope, entity_id, metric)] = RunningStats(low, high, weight, mean, m2, histogram)
+            flagged_batches[(scope, entity_id, metric)] = flagged
+    return baselines, flagged_batches
+
+
+def _anomaly(key, check_name, batch, batch_value, baseline_value, statistic, threshold) -> Dict[str, Any]:
+    scope, entity_id, metric = key
+    return {
+        'scope': scope, 'entity_id': entity_id, 'metric': metric, 'check_name': check_name,
+        'batch_count': int(batch.weight), 'batch_value': float(batch_value),
+        'baseline_value': float(baseline_value), 'statistic': float(statistic), 'threshold': float(threshold)
+    }
+
+
+def check_batch(key: Tuple[str, str, str], batch: RunningStats, baseline: Optional[RunningStats]) -> List[Dict[str, Any]]:
+    """Run the checks for one key; returns the failed ones"""
+    scope = key[0]
+    min_weight = MIN_GLOBAL_WEIGHT if scope == 'global' else MIN_ENTITY_WEIGHT
+    if baseline is None or baseline.weight < min_weight or batch.weight == 0:
+        return []
+
+    anomalies = []
+    if baseline.std > 0:
+        z = (batch.mean - baseline.mean) / (baseline.std / math.sqrt(batch.weight))
+        if abs(z) > Z_THRESHOLD:
+            anomalies.append(_anomaly(key, 'mean_shift', batch, batch.mean, baseline.mean, z, Z_THRESHOLD))
+
+    if scope == 'global' and batch.weight >= MIN_BATCH_DISTRIBUTION:
+        distance = float(np.abs(batch.cdf() - baseline.cdf()).max())
+        critical = KS_COEFFICIENT * math.sqrt((batch.weight + baseline.weight) / (batch.weight * baseline.weight))
+        if distance > critical:
+            anomalies.append(_anomaly(
+                key, 'distribution_shift', batch, batch.quantile(0.5), baseline.quantile(0.5), distance, critical
+            ))
+
+        rise = batch.floor_share - baseline.floor_share
+        if rise > FLOOR_SPIKE_DELTA:
+            anomalies.append(_anomaly(
+                key, 'floor_spike', batch, batch.floor_share, baseline.floor_share, rise, FLOOR_SPIKE_DELTA
+            ))
+    return anomalies
+
+
+def detect_batch_anomalies(
+    df: pd.DataFrame,
+    client,
+    batch_id: str = '',
+    update_baselines: bool = True
+) -> Dict[str, Any]:
+    """Check one batch of sessions against the stored baselines and fold it in"""
+    summaries = summarize_batch(df)
+    baselines, flagged_batches = load_baselines(client, list(summaries))
+
+    anomalies = []
+    for key, batch in summaries.items():
+        anomalies.extend(check_batch(key, batch, baselines.get(key)))
+
+    quarantined = {a['metric'] for a in anomalies if a['scope'] == 'global'}
+    flagged = {(a['scope'], a['entity_id'], a['metric']) for a in anomalies}
+
+    updated = 0
+    rebaselined = []
+    if update_baselines:
+        rows = []
+        for key, batch in summaries.items():
+            if batch.weight == 0:
+                continue
+            baseline = baselines.get(key)
+            if key[2] in quarantined or key in flagged:
+                if baseline is None:
+                    continue
+                # Held back: keep the baseline, but count the streak so a lasting shift is adopted
+                streak = flagged_batches.get(key, 0) + 1
+                if streak >= REBASELINE_AFTER_BATCHES:
+                    baseline, streak = batch, 0
+                    rebaselined.append(key)
+            else:
+                low, high = METRICS[key[2]]
+                baseline, streak = (baseline or RunningStats(low, high)).merge(batch), 0
+            rows.append([*key, baseline.weight, baseline.mean, baseline.m2, baseline.histogram.tolist(), streak, batch_id])
+        updated = clickhouse_batch_insert(client, BASELINES_TABLE, rows, BASELINE_COLUMNS) if rows else 0
+        if rebaselined:
+            logger.warning(
+                f"Re-baselined {len(rebaselined)} keys after {REBASELINE_AFTER_BATCHES} consecutive flagged batches: "
+                + ', '.join(sorted({f'{scope}:{metric}' for scope, _, metric in rebaselined}))
+            )
+
+    if anomalies:
+        clickhouse_batch_insert(
+            client, ANOMALIES_TABLE,
+            ([*(a[column] for column in ANOMALY_COLUMNS[:-1]), batch_id] for a in anomalies),
+            ANOMALY_COLUMNS
+        )
+
+    return {
+        'sessions': len(df),
+        'keys_checked': len(summaries),
+        'baselines_updated': updated,
+        'baselines_restarted': len(rebaselined),
+        'anomalies': anomalies,
+        'quarantined_metrics': sorted(quarantined)
+    }
+
+
+def reset_baselines(
+    metrics: Optional[List[str]] = None,
+    scopes: Optional[List[str]] = None,
+    batch_id: str = 'manual_reset',
+    connections=None
+) -> int:
+    """Restart baselines after an accepted distribution change; the next batches rebuild them from scratch"""
+    connections = connections or db_connections
+    metrics = list(metrics or METRICS)
+    scopes = list(scopes or SCOPES)
+    unknown = sorted(set(metrics) - set(METRICS)) + sorted(set(scopes) - set(SCOPES))
+    if unknown:
+        raise ValueError(f"Unknown metrics or scopes: {unknown}")
+
+    with connections.get_clickhouse_connection() as client:
+        # Zero-weight rows: checks skip until the baseline is warm again, and merging starts from the batch
+        reset = client.query(
+            f"""
+            SELECT scope, entity_id, metric
+            FROM {BASELINES_TABLE} FINAL
+            WHERE metric IN %(metrics)s AND scope IN %(scopes)s AND weight > 0
+            """,
+            parameters={'metrics': metrics, 'scopes': scopes}
+        ).result_rows
+        rows = [[*key, 0.0, 0.0, 0.0, [0.0] * HISTOGRAM_BINS, 0, batch_id] for key in reset]
+        written = clickhouse_batch_insert(client, BASELINES_TABLE, rows, BASELINE_COLUMNS) if rows else 0
+
+    logger.info(f"Reset {written} baselines for metrics {metrics} in scopes {scopes}")
+    return written
+
+
+def fetch_batch(since, until, connections=None) -> pd.DataFrame:
+    connections = connections or db_connections
+    with connections.get_postgres_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(BATCH_QUERY, {'since': since, 'until': until})
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+    df = pd.DataFrame(rows, columns=columns)
+    for metric in METRICS:
+        df[metric] = pd.to_numeric(df[metric], errors='coerce')
+    return df
+
+
+def run_anomaly_detection(
+    since,
+    until,
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    connections=None,
+    alert: bool = True
+) -> Dict[str, Any]:
+    """Score sessions last changed in (since, until]; alerts when a global check fails.
+
+    Windows must not overlap: every session in a window is folded into the baselines.
+    """
+    connections = connections or db_connections
+    df = fetch_batch(since, until, connections)
+    if metrics is not None:
+        metrics.record_extraction(len(df))
+    if df.empty:
+        logger.info("No sessions in batch, skipping anomaly detection")
+        return {
+            'sessions': 0, 'keys_checked': 0, 'baselines_updated': 0, 'baselines_restarted': 0,
+            'anomalies': [], 'quarantined_metrics': []
+        }
+
+    with connections.get_clickhouse_connection() as client:
+        result = detect_batch_anomalies(df, client, batch_id)
+
+    if metrics is not None:
+        metrics.record_load(result['baselines_updated'])
+
+    anomalies = result['anomalies']
+    global_anomalies = [a for a in anomalies if a['scope'] == 'global']
+    logger.info(
+        f"Anomaly detection: {len(df)} sessions, {len(anomalies)} anomalies "
+        f"({len(global_anomalies)} global), {result['baselines_updated']} baselines updated"
+    )
+    if alert and global_anomalies:
+        details = '\n'.join(
+            f"{a['metric']} {a['check_name']}: batch {a['batch_value']:.3f} vs baseline "
+            f"{a['baseline_value']:.3f} (statistic {a['statistic']:.2f}, threshold {a['threshold']:.2f})"
+            for a in global_anomalies
+        )
+        send_pipeline_alert(
+            'CIQ Metric Anomalies', 'warning', details,
+            {'sessions': len(df), 'entity_anomalies': len(anomalies) - len(global_anomalies),
+             'quarantined_metrics': result['quarantined_metrics']}
+        )
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reset CIQ metric baselines after an accepted distribution change')
+    parser.add_argument('--reset', nargs='*', metavar='METRIC', required=True,
+                        help=f'Metrics to reset (all when no names given): {", ".join(METRICS)}')
+    parser.add_argument('--scope', nargs='*', choices=list(SCOPES), help='Scopes to reset (default: all)')
+    args = parser.parse_args(argv)
+
+    reset_baselines(args.reset or None, args.scope or None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
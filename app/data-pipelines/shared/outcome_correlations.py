@@ -0,0 +1,325 @@
+"""
+Incremental ECI vs student outcome correlations for ANDI analytics
+
+Relates ECI component scores to student academic performance without
+joining years of facts on every run. The unit of observation is a
+classroom-week: mean ECI scores from ``facts_ciq_comprehensive`` paired with
+mean outcomes from ``facts_student_academic_performance``. Each observation
+contributes the outer product of ``v = [1, predictors, outcomes]`` to an
+augmented moment matrix kept per classroom, teacher and globally for each
+academic year and semester (``agg_eci_outcome_stats``). That matrix holds the
+count, sums and all cross-products, which is enough to derive every
+correlation and regression coefficient.
+
+A run only recomputes the classroom-weeks that received new sessions or
+outcome records since the watermark. The previous version of each such
+cell (``agg_eci_outcome_cells``) is subtracted and the new one added, so the
+cost is O(new rows) regardless of history. Coefficients are then
+re-derived for the touched entities only and written to
+``agg_eci_outcome_correlations``. ``rebuild_outcome_stats`` recomputes all
+statistics from the stored cells if floating-point drift ever matters.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from batching import clickhouse_batch_insert
+from eci_facts import ECI_COMPONENTS, COMPONENT_COLUMNS
+from event_streams import get_watermark, set_watermark
+
+
+CELLS_TABLE = 'agg_eci_outcome_cells'
+STATS_TABLE = 'agg_eci_outcome_stats'
+CORRELATIONS_TABLE = 'agg_eci_outcome_correlations'
+WATERMARK_STREAM = 'agg_eci_outcome_stats'
+
+PREDICTORS = [*COMPONENT_COLUMNS, 'overall_ciq_score']
+OUTCOMES = ['current_grade_percentage', 'mastery_percentage', 'attendance_percentage', 'behavior_score']
+DIMENSIONS = [f'{dimension}_avg' for dimension in ECI_COMPONENTS]
+WIDTH = 1 + len(PREDICTORS) + len(OUTCOMES)
+
+# Below this many classroom-weeks coefficients are written as NULL
+MIN_OBSERVATIONS = 4
+VARIANCE_EPSILON = 1e-9
+
+CELL_COLUMNS = [
+    'classroom_id', 'week_start_date', 'teacher_id', 'academic_year', 'semester',
+    'sessions', 'outcome_records', 'predictors', 'outcomes', 'etl_batch_id'
+]
+STATS_COLUMNS = ['scope', 'entity_id', 'academic_year', 'semester', 'observations', 'moments', 'etl_batch_id']
+CORRELATION_COLUMNS = [
+    'scope', 'entity_id', 'academic_year', 'semester', 'outcome', 'predictor', 'observations',
+    'pearson_r', 'slope', 'intercept', 'joint_coefficient', 'joint_r_squared', 'etl_batch_id'
+]
+
+# Classroom-weeks with facts created in (since, until]; the upper bound keeps the set stable within a run
+TOUCHED_CELLS_QUERY = """
+SELECT classroom_id, toMonday(session_date)
+FROM facts_ciq_comprehensive
+WHERE created_at > %(since)s AND created_at <= %(until)s AND classroom_id != ''
+UNION DISTINCT
+SELECT classroom_id, toMonday(record_date)
+FROM facts_student_academic_performance
+WHERE created_at > %(since)s AND created_at <= %(until)s AND classroom_id != ''
+"""
+
+CELL_QUERY = f"""
+SELECT
+    eci.classroom_id, eci.week_start_date, eci.teacher_id, eci.academic_year, eci.semester,
+    eci.sessions, outcome.records,
+    [{', '.join(f'eci.x_{index}' for index in range(len(PREDICTORS)))}] as predictors,
+    [{', '.join(f'outcome.y_{index}' for index in range(len(OUTCOMES)))}] as outcomes
+FROM (
+    SELECT
+        classroom_id,
+        toMonday(session_date) as week_start_date,
+        argMax(teacher_id, session_date) as teacher_id,
+        argMax(academic_year, session_date) as academic_year,
+        argMax(semester, session_date) as semester,
+        count() as sessions,
+        {', '.join(f'avg({column}) as x_{index}' for index, column in enumerate(PREDICTORS))}
+    FROM facts_ciq_comprehensive
+    WHERE (classroom_id, toMonday(session_date)) IN ({TOUCHED_CELLS_QUERY})
+    GROUP BY classroom_id, week_start_date
+) eci
+INNER JOIN (
+    SELECT
+        classroom_id,
+        toMonday(record_date) as week_start_date,
+        count() as records,
+        {', '.join(f'avg({column}) as y_{index}' for index, column in enumerate(OUTCOMES))}
+    FROM facts_student_academic_performance
+    WHERE (classroom_id, toMonday(record_date)) IN ({TOUCHED_CELLS_QUERY})
+    GROUP BY classroom_id, week_start_date
+) outcome USING (classroom_id, week_start_date)
+"""
+
+STORED_CELLS_QUERY = f"""
+SELECT classroom_id, week_start_date, teacher_id, academic_year, semester,
+       sessions, outcome_records, predictors, outcomes
+FROM {CELLS_TABLE} FINAL
+WHERE (classroom_id, week_start_date) IN ({TOUCHED_CELLS_QUERY})
+"""
+
+logger = setup_logging('outcome_correlations')
+
+StatsKey = Tuple[str, str, str, str]  # scope, entity_id, academic_year, semester
+
+
+def _predictor_transform() -> np.ndarray:
+    """Rows map the raw predictors to themselves plus the three dimension averages"""
+    transform = np.vstack([np.eye(len(PREDICTORS)), np.zeros((len(DIMENSIONS), len(PREDICTORS)))])
+    for row, columns in enumerate(ECI_COMPONENTS.values(), start=len(PREDICTORS)):
+        for column in columns:
+            transform[row, PREDICTORS.index(column)] = 1.0 / len(columns)
+    return transform
+
+
+PREDICTOR_TRANSFORM = _predictor_transform()
+PREDICTOR_NAMES = PREDICTORS + DIMENSIONS
+
+
+def cell_vector(predictors: List[float], outcomes: List[float]) -> np.ndarray:
+    return np.concatenate([[1.0], np.nan_to_num(predictors), np.nan_to_num(outcomes)])
+
+
+def stats_keys(cell: tuple) -> List[StatsKey]:
+    classroom_id, _, teacher_id, academic_year, semester = cell[:5]
+    return [
+        ('classroom', classroom_id, academic_year, semester),
+        ('teacher', teacher_id, academic_year, semester),
+        ('global', '', academic_year, semester),
+    ]
+
+
+def accumulate_deltas(new_cells: Iterable[tuple], old_cells: Iterable[tuple]) -> Dict[StatsKey, np.ndarray]:
+    """Moment-matrix change per stats key: new cell contributions minus the ones they replace"""
+    deltas: Dict[StatsKey, np.ndarray] = defaultdict(lambda: np.zeros((WIDTH, WIDTH)))
+    for cells, sign in ((new_cells, 1.0), (old_cells, -1.0)):
+        for cell in cells:
+            vector = cell_vector(cell[7], cell[8])
+            contribution = sign * np.outer(vector, vector)
+            for key in stats_keys(cell):
+                deltas[key] += contribution
+    return deltas
+
+
+def load_stats(client, keys: Iterable[StatsKey]) -> Dict[StatsKey, Tuple[np.ndarray, str]]:
+    """Current moment matrix and writing batch for each key that has one"""
+    wanted = set(keys)
+    by_scope: Dict[str, set] = defaultdict(set)
+    for scope, entity_id, _, _ in wanted:
+        by_scope[scope].add(entity_id)
+
+    stored = {}
+    for scope, entity_ids in by_scope.items():
+        result = client.query(
+            f"""
+            SELECT entity_id, academic_year, semester, moments, etl_batch_id
+            FROM {STATS_TABLE} FINAL
+            WHERE scope = %(scope)s AND entity_id IN %(entity_ids)s
+            """,
+            parameters={'scope': scope, 'entity_ids': list(entity_ids)}
+        )
+        for entity_id, academic_year, semester, moments, batch_id in result.result_rows:
+            key = (scope, entity_id, academic_year, semester)
+            if key in wanted and len(moments) == WIDTH * WIDTH:
+                stored[key] = (np.asarray(moments, dtype=float).reshape(WIDTH, WIDTH), batch_id)
+    return stored
+
+
+def derive_coefficients(moments: np.ndarray) -> Dict[str, Any]:
+    """Simple and joint regression statistics from an augmented moment matrix"""
+    count = moments[0, 0]
+    split = 1 + len(PREDICTORS)
+    if count < MIN_OBSERVATIONS:
+        return {'observations': count}
+
+    means = moments[0, 1:] / count
+    # Centered cross-products: sum((v - mean)(v - mean)')
+    centered = moments[1:, 1:] - count * np.outer(means, means)
+    cxx = PREDICTOR_TRANSFORM @ centered[:split - 1, :split - 1] @ PREDICTOR_TRANSFORM.T
+    cxy = PREDICTOR_TRANSFORM @ centered[:split - 1, split - 1:]
+    cyy = np.diag(centered[split - 1:, split - 1:])
+    mean_x = PREDICTOR_TRANSFORM @ means[:split - 1]
+    mean_y = means[split - 1:]
+
+    var_x = np.diag(cxx)
+    valid_x = var_x > VARIANCE_EPSILON
+    valid_y = cyy > VARIANCE_EPSILON
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(valid_x[:, None], cxy / var_x[:, None], np.nan)
+        pearson = np.where(valid_x[:, None] & valid_y[None, :], cxy / np.sqrt(np.outer(var_x, cyy)), np.nan)
+    intercept = mean_y[None, :] - slope * mean_x[:, None]
+
+    joint = np.full((len(DIMENSIONS), len(OUTCOMES)), np.nan)
+    joint_r2 = np.full(len(OUTCOMES), np.nan)
+    dims = slice(len(PREDICTORS), len(PREDICTOR_NAMES))
+    if count > len(DIMENSIONS) + 1:
+        dim_cxx = cxx[dims, dims]
+        if np.linalg.matrix_rank(dim_cxx) == len(DIMENSIONS):
+            joint = np.linalg.solve(dim_cxx, cxy[dims])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                joint_r2 = np.where(valid_y, np.einsum('ij,ij->j', cxy[dims], joint) / cyy, np.nan)
+
+    return {
+        'observations': count,
+        'pearson_r': pearson,
+        'slope': slope,
+        'intercept': intercept,
+        'joint': joint,
+        'joint_r2': joint_r2
+    }
+
+
+def _nullable(value: float) -> Optional[float]:
+    return None if value is None or not np.isfinite(value) else float(value)
+
+
+def correlation_rows(key: StatsKey, moments: np.ndarray, batch_id: str) -> List[list]:
+    coefficients = derive_coefficients(moments)
+    observations = int(round(coefficients['observations']))
+    rows = []
+    for j, outcome in enumerate(OUTCOMES):
+        for i, predictor in enumerate(PREDICTOR_NAMES):
+            if 'pearson_r' not in coefficients:
+                rows.append([*key, outcome, predictor, observations, None, None, None, None, None, batch_id])
+                continue
+            is_dimension = i >= len(PREDICTORS)
+            rows.append([
+                *key, outcome, predictor, observations,
+                _nullable(coefficients['pearson_r'][i, j]),
+                _nullable(coefficients['slope'][i, j]),
+                _nullable(coefficients['intercept'][i, j]),
+                _nullable(coefficients['joint'][i - len(PREDICTORS), j]) if is_dimension else None,
+                _nullable(coefficients['joint_r2'][j]),
+                batch_id
+            ])
+    return rows
+
+
+def write_stats(client, stats: Dict[StatsKey, np.ndarray], batch_id: str, metrics: Optional[ETLMetrics] = None) -> Dict[str, int]:
+    stats_rows = [
+        [*key, float(moments[0, 0]), moments.ravel().tolist(), batch_id]
+        for key, moments in stats.items()
+    ]
+    inserted = clickhouse_batch_insert(client, STATS_TABLE, stats_rows, STATS_COLUMNS, metrics)
+    correlation_count = clickhouse_batch_insert(
+        client, CORRELATIONS_TABLE,
+        (row for key, moments in stats.items() for row in correlation_rows(key, moments, batch_id)),
+        CORRELATION_COLUMNS, metrics
+    )
+    return {'stats_rows': inserted, 'correlation_rows': correlation_count}
+
+
+def update_outcome_correlations(
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    client=None
+) -> Dict[str, Any]:
+    """Fold classroom-weeks with new ECI or outcome facts into the running statistics"""
+    if client is None:
+        with db_connections.get_clickhouse_connection() as ch_client:
+            return update_outcome_correlations(metrics, batch_id, ch_client)
+
+    watermark, _ = get_watermark(client, WATERMARK_STREAM)
+    run_started = datetime.now(timezone.utc)
+    window = {'since': watermark, 'until': run_started}
+
+    new_cells = client.query(CELL_QUERY, parameters=window).result_rows
+    old_cells = client.query(STORED_CELLS_QUERY, parameters=window).result_rows
+    if not new_cells and not old_cells:
+        logger.info("No new classroom-weeks since last correlation update")
+        set_watermark(client, WATERMARK_STREAM, run_started, '', 0, batch_id)
+        return {'cells': 0, 'stats_rows': 0, 'correlation_rows': 0}
+
+    deltas = accumulate_deltas(new_cells, old_cells)
+    stored = load_stats(client, deltas)
+    updated = {}
+    for key, delta in deltas.items():
+        moments, written_by = stored.get(key, (np.zeros((WIDTH, WIDTH)), ''))
+        # An earlier try of this run already applied the delta but failed before saving the cells
+        if batch_id and written_by == batch_id:
+            updated[key] = moments
+            continue
+        updated[key] = moments + delta
+
+    result = write_stats(client, updated, batch_id, metrics)
+    cells_written = clickhouse_batch_insert(
+        client, CELLS_TABLE,
+        ([*cell[:7], list(cell[7]), list(cell[8]), batch_id] for cell in new_cells),
+        CELL_COLUMNS, metrics
+    )
+    set_watermark(client, WATERMARK_STREAM, run_started, '', cells_written, batch_id)
+    if metrics is not None:
+        metrics.record_load(cells_written + result['stats_rows'] + result['correlation_rows'])
+
+    logger.info(
+        f"Outcome correlations updated from {cells_written:,} classroom-weeks: "
+        f"{result['stats_rows']:,} stats rows, {result['correlation_rows']:,} coefficient rows"
+    )
+    return {'cells': cells_written, **result}
+
+
+def rebuild_outcome_stats(batch_id: str = '', client=None) -> Dict[str, int]:
+    """Recompute every stats row and coefficient from the stored classroom-week cells"""
+    if client is None:
+        with db_connections.get_clickhouse_connection() as ch_client:
+            return rebuild_outcome_stats(batch_id, ch_client)
+
+    cells = client.query(
+        f"""
+        SELECT classroom_id, week_start_date, teacher_id, academic_year, semester,
+               sessions, outcome_records, predictors, outcomes
+        FROM {CELLS_TABLE} FINAL
+        """
+    ).result_rows
+    stats = accumulate_deltas(cells, [])
+    result = write_stats(client, stats, batch_id)
+    logger.info(f"Rebuilt outcome statistics from {len(cells):,} classroom-weeks: {result}")
+    return {'cells': len(cells), **result}
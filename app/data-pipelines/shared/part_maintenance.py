@@ -0,0 +1,110 @@
+"""
+Part-count maintenance for ANDI warehouse tables
+
+Frequent inserts (and the materialized views they fire) leave many small
+parts per partition until background merges catch up, which slows
+dashboard queries. This module reads active part counts from
+``system.parts`` and issues targeted ``OPTIMIZE ... PARTITION ID`` merges
+for the partitions over a threshold, skipping partitions that already have
+a merge in flight.
+"""
+
+from typing import Dict, Any, List, Optional
+
+from utils import setup_logging
+from connections import db_connections
+
+
+# Tables written by the hourly sync and their materialized views.
+# FINAL is only used for small aggregate tables where collapsing the whole partition is cheap.
+MAINTAINED_TABLES = {
+    'facts_ciq_comprehensive': {'max_parts': 30, 'final': False},
+    'aggregates_daily_ciq_metrics': {'max_parts': 10, 'final': True},
+}
+
+logger = setup_logging('part_maintenance')
+
+
+def get_partition_part_counts(client, tables: List[str], database: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Active parts, rows and bytes per partition, most fragmented first"""
+    query = """
+    SELECT
+        table,
+        partition,
+        partition_id,
+        count() as part_count,
+        sum(rows) as rows,
+        sum(bytes_on_disk) as bytes_on_disk
+    FROM system.parts
+    WHERE active AND database = {database} AND table IN %(tables)s
+    GROUP BY table, partition, partition_id
+    ORDER BY part_count DESC
+    """.format(database='%(database)s' if database else 'currentDatabase()')
+    parameters: Dict[str, Any] = {'tables': tables}
+    if database:
+        parameters['database'] = database
+
+    result = client.query(query, parameters=parameters)
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+def get_merging_partitions(client, tables: List[str]) -> set:
+    """(table, partition_id) pairs with a merge currently running"""
+    result = client.query(
+        """
+        SELECT DISTINCT table, partition_id
+        FROM system.merges
+        WHERE database = currentDatabase() AND table IN %(tables)s
+        """,
+        parameters={'tables': tables}
+    )
+    return {(row[0], row[1]) for row in result.result_rows}
+
+
+def merge_fragmented_partitions(
+    client=None,
+    tables: Optional[Dict[str, Dict[str, Any]]] = None,
+    max_merges: int = 5,
+    dry_run: bool = False
+) -> List[Dict[str, Any]]:
+    """Trigger merges for partitions whose active part count exceeds the table's threshold"""
+    tables = tables or MAINTAINED_TABLES
+    if client is None:
+        with db_connections.get_clickhouse_connection() as ch_client:
+            return merge_fragmented_partitions(ch_client, tables, max_merges, dry_run)
+
+    table_names = list(tables)
+    counts = get_partition_part_counts(client, table_names)
+    merging = get_merging_partitions(client, table_names)
+    actions = []
+
+    for entry in counts:
+        policy = tables[entry['table']]
+        if entry['part_count'] <= policy['max_parts']:
+            continue
+        if (entry['table'], entry['partition_id']) in merging:
+            logger.info(f"Skipping {entry['table']} partition {entry['partition']}: merge already running")
+            continue
+        if len(actions) >= max_merges:
+            break
+
+        statement = f"OPTIMIZE TABLE {entry['table']} PARTITION ID '{entry['partition_id']}'"
+        if policy.get('final'):
+            statement += ' FINAL'
+        action = {**entry, 'statement': statement, 'executed': False}
+
+        if not dry_run:
+            try:
+                client.command(statement)
+                action['executed'] = True
+            except Exception as e:
+                action['error'] = str(e)
+                logger.warning(f"Merge failed for {entry['table']} partition {entry['partition']}: {e}")
+        actions.append(action)
+
+    for action in actions:
+        logger.info(
+            f"{'Merged' if action['executed'] else 'Would merge'} {action['table']} partition "
+            f"{action['partition']} ({action['part_count']} parts, {action['rows']:,} rows)"
+        )
+    return actions
@@ -0,0 +1,332 @@
+"""
+Cold-partition Parquet archive for ANDI fact tables
+
+Fact tables drop rows at their TTL (3 years for ``facts_ciq_sessions``,
+2 years for the resource/community facts). Before a monthly partition
+reaches that point, its rows are exported as a zstd-compressed Parquet file
+into a Hive-style layout::
+
+    {ARCHIVE_ROOT}/{table}/partition_month=YYYYMM/part-0.parquet
+    {ARCHIVE_ROOT}/{table}/_manifest.json
+
+On a sharded cluster (``CLICKHOUSE_SHARDS``) the fact tables are
+shard-local, so each shard's part of a partition is exported from that
+shard as ``part-{shard index}.parquet``, recorded and (optionally) dropped
+on its own.
+
+ClickHouse encodes the Parquet itself (``FORMAT Parquet``), sorted by the
+table's key so row-group statistics stay selective; the bytes are streamed
+straight to local disk or object storage (any URI pyarrow understands, e.g.
+``s3://bucket/prefix``) and verified against the partition row count before
+the manifest is updated. ``ArchiveReader`` queries the archive with
+partition pruning and row-group predicate pushdown.
+"""
+
+import json
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from cluster import SHARDED_TABLES, get_cluster
+
+
+ARCHIVE_ROOT = os.getenv('ARCHIVE_ROOT', '/opt/airflow/archive')
+MANIFEST_NAME = '_manifest.json'
+PARTITION_FIELD = 'partition_month'
+
+# table -> date column driving the monthly partition and TTL, and the TTL in months
+ARCHIVED_TABLES = {
+    'facts_ciq_sessions': {'date_column': 'session_date', 'ttl_months': 36},
+    'facts_resource_usage': {'date_column': 'interaction_date', 'ttl_months': 24},
+    'facts_community_activity': {'date_column': 'activity_date', 'ttl_months': 24},
+}
+# Archive a partition once its oldest rows are this close to expiring
+ARCHIVE_LEAD_MONTHS = 2
+
+EXPORT_SETTINGS = {
+    'output_format_parquet_compression_method': 'zstd',
+    'output_format_parquet_row_group_size': 500_000,
+    'output_format_parquet_string_as_string': 1,
+}
+STREAM_CHUNK_BYTES = 8 * 1024 * 1024
+# Date (not DateTime/Date32), also inside Nullable(...) or LowCardinality(...)
+DATE_TYPE = re.compile(r'\bDate\b')
+
+logger = setup_logging('partition_archive')
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _resolve_root(root: Optional[str]) -> Tuple[pafs.FileSystem, str]:
+    root = root or ARCHIVE_ROOT
+    if '://' in root:
+        return pafs.FileSystem.from_uri(root)
+    return pafs.LocalFileSystem(), os.path.abspath(root)
+
+
+def partitions_due(client, table: str, today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Active monthly partitions whose oldest rows expire within ARCHIVE_LEAD_MONTHS"""
+    config = ARCHIVED_TABLES[table]
+    today = today or datetime.now().date()
+    # A partition's first rows expire at month start + TTL
+    cutoff = _add_months(today.replace(day=1), ARCHIVE_LEAD_MONTHS - config['ttl_months'])
+
+    result = client.query(
+        """
+        SELECT
+            partition_id,
+            sum(rows) as partition_rows,
+            min(min_date) as first_date,
+            max(max_date) as last_date
+        FROM system.parts
+        WHERE active AND database = currentDatabase() AND table = %(table)s
+        GROUP BY partition_id
+        HAVING first_date < %(cutoff)s
+        ORDER BY partition_id
+        """,
+        parameters={'table': table, 'cutoff': cutoff}
+    )
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+def export_columns(client, table: str) -> str:
+    """Select list for export; UUIDs become strings so archive filters can use their text form.
+
+    Date is written to Parquet as a plain day number, so it is cast to
+    Date32, which maps to a Parquet date that compares with ``datetime.date``.
+    """
+    result = client.query(
+        """
+        SELECT name, type FROM system.columns
+        WHERE database = currentDatabase() AND table = %(table)s AND default_kind NOT IN ('ALIAS', 'MATERIALIZED')
+        ORDER BY position
+        """,
+        parameters={'table': table}
+    )
+    columns = []
+    for name, column_type in result.result_rows:
+        if 'UUID' in column_type:
+            columns.append(f'toString({name}) as {name}')
+        elif DATE_TYPE.search(column_type):
+            columns.append(f"CAST({name} AS {DATE_TYPE.sub('Date32', column_type)}) as {name}")
+        else:
+            columns.append(name)
+    return ', '.join(columns)
+
+
+class PartitionArchive:
+    """Writes partitions and the manifest for one table under the archive root"""
+
+    def __init__(self, table: str, root: Optional[str] = None):
+        self.table = table
+        self.config = ARCHIVED_TABLES[table]
+        self.fs, base = _resolve_root(root)
+        self.base = f'{base.rstrip("/")}/{table}'
+        self.fs.create_dir(self.base, recursive=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return f'{self.base}/{MANIFEST_NAME}'
+
+    def partition_path(self, partition_id: str, part: int = 0) -> str:
+        return f'{self.base}/{PARTITION_FIELD}={partition_id}/part-{part}.parquet'
+
+    def load_manifest(self) -> Dict[str, Any]:
+        if self.fs.get_file_info(self.manifest_path).type == pafs.FileType.NotFound:
+            return {
+                'table': self.table,
+                'date_column': self.config['date_column'],
+                'ttl_months': self.config['ttl_months'],
+                'partition_field': PARTITION_FIELD,
+                'partitions': {}
+            }
+        with self.fs.open_input_stream(self.manifest_path) as stream:
+            return json.loads(stream.read().decode('utf-8'))
+
+    def save_manifest(self, manifest: Dict[str, Any]):
+        manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+        temp_path = f'{self.manifest_path}.tmp'
+        with self.fs.open_output_stream(temp_path) as stream:
+            stream.write(json.dumps(manifest, indent=2, sort_keys=True, default=str).encode('utf-8'))
+        self.fs.move(temp_path, self.manifest_path)
+
+    def export_partition(self, client, partition: Dict[str, Any], batch_id: str = '', part: int = 0) -> Dict[str, Any]:
+        """Stream one partition as Parquet, verify its row count and return the manifest entry"""
+        partition_id = partition['partition_id']
+        path = self.partition_path(partition_id, part)
+        temp_path = f'{path}.tmp'
+        self.fs.create_dir(path.rsplit('/', 1)[0], recursive=True)
+
+        query = f"SELECT {export_columns(client, self.table)} FROM {self.table} WHERE _partition_id = %(partition_id)s"
+        sorting_key = client.command(
+            "SELECT sorting_key FROM system.tables WHERE database = currentDatabase() AND name = %(table)s",
+            parameters={'table': self.table}
+        )
+        if sorting_key:
+            query += f' ORDER BY {sorting_key}'
+
+        written = 0
+        stream = client.raw_stream(query, parameters={'partition_id': partition_id},
+                                   settings=EXPORT_SETTINGS, fmt='Parquet')
+        with stream, self.fs.open_output_stream(temp_path) as output:
+            while True:
+                chunk = stream.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                output.write(chunk)
+                written += len(chunk)
+
+        with self.fs.open_input_file(temp_path) as archived:
+            archived_rows = pq.ParquetFile(archived).metadata.num_rows
+        if archived_rows != partition['partition_rows']:
+            self.fs.delete_file(temp_path)
+            raise ValueError(
+                f"{self.table} partition {partition_id}: archived {archived_rows} rows, "
+                f"expected {partition['partition_rows']}"
+            )
+        self.fs.move(temp_path, path)
+
+        return {
+            'path': path.rsplit(f'{self.table}/', 1)[-1],
+            'rows': archived_rows,
+            'bytes': written,
+            'min_date': partition['first_date'].isoformat(),
+            'max_date': partition['last_date'].isoformat(),
+            'exported_at': datetime.now(timezone.utc).isoformat(),
+            'etl_batch_id': batch_id
+        }
+
+
+def archive_table(
+    client,
+    table: str,
+    root: Optional[str] = None,
+    today: Optional[date] = None,
+    batch_id: str = '',
+    drop_after_archive: bool = False,
+    shard: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Archive every due partition of a table (or of one shard's local table) not already archived at its current size"""
+    archive = PartitionArchive(table, root)
+    manifest = archive.load_manifest()
+    exported = []
+    source = table if shard is None else f'{table} shard {shard + 1}'
+
+    for partition in partitions_due(client, table, today):
+        partition_id = partition['partition_id']
+        key = partition_id if shard is None else f'{partition_id}.shard{shard + 1}'
+        previous = manifest['partitions'].get(key)
+        # TTL only ever removes rows, so fewer rows than archived means nothing new to keep
+        if previous is not None and partition['partition_rows'] <= previous['rows']:
+            continue
+
+        entry = archive.export_partition(client, partition, batch_id, part=shard or 0)
+        if shard is not None:
+            entry['shard'] = shard + 1
+        manifest['partitions'][key] = entry
+        archive.save_manifest(manifest)
+        exported.append({'table': table, 'partition_id': partition_id, **entry})
+        logger.info(f"Archived {source} partition {partition_id}: {entry['rows']:,} rows, {entry['bytes']:,} bytes")
+
+        if drop_after_archive:
+            # On a shard this drops the local partition on every replica of that shard only
+            client.command(f"ALTER TABLE {table} DROP PARTITION ID '{partition_id}'")
+            logger.info(f"Dropped archived partition {partition_id} from {source}")
+
+    return exported
+
+
+def archive_cold_partitions(
+    tables: Optional[Sequence[str]] = None,
+    root: Optional[str] = None,
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    drop_after_archive: bool = False
+) -> List[Dict[str, Any]]:
+    """Archive due partitions for every configured fact table, shard by shard on a cluster"""
+    cluster = get_cluster()
+    exported = []
+    with db_connections.get_clickhouse_connection() as client:
+        for table in tables or ARCHIVED_TABLES:
+            if cluster is None or table not in SHARDED_TABLES:
+                exported.extend(archive_table(
+                    client, table, root, batch_id=batch_id, drop_after_archive=drop_after_archive
+                ))
+                continue
+            for shard_index in range(len(cluster.shards)):
+                with cluster.shard_client(shard_index) as shard_client:
+                    exported.extend(archive_table(
+                        shard_client, table, root, batch_id=batch_id,
+                        drop_after_archive=drop_after_archive, shard=shard_index
+                    ))
+
+    # ETLMetrics.record_load assigns, so the run total is recorded once
+    if metrics is not None:
+        metrics.record_load(sum(entry['rows'] for entry in exported), sum(entry['bytes'] for entry in exported))
+    return exported
+
+
+class ArchiveReader:
+    """Query archived partitions with partition pruning and row-group predicate pushdown"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.fs, self.base = _resolve_root(root)
+
+    def manifest(self, table: str) -> Dict[str, Any]:
+        path = f'{self.base.rstrip("/")}/{table}/{MANIFEST_NAME}'
+        with self.fs.open_input_stream(path) as stream:
+            return json.loads(stream.read().decode('utf-8'))
+
+    def dataset(self, table: str) -> ds.FileSystemDataset:
+        """Dataset over the files listed in the manifest (half-written files are never picked up)"""
+        table_base = f'{self.base.rstrip("/")}/{table}'
+        files = [f'{table_base}/{entry["path"]}' for entry in self.manifest(table)['partitions'].values()]
+        return ds.dataset(
+            files, filesystem=self.fs, format='parquet',
+            partitioning=ds.partitioning(flavor='hive'), partition_base_dir=table_base
+        )
+
+    def read(
+        self,
+        table: str,
+        columns: Optional[List[str]] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> pd.DataFrame:
+        """Rows in [start_date, end_date) matching equality / IN ``filters`` (column -> value or list)"""
+        date_column = ARCHIVED_TABLES[table]['date_column']
+        expression = None
+
+        def combine(condition):
+            nonlocal expression
+            expression = condition if expression is None else expression & condition
+
+        # Month bounds prune whole files; the date bounds then use row-group statistics
+        if start_date is not None:
+            combine(ds.field(PARTITION_FIELD) >= int(start_date.strftime('%Y%m')))
+            combine(ds.field(date_column) >= start_date)
+        if end_date is not None:
+            combine(ds.field(PARTITION_FIELD) <= int(end_date.strftime('%Y%m')))
+            combine(ds.field(date_column) < end_date)
+        for column, value in (filters or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                combine(ds.field(column).isin(list(value)))
+            else:
+                combine(ds.field(column) == value)
+
+        dataset = self.dataset(table)
+        if not dataset.files:
+            return pd.DataFrame(columns=columns)
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
@@ -0,0 +1,218 @@
+"""
+Opt-in task profiling for ANDI data pipelines
+
+Captures cProfile stats, tracemalloc top allocators and per-stage wall/CPU
+timings for a task and writes them to a local artifact directory. Profiling
+is off unless enabled by the ANDI_PROFILE_TASKS env var (``1``/``true`` for
+all tasks or a comma-separated list of task ids) or by a ``profile`` DAG
+param / dag_run conf key, so the wrappers cost nothing in normal runs.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+from typing import Dict, Any, Optional, List
+
+from utils import setup_logging, format_bytes, format_duration, get_peak_rss_bytes
+
+
+PROFILE_DIR = os.getenv('ANDI_PROFILE_DIR', '/opt/airflow/logs/profiles')
+TOP_FUNCTIONS = int(os.getenv('ANDI_PROFILE_TOP_FUNCTIONS', '15'))
+TOP_ALLOCATIONS = int(os.getenv('ANDI_PROFILE_TOP_ALLOCATIONS', '15'))
+
+_local = threading.local()
+
+
+def _truthy(value: Any) -> bool:
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def profiling_enabled(task_id: Optional[str] = None, context: Optional[Dict[str, Any]] = None) -> bool:
+    """Check env var and DAG params/conf for a profiling opt-in"""
+    env_value = os.getenv('ANDI_PROFILE_TASKS', '')
+    if _truthy(env_value):
+        return True
+    if task_id and task_id in {name.strip() for name in env_value.split(',') if name.strip()}:
+        return True
+
+    if context:
+        params = context.get('params') or {}
+        if _truthy(params.get('profile', False)):
+            return True
+        dag_run = context.get('dag_run')
+        conf = getattr(dag_run, 'conf', None) or {}
+        if _truthy(conf.get('profile', False)):
+            return True
+    return False
+
+
+class TaskProfiler:
+    """Context manager collecting CPU, allocation and stage timings for one task run"""
+
+    def __init__(self, dag_id: str, task_id: str, run_id: Optional[str] = None, output_dir: Optional[str] = None):
+        self.dag_id = dag_id
+        self.task_id = task_id
+        self.run_id = run_id or datetime.now().strftime('manual__%Y%m%dT%H%M%S')
+        self.output_dir = os.path.join(
+            output_dir or PROFILE_DIR, dag_id, task_id, self.run_id.replace(':', '_').replace('+', '_')
+        )
+        self.logger = setup_logging(f'profiling.{dag_id}.{task_id}')
+        self.stages: List[Dict[str, Any]] = []
+        self._profile = cProfile.Profile()
+        self._started_tracemalloc = False
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+        self.summary: Dict[str, Any] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a named stage inside the task"""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            entry = {
+                'stage': name,
+                'wall_seconds': round(time.perf_counter() - wall_start, 4),
+                'cpu_seconds': round(time.process_time() - cpu_start, 4)
+            }
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                entry['traced_current_bytes'] = current
+                entry['traced_peak_bytes'] = peak
+            self.stages.append(entry)
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._previous = getattr(_local, 'profiler', None)
+        _local.profiler = self
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profile.disable()
+        _local.profiler = self._previous
+        wall = time.perf_counter() - self._wall_start
+        cpu = time.process_time() - self._cpu_start
+
+        snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+            ])
+        _, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        try:
+            self._write_artifacts(wall, cpu, traced_peak, snapshot, failed=exc_type is not None)
+        except Exception as e:
+            # Profiling must never fail the task it observes
+            self.logger.warning(f"Failed to write profiling artifacts: {e}")
+        return False
+
+    def _write_artifacts(self, wall: float, cpu: float, traced_peak: int, snapshot, failed: bool) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._profile.dump_stats(os.path.join(self.output_dir, 'cpu.pstats'))
+        stats_stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stats_stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        with open(os.path.join(self.output_dir, 'cpu_top.txt'), 'w') as cpu_file:
+            cpu_file.write(stats_stream.getvalue())
+
+        hottest = []
+        for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+            hottest.append({
+                'function': f'{os.path.basename(filename)}:{line}({function})',
+                'calls': ncalls,
+                'self_seconds': round(tottime, 4),
+                'cumulative_seconds': round(cumtime, 4)
+            })
+        hottest.sort(key=lambda entry: entry['self_seconds'], reverse=True)
+        hottest = hottest[:TOP_FUNCTIONS]
+
+        allocations = []
+        if snapshot is not None:
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                allocations.append({
+                    'location': f'{frame.filename}:{frame.lineno}',
+                    'size_bytes': stat.size,
+                    'count': stat.count
+                })
+
+        self.summary = {
+            'dag_id': self.dag_id,
+            'task_id': self.task_id,
+            'run_id': self.run_id,
+            'failed': failed,
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            'traced_peak_bytes': traced_peak,
+            'peak_rss_bytes': get_peak_rss_bytes(),
+            'stages': self.stages,
+            'hottest_functions': hottest,
+            'top_allocations': allocations
+        }
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w') as summary_file:
+            json.dump(self.summary, summary_file, indent=2)
+
+        lines = [
+            f"Profile for {self.dag_id}.{self.task_id}: wall {format_duration(wall)}, "
+            f"cpu {format_duration(cpu)}, traced peak {format_bytes(traced_peak)} -> {self.output_dir}"
+        ]
+        for entry in self.stages:
+            lines.append(f"  stage {entry['stage']}: wall {entry['wall_seconds']}s, cpu {entry['cpu_seconds']}s")
+        for entry in hottest[:5]:
+            lines.append(
+                f"  hot {entry['function']}: self {entry['self_seconds']}s, "
+                f"cum {entry['cumulative_seconds']}s, calls {entry['calls']}"
+            )
+        for entry in allocations[:5]:
+            lines.append(f"  alloc {entry['location']}: {format_bytes(entry['size_bytes'])} in {entry['count']} blocks")
+        self.logger.info('\n'.join(lines))
+
+
+def current_profiler() -> Optional[TaskProfiler]:
+    """Return the profiler active on this thread, if any"""
+    return getattr(_local, 'profiler', None)
+
+
+def task_stage(name: str):
+    """Time a stage when profiling is active; a no-op context otherwise"""
+    profiler = current_profiler()
+    return profiler.stage(name) if profiler else nullcontext()
+
+
+def profile_task(dag_id: str, task_id: Optional[str] = None):
+    """Decorator profiling an Airflow python_callable when profiling is enabled"""
+
+    def decorator(func):
+        name = task_id or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiling_enabled(name, kwargs):
+                return func(*args, **kwargs)
+            run_id = kwargs.get('run_id') or getattr(kwargs.get('dag_run'), 'run_id', None)
+            with TaskProfiler(dag_id, name, run_id=run_id):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
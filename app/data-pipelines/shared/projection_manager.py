@@ -0,0 +1,325 @@
+"""
+Projection and data-skipping index manager for ANDI warehouse tables
+
+``facts_ciq_sessions`` is ordered by (district_id, school_id, teacher_id,
+session_date), so a teacher drill-down that filters on teacher_id alone, or
+a date-range query without a district, cannot use the primary key and
+reads most granules of every partition it touches. This module finds those
+query shapes in ``system.query_log`` and proposes fixes:
+
+- a reordered projection (``SELECT * ORDER BY ...``) for shapes whose
+  equality filters skip the primary key prefix
+- an aggregate projection for GROUP BY shapes, grouped by their filter and
+  grouping columns so the optimizer can answer them from the projection
+- a skipping index (bloom_filter, set or minmax, chosen by column type and
+  cardinality) for selective filters on columns outside the key
+
+Proposals are ranked by the rows the matching shapes read per day. Applying
+one adds it, materializes it for existing parts, and replays each matching
+shape's sample query before and after to report rows read and latency:
+
+    python shared/projection_manager.py --table facts_ciq_sessions --days 7
+    python shared/projection_manager.py --apply proj_by_teacher_id_session_date --output result.json
+"""
+
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from utils import setup_logging
+from connections import db_connections
+
+
+DEFAULT_TABLE = 'facts_ciq_sessions'
+MIN_EXECUTIONS = 5
+MAX_SHAPES = 200
+# A shape reading more than this many rows per result row is worth indexing for
+MIN_READ_AMPLIFICATION = 50
+# Equality-filter columns above this sampled cardinality get a bloom filter, below it a set index
+SET_INDEX_MAX_CARDINALITY = 1000
+REPLAY_REPEATS = 3
+MUTATION_TIMEOUT_SECONDS = 3600
+
+AGGREGATE_PATTERN = re.compile(r'\b(count|sum|avg|min|max|uniq|uniqExact|countDistinct)\s*\(\s*([\w.]*)\s*\)', re.IGNORECASE)
+# Canonical spelling per aggregate; countDistinct is stored as its uniqExact implementation
+AGGREGATE_NAMES = {
+    'count': 'count', 'sum': 'sum', 'avg': 'avg', 'min': 'min', 'max': 'max',
+    'uniq': 'uniq', 'uniqexact': 'uniqExact', 'countdistinct': 'uniqExact'
+}
+# Subquery clauses run on into the outer query; over-including columns only widens a proposal
+CLAUSE_END = r'(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bSETTINGS\b|\bFORMAT\b|\bUNION\b|$)'
+FILTER_PATTERN = re.compile(r'\b(?:PRE)?WHERE\b(.*?)' + CLAUSE_END, re.IGNORECASE | re.DOTALL)
+GROUP_PATTERN = re.compile(r'\bGROUP\s+BY\b(.*?)' + CLAUSE_END, re.IGNORECASE | re.DOTALL)
+
+SHAPES_QUERY = """
+SELECT
+    normalized_query_hash,
+    any(query) as sample_query,
+    count() as executions,
+    count() / greatest(dateDiff('day', min(event_time), max(event_time)), 1) as executions_per_day,
+    quantile(0.5)(query_duration_ms) as p50_ms,
+    quantile(0.99)(query_duration_ms) as p99_ms,
+    avg(read_rows) as avg_read_rows,
+    avg(result_rows) as avg_result_rows
+FROM system.query_log
+WHERE type = 'QueryFinish'
+  AND query_kind = 'Select'
+  AND event_date >= today() - %(days)s
+  AND has(tables, %(qualified_table)s)
+  AND NOT has(databases, 'system')
+GROUP BY normalized_query_hash
+HAVING executions >= %(min_executions)s
+ORDER BY sum(read_rows) DESC
+LIMIT %(max_shapes)s
+"""
+
+logger = setup_logging('projection_manager')
+
+
+def describe_table(client, database: str, table: str) -> Dict[str, Any]:
+    """Primary key, columns, existing projections and skipping indexes"""
+    primary_key, create_query, total_rows = client.query(
+        "SELECT primary_key, create_table_query, total_rows FROM system.tables WHERE database = %(db)s AND name = %(table)s",
+        parameters={'db': database, 'table': table}
+    ).result_rows[0]
+    columns = dict(client.query(
+        "SELECT name, type FROM system.columns WHERE database = %(db)s AND table = %(table)s",
+        parameters={'db': database, 'table': table}
+    ).result_rows)
+    indexes = client.query(
+        "SELECT name, expr, type FROM system.data_skipping_indices WHERE database = %(db)s AND table = %(table)s",
+        parameters={'db': database, 'table': table}
+    ).result_rows
+    return {
+        'primary_key': [column.strip() for column in primary_key.split(',') if column.strip()],
+        'columns': columns,
+        'projections': re.findall(r'PROJECTION\s+(\w+)', create_query),
+        'indexed_columns': {expr.strip() for _, expr, _ in indexes},
+        'total_rows': total_rows or 0
+    }
+
+
+def _mentioned(columns: List[str], text: str, pattern: str) -> List[str]:
+    return [column for column in columns if re.search(pattern.format(column=re.escape(column)), text, re.IGNORECASE)]
+
+
+def parse_shape(query: str, columns: List[str]) -> Dict[str, Any]:
+    """Equality / range filter columns, grouping columns and aggregates of a query (regex heuristics)"""
+    filters = ' '.join(FILTER_PATTERN.findall(query))
+    groups = ' '.join(GROUP_PATTERN.findall(query))
+    return {
+        'eq': _mentioned(columns, filters, r'\b{column}\s*(=|\bIN\b)'),
+        'range': _mentioned(columns, filters, r'\b{column}\s*(>=|<=|>|<|\bBETWEEN\b)'),
+        'group_by': _mentioned(columns, groups, r'\b{column}\b'),
+        'aggregates': sorted({
+            f"{AGGREGATE_NAMES[name.lower()]}({argument.split('.')[-1]})" for name, argument in AGGREGATE_PATTERN.findall(query)
+            if not argument or argument.split('.')[-1] in columns
+        })
+    }
+
+
+def uses_key_prefix(shape: Dict[str, Any], primary_key: List[str]) -> bool:
+    """Whether the filters can narrow the primary key index (leading key column constrained)"""
+    return bool(primary_key) and primary_key[0] in shape['eq'] + shape['range']
+
+
+def collect_query_shapes(client, database: str, table: str, days: int = 7,
+                         min_executions: int = MIN_EXECUTIONS) -> List[Dict[str, Any]]:
+    result = client.query(
+        SHAPES_QUERY,
+        parameters={
+            'days': days, 'qualified_table': f'{database}.{table}',
+            'min_executions': min_executions, 'max_shapes': MAX_SHAPES
+        }
+    )
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+def sampled_cardinality(client, database: str, table: str, column: str, sample_rows: int = 1_000_000) -> int:
+    return int(client.query(
+        f'SELECT uniq(`{column}`) FROM (SELECT `{column}` FROM {database}.{table} LIMIT {int(sample_rows)})'
+    ).result_rows[0][0])
+
+
+def _add_proposal(proposals: Dict[str, Dict[str, Any]], name: str, kind: str, ddl: str, shape: Dict[str, Any]):
+    proposal = proposals.setdefault(name, {'name': name, 'kind': kind, 'ddl': ddl, 'shapes': [], 'rows_read_per_day': 0.0})
+    proposal['shapes'].append(shape['normalized_query_hash'])
+    proposal['rows_read_per_day'] += shape['avg_read_rows'] * shape['executions_per_day']
+
+
+def propose(client, database: str, table: str, shapes: List[Dict[str, Any]], description: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Projections and skipping indexes for shapes the primary key serves poorly, most rows first"""
+    columns = list(description['columns'])
+    primary_key = description['primary_key']
+    proposals: Dict[str, Dict[str, Any]] = {}
+    cardinalities: Dict[str, int] = {}
+
+    for shape in shapes:
+        parsed = parse_shape(shape['sample_query'], columns)
+        shape['parsed'] = parsed
+        amplification = shape['avg_read_rows'] / max(shape['avg_result_rows'], 1)
+        if uses_key_prefix(parsed, primary_key) or amplification < MIN_READ_AMPLIFICATION:
+            continue
+
+        # Equality columns first, then range columns, mirroring how the key would prune them
+        order = list(dict.fromkeys(parsed['eq'] + parsed['range']))
+        if parsed['group_by'] and parsed['aggregates']:
+            keys = list(dict.fromkeys(order + parsed['group_by']))
+            name = 'proj_agg_' + '_'.join(keys)
+            aggregates = ', '.join(parsed['aggregates'])
+            ddl = f'ALTER TABLE {database}.{table} ADD PROJECTION IF NOT EXISTS {name} (SELECT {", ".join(keys)}, {aggregates} GROUP BY {", ".join(keys)})'
+            if name not in description['projections']:
+                _add_proposal(proposals, name, 'aggregate_projection', ddl, shape)
+        elif order:
+            name = 'proj_by_' + '_'.join(order)
+            ddl = f'ALTER TABLE {database}.{table} ADD PROJECTION IF NOT EXISTS {name} (SELECT * ORDER BY ({", ".join(order)}))'
+            if name not in description['projections']:
+                _add_proposal(proposals, name, 'ordered_projection', ddl, shape)
+
+        # A skipping index is the cheaper alternative for single-column filters
+        for column in order:
+            if column in description['indexed_columns'] or column in primary_key:
+                continue
+            column_type = description['columns'][column]
+            if column in parsed['range'] and column not in parsed['eq']:
+                index_type = 'minmax'
+            else:
+                if column not in cardinalities:
+                    cardinalities[column] = sampled_cardinality(client, database, table, column)
+                index_type = f'set({SET_INDEX_MAX_CARDINALITY})' if cardinalities[column] <= SET_INDEX_MAX_CARDINALITY else 'bloom_filter(0.01)'
+            if index_type.startswith('bloom') and not re.match(r'^(UUID|String|LowCardinality|U?Int|FixedString)', column_type):
+                continue
+            name = f'idx_{column}_{index_type.split("(")[0]}'
+            ddl = f'ALTER TABLE {database}.{table} ADD INDEX IF NOT EXISTS {name} {column} TYPE {index_type} GRANULARITY 4'
+            _add_proposal(proposals, name, 'skipping_index', ddl, shape)
+
+    return sorted(proposals.values(), key=lambda proposal: proposal['rows_read_per_day'], reverse=True)
+
+
+def replay(client, query: str, repeats: int = REPLAY_REPEATS) -> Dict[str, Any]:
+    """Rows/bytes read and median latency of a sample query, with caches bypassed"""
+    timings = []
+    summary: Dict[str, Any] = {}
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = client.query(query, settings={'use_query_cache': 0, 'use_uncompressed_cache': 0})
+        timings.append(time.perf_counter() - started)
+        summary = result.summary or {}
+    return {
+        'read_rows': int(summary.get('read_rows', 0)),
+        'read_bytes': int(summary.get('read_bytes', 0)),
+        'median_ms': round(statistics.median(timings) * 1000, 2)
+    }
+
+
+def wait_for_mutations(client, database: str, table: str, timeout: float = MUTATION_TIMEOUT_SECONDS):
+    """Block until MATERIALIZE mutations on the table finish (or fail)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pending = client.query(
+            """
+            SELECT count(), any(latest_fail_reason)
+            FROM system.mutations
+            WHERE database = %(db)s AND table = %(table)s AND NOT is_done
+            """,
+            parameters={'db': database, 'table': table}
+        ).result_rows[0]
+        if not pending[0]:
+            return
+        if pending[1]:
+            raise RuntimeError(f"Materialization on {database}.{table} failing: {pending[1]}")
+        time.sleep(10)
+    raise TimeoutError(f"Materialization on {database}.{table} still running after {timeout:.0f}s")
+
+
+def apply_proposal(client, database: str, table: str, proposal: Dict[str, Any],
+                   shapes: List[Dict[str, Any]], materialize: bool = True) -> Dict[str, Any]:
+    """Add a proposal, materialize it and compare its shapes' sample queries before and after"""
+    samples = [shape for shape in shapes if shape['normalized_query_hash'] in proposal['shapes']]
+    before = {shape['normalized_query_hash']: replay(client, shape['sample_query']) for shape in samples}
+
+    client.command(proposal['ddl'])
+    if materialize:
+        target = 'PROJECTION' if proposal['kind'].endswith('projection') else 'INDEX'
+        client.command(f"ALTER TABLE {database}.{table} MATERIALIZE {target} {proposal['name']}")
+        wait_for_mutations(client, database, table)
+
+    comparisons = []
+    for shape in samples:
+        query_hash = shape['normalized_query_hash']
+        after = replay(client, shape['sample_query'])
+        comparisons.append({
+            'normalized_query_hash': query_hash,
+            'before': before[query_hash],
+            'after': after,
+            'read_rows_ratio': round(after['read_rows'] / before[query_hash]['read_rows'], 4) if before[query_hash]['read_rows'] else None
+        })
+        logger.info(
+            f"{proposal['name']} shape {query_hash}: rows read {before[query_hash]['read_rows']:,} -> {after['read_rows']:,}, "
+            f"{before[query_hash]['median_ms']}ms -> {after['median_ms']}ms"
+        )
+    return {'proposal': proposal['name'], 'ddl': proposal['ddl'], 'materialized': materialize, 'comparisons': comparisons}
+
+
+def analyze(client, database: str, table: str, days: int = 7) -> Dict[str, Any]:
+    description = describe_table(client, database, table)
+    shapes = collect_query_shapes(client, database, table, days)
+    proposals = propose(client, database, table, shapes, description)
+    served = sum(1 for shape in shapes if uses_key_prefix(shape['parsed'], description['primary_key']))
+    logger.info(
+        f"{database}.{table}: {len(shapes)} query shapes over {days} days, "
+        f"{served} use the primary key prefix, {len(proposals)} proposals"
+    )
+    return {'description': description, 'shapes': shapes, 'proposals': proposals}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Propose and apply projections / skipping indexes from system.query_log')
+    parser.add_argument('--table', default=DEFAULT_TABLE)
+    parser.add_argument('--database', default=db_connections.clickhouse_config['database'])
+    parser.add_argument('--days', type=int, default=7, help='query_log window to analyze')
+    parser.add_argument('--apply', nargs='*', metavar='NAME', help='Apply these proposals (all when no names given)')
+    parser.add_argument('--no-materialize', action='store_true', help='Add without materializing existing parts')
+    parser.add_argument('--output', help='Write the JSON report to this path (default: stdout)')
+    args = parser.parse_args(argv)
+
+    with db_connections.get_clickhouse_connection() as client:
+        analysis = analyze(client, args.database, args.table, args.days)
+        report: Dict[str, Any] = {
+            'tool': 'projection_manager',
+            'timestamp': datetime.now().isoformat(),
+            'table': f'{args.database}.{args.table}',
+            'primary_key': analysis['description']['primary_key'],
+            'shapes': analysis['shapes'],
+            'proposals': analysis['proposals'],
+            'applied': []
+        }
+        if args.apply is not None:
+            selected = [
+                proposal for proposal in analysis['proposals']
+                if not args.apply or proposal['name'] in args.apply
+            ]
+            for proposal in selected:
+                report['applied'].append(apply_proposal(
+                    client, args.database, args.table, proposal, analysis['shapes'], not args.no_materialize
+                ))
+
+    payload = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(payload)
+    else:
+        print(payload)
+
+    for proposal in report['proposals']:
+        print(f"{proposal['rows_read_per_day']:>16,.0f} rows/day  {proposal['ddl']};", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
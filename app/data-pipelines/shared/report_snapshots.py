@@ -0,0 +1,291 @@
+"""
+Report snapshot materialization for ANDI coach and teacher screens
+
+Builds one compact JSON payload per teacher (Teacher Performance) and per
+coach (Coach - My Teachers / Reports) from the daily teacher aggregates,
+rolling trends, weekly school metrics and ECI aggregates, and stores them in
+``report_snapshots`` keyed by (report_type, subject_id). Each payload
+carries a fingerprint of its inputs; only payloads whose fingerprint
+changed since the stored snapshot are rewritten, so a quiet day writes
+almost nothing. Stored subjects that no longer appear (a teacher with no
+sessions in the windows, a coach with no active assignments) are rewritten
+once with an empty payload rather than keeping their last figures.
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from batching import clickhouse_batch_insert
+
+
+SNAPSHOTS_TABLE = 'report_snapshots'
+SNAPSHOT_COLUMNS = ['report_type', 'subject_id', 'payload', 'input_hash', 'etl_batch_id']
+
+TEACHER_REPORT = 'teacher_performance'
+COACH_REPORT = 'coach_my_teachers'
+
+SUMMARY_DAYS = 30
+TREND_WEEKS = 12
+
+ECI_AVERAGES = {
+    'equity': 'avg_equity_score', 'creativity': 'avg_creativity_score',
+    'innovation': 'avg_innovation_score', 'weighted_ciq': 'avg_weighted_ciq',
+    'e1': 'avg_e1_identity', 'e2': 'avg_e2_safety', 'e3': 'avg_e3_access',
+    'e4': 'avg_e4_voice', 'e5': 'avg_e5_collaboration',
+    'c6': 'avg_c6_expression', 'c7': 'avg_c7_experimentation', 'c8': 'avg_c8_active_learning',
+    'c9': 'avg_c9_skill_development', 'c10': 'avg_c10_imagination',
+    'i11': 'avg_i11_possibility', 'i12': 'avg_i12_connections', 'i13': 'avg_i13_change_making',
+    'i14': 'avg_i14_impact', 'i15': 'avg_i15_improvement'
+}
+
+DAILY_QUERY = """
+SELECT
+    toString(teacher_id) as teacher_id,
+    toString(argMax(school_id, performance_date)) as school_id,
+    toString(argMax(district_id, performance_date)) as district_id,
+    sum(session_count) as sessions,
+    sum(avg_overall_score * session_count) / nullIf(sum(session_count), 0) as avg_overall_score,
+    sum(avg_equity_score * session_count) / nullIf(sum(session_count), 0) as avg_equity_score,
+    sum(avg_student_engagement * session_count) / nullIf(sum(session_count), 0) as avg_student_engagement,
+    max(performance_date) as last_session_date
+FROM agg_daily_teacher_performance
+WHERE performance_date >= %(since)s
+GROUP BY teacher_id
+"""
+
+ROLLING_QUERY = """
+SELECT
+    toString(teacher_id) as teacher_id, week_start_date, week_sessions, week_avg_score,
+    rolling_4w_avg_score, rolling_12w_avg_score, rolling_4w_delta,
+    school_rank, district_rank, district_percentile
+FROM agg_rolling_teacher_trends FINAL
+WHERE week_start_date >= %(since)s
+ORDER BY teacher_id, week_start_date
+"""
+
+SCHOOL_QUERY = """
+SELECT
+    toString(school_id) as school_id,
+    max(week_start_date) as week_start_date,
+    argMax(avg_school_overall_score, week_start_date) as avg_school_overall_score,
+    argMax(active_teachers, week_start_date) as active_teachers
+FROM agg_weekly_school_metrics
+WHERE week_start_date >= %(since)s
+GROUP BY school_id
+"""
+
+ECI_QUERY = f"""
+SELECT
+    teacher_id,
+    sum(total_sessions) as sessions,
+    {', '.join(
+        f'sum({column} * total_sessions) / nullIf(sum(total_sessions), 0) as {column}'
+        for column in ECI_AVERAGES.values()
+    )}
+FROM aggregates_daily_ciq_metrics
+WHERE metric_date >= %(since)s
+GROUP BY teacher_id
+"""
+
+ASSIGNMENTS_QUERY = """
+SELECT coach_id::text, teacher_id::text
+FROM core.coach_teacher_assignments
+WHERE is_active = true
+ORDER BY coach_id, teacher_id
+"""
+
+logger = setup_logging('report_snapshots')
+
+
+def _rows(client, query: str, since: date) -> List[Dict[str, Any]]:
+    result = client.query(query, parameters={'since': since})
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+def _round(value: Optional[float], digits: int = 2) -> Optional[float]:
+    return None if value is None else round(float(value), digits)
+
+
+def payload_hash(payload: Dict[str, Any]) -> Tuple[str, int]:
+    """Serialize a payload canonically and fingerprint it as a UInt64"""
+    document = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    digest = hashlib.blake2b(document.encode('utf-8'), digest_size=8).digest()
+    return document, int.from_bytes(digest, 'big')
+
+
+def _teacher_payload(
+    teacher_id: str,
+    summary: Dict[str, Any],
+    weeks: List[Dict[str, Any]],
+    school: Dict[str, Any],
+    eci_row: Dict[str, Any]
+) -> Dict[str, Any]:
+    latest = weeks[-1] if weeks else {}
+    return {
+        'teacher_id': teacher_id,
+        'school_id': summary.get('school_id'),
+        'district_id': summary.get('district_id'),
+        'summary': {
+            'sessions_30d': int(summary.get('sessions') or 0),
+            'avg_overall_score_30d': _round(summary.get('avg_overall_score')),
+            'avg_equity_score_30d': _round(summary.get('avg_equity_score')),
+            'avg_student_engagement_30d': _round(summary.get('avg_student_engagement')),
+            'last_session_date': summary.get('last_session_date'),
+            'rolling_4w_avg_score': _round(latest.get('rolling_4w_avg_score')),
+            'rolling_12w_avg_score': _round(latest.get('rolling_12w_avg_score')),
+            'rolling_4w_delta': _round(latest.get('rolling_4w_delta')),
+            'school_rank': latest.get('school_rank'),
+            'district_rank': latest.get('district_rank'),
+            'district_percentile': _round(latest.get('district_percentile'), 3)
+        },
+        'weekly_trend': [
+            {
+                'week': week['week_start_date'],
+                'sessions': week['week_sessions'],
+                'avg_score': _round(week['week_avg_score']),
+                'rolling_4w': _round(week['rolling_4w_avg_score'])
+            }
+            for week in weeks
+        ],
+        'eci': {name: _round(eci_row.get(column)) for name, column in ECI_AVERAGES.items()} if eci_row else None,
+        'school': {
+            'week_start_date': school.get('week_start_date'),
+            'avg_overall_score': _round(school.get('avg_school_overall_score')),
+            'active_teachers': school.get('active_teachers')
+        } if school else None
+    }
+
+
+def build_teacher_payloads(client, as_of: date) -> Dict[str, Dict[str, Any]]:
+    """teacher_id -> Teacher Performance payload, assembled from one query per source"""
+    daily = {row['teacher_id']: row for row in _rows(client, DAILY_QUERY, as_of - timedelta(days=SUMMARY_DAYS))}
+    schools = {row['school_id']: row for row in _rows(client, SCHOOL_QUERY, as_of - timedelta(weeks=2))}
+    eci = {row['teacher_id']: row for row in _rows(client, ECI_QUERY, as_of - timedelta(days=SUMMARY_DAYS))}
+    weekly: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for row in _rows(client, ROLLING_QUERY, as_of - timedelta(weeks=TREND_WEEKS)):
+        weekly[row.pop('teacher_id')].append(row)
+
+    payloads = {}
+    for teacher_id in set(daily) | set(weekly):
+        summary = daily.get(teacher_id, {})
+        payloads[teacher_id] = _teacher_payload(
+            teacher_id, summary, weekly.get(teacher_id, []),
+            schools.get(summary.get('school_id'), {}), eci.get(teacher_id, {})
+        )
+    return payloads
+
+
+def build_coach_payloads(
+    assignments: List[Tuple[str, str]],
+    teacher_payloads: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """coach_id -> My Teachers payload listing each assigned teacher's summary"""
+    teachers_by_coach: Dict[str, List[str]] = defaultdict(list)
+    for coach_id, teacher_id in assignments:
+        teachers_by_coach[coach_id].append(teacher_id)
+
+    payloads = {}
+    for coach_id, teacher_ids in teachers_by_coach.items():
+        teachers = []
+        for teacher_id in teacher_ids:
+            teacher = teacher_payloads.get(teacher_id)
+            summary = teacher['summary'] if teacher else {}
+            teachers.append({'teacher_id': teacher_id, 'school_id': teacher and teacher['school_id'], **summary})
+        payloads[coach_id] = _coach_payload(coach_id, teachers)
+    return payloads
+
+
+def _coach_payload(coach_id: str, teachers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    scores = [t['rolling_4w_avg_score'] for t in teachers if t.get('rolling_4w_avg_score') is not None]
+    return {
+        'coach_id': coach_id,
+        'teacher_count': len(teachers),
+        'active_teachers_30d': sum(1 for t in teachers if t.get('sessions_30d')),
+        'avg_rolling_4w_score': _round(sum(scores) / len(scores)) if scores else None,
+        'teachers_declining': sum(1 for t in teachers if (t.get('rolling_4w_delta') or 0) < -2.0),
+        'teachers_needing_support': sum(1 for score in scores if score < 65),
+        'teachers': teachers
+    }
+
+
+def empty_payload(report_type: str, subject_id: str) -> Dict[str, Any]:
+    """Payload for a subject with no data left in the report windows (inactive teacher, coach without teachers)"""
+    if report_type == TEACHER_REPORT:
+        return _teacher_payload(subject_id, {}, [], {}, {})
+    return _coach_payload(subject_id, [])
+
+
+def fetch_stored_hashes(client) -> Dict[Tuple[str, str], int]:
+    result = client.query(
+        f"""
+        SELECT report_type, toString(subject_id), argMax(input_hash, generated_at)
+        FROM {SNAPSHOTS_TABLE}
+        GROUP BY report_type, subject_id
+        """
+    )
+    return {(report_type, subject_id): input_hash for report_type, subject_id, input_hash in result.result_rows}
+
+
+def materialize_report_snapshots(
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    as_of: Optional[date] = None,
+    connections=None
+) -> Dict[str, Any]:
+    """Rebuild report payloads and write those whose inputs changed"""
+    connections = connections or db_connections
+    as_of = as_of or datetime.now().date()
+
+    with connections.get_postgres_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(ASSIGNMENTS_QUERY)
+            assignments = cursor.fetchall()
+
+    with connections.get_clickhouse_connection() as client:
+        teacher_payloads = build_teacher_payloads(client, as_of)
+        coach_payloads = build_coach_payloads(assignments, teacher_payloads)
+        stored = fetch_stored_hashes(client)
+
+        # Stored subjects that dropped out of the rebuild get an empty payload instead of keeping stale figures
+        rebuilt = {TEACHER_REPORT: teacher_payloads, COACH_REPORT: coach_payloads}
+        cleared: Dict[str, Dict[str, Dict[str, Any]]] = {TEACHER_REPORT: {}, COACH_REPORT: {}}
+        for report_type, subject_id in stored:
+            if report_type in rebuilt and subject_id not in rebuilt[report_type]:
+                cleared[report_type][subject_id] = empty_payload(report_type, subject_id)
+
+        changed = []
+        counts = {TEACHER_REPORT: 0, COACH_REPORT: 0}
+        emptied = {TEACHER_REPORT: 0, COACH_REPORT: 0}
+        for report_type in (TEACHER_REPORT, COACH_REPORT):
+            for subject_id, payload in {**rebuilt[report_type], **cleared[report_type]}.items():
+                document, input_hash = payload_hash(payload)
+                if stored.get((report_type, subject_id)) == input_hash:
+                    continue
+                changed.append([report_type, subject_id, document, input_hash, batch_id])
+                counts[report_type] += 1
+                emptied[report_type] += subject_id in cleared[report_type]
+
+        written = clickhouse_batch_insert(client, SNAPSHOTS_TABLE, changed, SNAPSHOT_COLUMNS) if changed else 0
+
+    if metrics is not None:
+        metrics.record_extraction(len(teacher_payloads) + len(coach_payloads))
+        metrics.record_load(written)
+
+    logger.info(
+        f"Report snapshots: {counts[TEACHER_REPORT]}/{len(teacher_payloads) + len(cleared[TEACHER_REPORT])} teacher "
+        f"and {counts[COACH_REPORT]}/{len(coach_payloads) + len(cleared[COACH_REPORT])} coach payloads changed "
+        f"({emptied[TEACHER_REPORT]} teacher and {emptied[COACH_REPORT]} coach snapshots emptied)"
+    )
+    return {
+        'teacher_payloads': len(teacher_payloads),
+        'coach_payloads': len(coach_payloads),
+        'teacher_written': counts[TEACHER_REPORT],
+        'coach_written': counts[COACH_REPORT],
+        'teacher_emptied': emptied[TEACHER_REPORT],
+        'coach_emptied': emptied[COACH_REPORT]
+    }
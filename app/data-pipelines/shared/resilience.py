@@ -0,0 +1,290 @@
+"""
+Retry, deadline and circuit-breaker policy for ANDI data pipelines
+
+Database calls are retried with full-jitter exponential backoff, so the
+overlapping ``andi_ciq_sync`` runs spread out instead of reconnecting in
+lockstep after a Postgres or ClickHouse blip. Retries stop at a deadline,
+by default the task's own ``execution_timeout`` minus a safety margin
+(``task_deadline``), instead of sleeping through it. Errors are classified
+first: only transient ones (dropped connections, deadlocks, memory or
+concurrency limits, timeouts) are retried; syntax, type and constraint
+errors fail immediately.
+
+Each endpoint has a circuit breaker shared by every thread in the worker.
+After ``failure_threshold`` consecutive transient failures it opens and
+calls fail fast with ``CircuitOpenError`` until ``reset_timeout`` passes;
+one probe call is then let through and closes it again on success.
+"""
+
+import random
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Dict, Any, Callable, Optional
+
+import psycopg2
+from clickhouse_connect.driver import exceptions as ch_exceptions
+
+from utils import ETLMetrics, setup_logging
+
+
+BASE_DELAY_SECONDS = 0.5
+MAX_DELAY_SECONDS = 30.0
+MAX_ATTEMPTS = 6
+# Retry budget for calls made outside a task_deadline scope
+DEFAULT_BUDGET_SECONDS = 120.0
+# Leave time for the task to report its own failure before Airflow kills it
+DEADLINE_MARGIN_SECONDS = 30.0
+
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT_SECONDS = 30.0
+
+# SQLSTATE classes / codes worth retrying: connection exceptions, serialization failures and
+# deadlocks, insufficient resources, lock timeouts, operator intervention (shutdown, recovery)
+TRANSIENT_PG_CLASSES = ('08', '53', '57P')
+TRANSIENT_PG_CODES = {'40001', '40P01', '55P03', '57014'}
+
+# ClickHouse server error codes worth retrying
+TRANSIENT_CH_CODES = {
+    3,    # UNEXPECTED_END_OF_FILE
+    159,  # TIMEOUT_EXCEEDED
+    164,  # READONLY (replica lost its Keeper session)
+    202,  # TOO_MANY_SIMULTANEOUS_QUERIES
+    209,  # SOCKET_TIMEOUT
+    210,  # NETWORK_ERROR
+    241,  # MEMORY_LIMIT_EXCEEDED
+    242,  # TABLE_IS_READ_ONLY
+    252,  # TOO_MANY_PARTS
+    285,  # TOO_FEW_LIVE_REPLICAS
+    319,  # UNKNOWN_STATUS_OF_INSERT
+    425,  # SYSTEM_ERROR
+    999,  # KEEPER_EXCEPTION
+}
+CH_CODE_PATTERN = re.compile(r'Code:\s*(\d+)')
+
+logger = setup_logging('resilience')
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling an endpoint whose circuit is open"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Circuit for {endpoint} is open, retry after {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def clickhouse_error_code(exc: BaseException) -> Optional[int]:
+    match = CH_CODE_PATTERN.search(str(exc))
+    return int(match.group(1)) if match else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether retrying the failed call could succeed"""
+    if isinstance(exc, CircuitOpenError):
+        return True
+
+    if isinstance(exc, psycopg2.Error):
+        code = exc.pgcode
+        if code:
+            return code in TRANSIENT_PG_CODES or code.startswith(TRANSIENT_PG_CLASSES)
+        # No SQLSTATE means the client lost the connection before the server answered
+        return isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    if isinstance(exc, ch_exceptions.ClickHouseError):
+        code = clickhouse_error_code(exc)
+        if code is not None:
+            return code in TRANSIENT_CH_CODES
+        # HTTP transport failures and broken result streams carry no server code
+        return isinstance(exc, (ch_exceptions.OperationalError, ch_exceptions.StreamFailureError))
+
+    return isinstance(exc, (ConnectionError, TimeoutError, socket.timeout))
+
+
+class Deadline:
+    """Absolute point in (monotonic) time after which no further retries start"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + max(seconds, 0.0)
+
+    @classmethod
+    def from_context(cls, context: Dict[str, Any], margin: float = DEADLINE_MARGIN_SECONDS) -> 'Deadline':
+        """Deadline at the task's execution_timeout, measured from the task instance start"""
+        task = context.get('task')
+        timeout = getattr(task, 'execution_timeout', None)
+        if timeout is None:
+            return cls(DEFAULT_BUDGET_SECONDS)
+        started = getattr(context.get('task_instance'), 'start_date', None) or datetime.now(timezone.utc)
+        elapsed = (datetime.now(timezone.utc) - started).total_seconds()
+        return cls(timeout.total_seconds() - elapsed - margin)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('andi_task_deadline', default=None)
+
+
+@contextmanager
+def task_deadline(context: Dict[str, Any], margin: float = DEADLINE_MARGIN_SECONDS):
+    """Bound every retry inside the block by the running task's execution_timeout"""
+    deadline = Deadline.from_context(context, margin)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Deadline:
+    return _current_deadline.get() or Deadline(DEFAULT_BUDGET_SECONDS)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one endpoint, safe to share across threads"""
+
+    def __init__(self, endpoint: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT_SECONDS):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half_open'
+
+    def before_call(self):
+        """Admit the call or raise CircuitOpenError; in half-open only one probe is admitted"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_timeout:
+                raise CircuitOpenError(self.endpoint, self.reset_timeout - waited)
+            if self._probing:
+                raise CircuitOpenError(self.endpoint, BASE_DELAY_SECONDS)
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit for {self.endpoint} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    logger.warning(f"Circuit for {self.endpoint} opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """Let the next call probe again when this one failed for a non-endpoint reason"""
+        with self._lock:
+            self._probing = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """Worker-wide breaker for an endpoint (created on first use)"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def backoff_delay(attempt: int, base: float = BASE_DELAY_SECONDS, cap: float = MAX_DELAY_SECONDS) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0.0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retries(
+    func: Callable[..., Any],
+    *args,
+    endpoint: str,
+    deadline: Optional[Deadline] = None,
+    max_attempts: int = MAX_ATTEMPTS,
+    metrics: Optional[ETLMetrics] = None,
+    **kwargs
+) -> Any:
+    """Call ``func`` through the endpoint's breaker, retrying transient errors until the deadline"""
+    breaker = circuit_breaker(endpoint)
+    deadline = deadline or current_deadline()
+
+    for attempt in range(max_attempts):
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            if attempt + 1 >= max_attempts or e.retry_after >= deadline.remaining():
+                raise
+            time.sleep(e.retry_after + backoff_delay(0))
+            continue
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                breaker.release_probe()
+                raise
+            breaker.record_failure()
+
+            delay = backoff_delay(attempt)
+            if attempt + 1 >= max_attempts or delay >= deadline.remaining():
+                logger.error(f"{endpoint}: giving up after {attempt + 1} attempts: {e}")
+                raise
+            if metrics is not None:
+                metrics.record_retry()
+            logger.warning(f"{endpoint}: transient error on attempt {attempt + 1}, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            continue
+
+        breaker.record_success()
+        return result
+
+
+def resilient(endpoint: str, max_attempts: int = MAX_ATTEMPTS):
+    """Decorator form of call_with_retries using the ambient task deadline"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call_with_retries(func, *args, endpoint=endpoint, max_attempts=max_attempts, **kwargs)
+        return wrapper
+    return decorator
+
+
+def fail_fast_if_permanent(exc: BaseException):
+    """Turn a permanent database error into AirflowFailException so Airflow does not retry the task"""
+    # Only database errors are classified; timeouts and other task failures keep Airflow's retries
+    if not isinstance(exc, (psycopg2.Error, ch_exceptions.ClickHouseError)) or is_transient(exc):
+        return
+    try:
+        from airflow.exceptions import AirflowFailException
+    except ImportError:
+        return
+    raise AirflowFailException(f"Permanent error, not retrying: {exc}") from exc
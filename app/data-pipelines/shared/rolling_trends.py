@@ -0,0 +1,201 @@
+"""
+Rolling trend precomputation for ANDI coach dashboards
+
+Maintains ``agg_rolling_teacher_trends`` and ``agg_rolling_school_trends``:
+session-weighted rolling 4/12-week averages, their deltas and
+school/district ranks, stored per week. Only windows touched by new
+sessions are recomputed: for every district with sessions loaded since the
+last run (by the fact row's ingest time, so re-scored old sessions count), weeks from the earliest touched week forward are rebuilt (ranks
+need the whole district), reading just enough history for the 12-week
+window and its delta. Rows are rewritten into ReplacingMergeTree tables, so
+the latest computation wins.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+import pandas as pd
+
+from utils import ETLMetrics, setup_logging
+from connections import db_connections
+from batching import clickhouse_batch_insert
+from event_streams import get_watermark, set_watermark
+
+
+WINDOWS = (4, 12)
+# History needed before the first rebuilt week: the 12-week window plus its 12-week delta
+LOOKBACK_WEEKS = 2 * max(WINDOWS) - 1
+# Re-scanned ingest-time overlap, covering rows whose insert straddled the previous run's start
+WATERMARK_OVERLAP = timedelta(days=2)
+WATERMARK_STREAM = 'agg_rolling_trends'
+
+TEACHER_TABLE = 'agg_rolling_teacher_trends'
+SCHOOL_TABLE = 'agg_rolling_school_trends'
+
+TREND_COLUMNS = [
+    'week_sessions', 'week_avg_score',
+    'rolling_4w_sessions', 'rolling_4w_avg_score', 'rolling_12w_sessions', 'rolling_12w_avg_score',
+    'rolling_4w_delta', 'rolling_12w_delta'
+]
+TEACHER_COLUMNS = [
+    'week_start_date', 'teacher_id', 'school_id', 'district_id', *TREND_COLUMNS,
+    'school_rank', 'district_rank', 'district_percentile', 'etl_batch_id'
+]
+SCHOOL_COLUMNS = [
+    'week_start_date', 'school_id', 'district_id', *TREND_COLUMNS,
+    'district_rank', 'district_percentile', 'etl_batch_id'
+]
+
+logger = setup_logging('rolling_trends')
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def find_touched_districts(client, since: datetime) -> Dict[str, date]:
+    """district_id -> earliest week with session rows loaded after ``since``"""
+    result = client.query(
+        """
+        SELECT toString(district_id), min(toMonday(session_date))
+        FROM facts_ciq_sessions
+        -- updated_at is the load time (DEFAULT now()); created_at is the source session's creation,
+        -- which stays old when the extractor re-pulls a session for new metrics
+        WHERE updated_at > %(since)s
+        GROUP BY district_id
+        """,
+        parameters={'since': since}
+    )
+    return {district_id: first_week for district_id, first_week in result.result_rows}
+
+
+def fetch_weekly_teacher_sums(client, districts: List[str], start: date) -> pd.DataFrame:
+    """Per teacher-week session counts and score sums (sums keep the rolling averages session-weighted)"""
+    result = client.query(
+        """
+        SELECT
+            toMonday(session_date) as week_start_date,
+            toString(teacher_id) as teacher_id,
+            toString(argMax(school_id, session_date)) as school_id,
+            toString(district_id) as district_id,
+            count() as sessions,
+            sum(overall_score) as score_sum
+        FROM facts_ciq_sessions
+        WHERE district_id IN %(districts)s AND session_date >= %(start)s
+        GROUP BY district_id, teacher_id, week_start_date
+        """,
+        parameters={'districts': districts, 'start': start}
+    )
+    return pd.DataFrame(result.result_rows, columns=result.column_names)
+
+
+def compute_rolling(weekly: pd.DataFrame, entity: str, weeks: pd.DatetimeIndex) -> pd.DataFrame:
+    """Rolling windows for every entity over a dense week range.
+
+    ``weekly`` has one row per (entity, week_start_date) with ``sessions``
+    and ``score_sum``; weeks without sessions count as empty.
+    """
+    sessions = weekly.pivot_table(
+        index='week_start_date', columns=entity, values='sessions', aggfunc='sum', fill_value=0
+    ).reindex(weeks, fill_value=0)
+    score_sums = weekly.pivot_table(
+        index='week_start_date', columns=entity, values='score_sum', aggfunc='sum', fill_value=0.0
+    ).reindex(weeks, fill_value=0.0)
+
+    frames = {
+        'week_sessions': sessions,
+        'week_avg_score': score_sums / sessions.where(sessions > 0)
+    }
+    for window in WINDOWS:
+        window_sessions = sessions.rolling(window, min_periods=1).sum()
+        window_avg = score_sums.rolling(window, min_periods=1).sum() / window_sessions.where(window_sessions > 0)
+        frames[f'rolling_{window}w_sessions'] = window_sessions
+        frames[f'rolling_{window}w_avg_score'] = window_avg
+        frames[f'rolling_{window}w_delta'] = window_avg - window_avg.shift(window)
+
+    stacked = pd.concat({name: frame.stack(future_stack=True) for name, frame in frames.items()}, axis=1)
+    stacked.index.names = ['week_start_date', entity]
+    stacked = stacked.reset_index()
+    # Entities drop out once their 12-week window is empty
+    return stacked[stacked[f'rolling_{max(WINDOWS)}w_sessions'] > 0]
+
+
+def add_ranks(df: pd.DataFrame, group_columns: List[str], prefix: str) -> pd.DataFrame:
+    grouped = df.groupby(group_columns)['rolling_4w_avg_score']
+    df[f'{prefix}_rank'] = grouped.rank(method='min', ascending=False).fillna(0).astype('uint32')
+    if prefix == 'district':
+        df['district_percentile'] = grouped.rank(method='max', pct=True).fillna(0.0)
+    return df
+
+
+def _finalize(df: pd.DataFrame, first_weeks: Dict[str, date], batch_id: str) -> pd.DataFrame:
+    first = df['district_id'].map(first_weeks)
+    df = df[df['week_start_date'].dt.date >= first].copy()
+    df['week_start_date'] = df['week_start_date'].dt.date
+    for column in ('week_sessions', 'rolling_4w_sessions', 'rolling_12w_sessions'):
+        df[column] = df[column].astype('uint32')
+    for column in ('week_avg_score', 'rolling_4w_avg_score', 'rolling_12w_avg_score',
+                   'rolling_4w_delta', 'rolling_12w_delta'):
+        df[column] = df[column].fillna(0.0)
+    df['etl_batch_id'] = batch_id
+    return df
+
+
+def rebuild_trends(client, first_weeks: Dict[str, date], through: date, batch_id: str = '') -> Dict[str, int]:
+    """Recompute teacher and school rolling rows from each district's first touched week"""
+    start = min(first_weeks.values()) - timedelta(weeks=LOOKBACK_WEEKS)
+    weekly = fetch_weekly_teacher_sums(client, list(first_weeks), start)
+    if weekly.empty:
+        return {'teacher_rows': 0, 'school_rows': 0}
+
+    weekly['week_start_date'] = pd.to_datetime(weekly['week_start_date'])
+    weeks = pd.date_range(start, week_start(through), freq='W-MON')
+
+    # Teachers keep their most recent school for grouping
+    placement = weekly.sort_values('week_start_date').groupby('teacher_id')[['school_id', 'district_id']].last()
+    teachers = compute_rolling(weekly, 'teacher_id', weeks).join(placement, on='teacher_id')
+    teachers = add_ranks(teachers, ['school_id', 'week_start_date'], 'school')
+    teachers = add_ranks(teachers, ['district_id', 'week_start_date'], 'district')
+    teachers = _finalize(teachers, first_weeks, batch_id)
+
+    school_district = weekly.groupby('school_id')['district_id'].last()
+    schools = compute_rolling(weekly, 'school_id', weeks).join(school_district, on='school_id')
+    schools = add_ranks(schools, ['district_id', 'week_start_date'], 'district')
+    schools = _finalize(schools, first_weeks, batch_id)
+
+    teacher_rows = clickhouse_batch_insert(
+        client, TEACHER_TABLE, teachers[TEACHER_COLUMNS].astype(object).itertuples(index=False, name=None), TEACHER_COLUMNS
+    )
+    school_rows = clickhouse_batch_insert(
+        client, SCHOOL_TABLE, schools[SCHOOL_COLUMNS].astype(object).itertuples(index=False, name=None), SCHOOL_COLUMNS
+    )
+    return {'teacher_rows': teacher_rows, 'school_rows': school_rows}
+
+
+def update_rolling_trends(
+    metrics: Optional[ETLMetrics] = None,
+    batch_id: str = '',
+    client=None
+) -> Dict[str, Any]:
+    """Incrementally refresh rolling trends for districts with new sessions"""
+    if client is None:
+        with db_connections.get_clickhouse_connection() as ch_client:
+            return update_rolling_trends(metrics, batch_id, ch_client)
+
+    watermark, _ = get_watermark(client, WATERMARK_STREAM)
+    run_started = datetime.now(timezone.utc)
+    first_weeks = find_touched_districts(client, watermark - WATERMARK_OVERLAP)
+    if not first_weeks:
+        logger.info("No new sessions since last rolling trend update")
+        return {'districts': 0, 'teacher_rows': 0, 'school_rows': 0}
+
+    result = rebuild_trends(client, first_weeks, run_started.date(), batch_id)
+    if metrics is not None:
+        metrics.record_load(result['teacher_rows'] + result['school_rows'])
+    set_watermark(client, WATERMARK_STREAM, run_started, '', result['teacher_rows'], batch_id)
+
+    logger.info(
+        f"Rolling trends refreshed for {len(first_weeks)} districts: "
+        f"{result['teacher_rows']:,} teacher rows, {result['school_rows']:,} school rows"
+    )
+    return {'districts': len(first_weeks), **result}
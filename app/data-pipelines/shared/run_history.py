@@ -0,0 +1,170 @@
+"""
+Pipeline run history for ANDI data pipelines
+
+Persists one structured record per task run to the warehouse
+``pipeline_runs`` table and flags runs whose throughput regressed against
+the trailing median of earlier runs of the same task. Tasks that load no
+records (checks, validations) are compared on duration instead.
+"""
+
+import statistics
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+
+from utils import ETLMetrics, setup_logging, send_pipeline_alert
+from connections import db_connections
+from batching import clickhouse_batch_insert
+
+
+PIPELINE_RUNS_TABLE = 'pipeline_runs'
+
+PIPELINE_RUNS_COLUMNS = [
+    'run_date', 'started_at', 'finished_at', 'dag_id', 'task_id', 'run_id', 'pipeline',
+    'partition_key', 'status', 'duration_seconds', 'stage_seconds',
+    'records_extracted', 'records_transformed', 'records_loaded', 'records_failed', 'bytes_processed',
+    'batch_count', 'avg_batch_size', 'max_batch_size', 'retries',
+    'peak_memory_bytes', 'throughput_records_per_second', 'error_count', 'hostname'
+]
+
+logger = setup_logging('run_history')
+
+
+def write_pipeline_runs(records: List[Dict[str, Any]], client=None) -> int:
+    """Insert run records into pipeline_runs through the batched loader"""
+    rows = ([record[column] for column in PIPELINE_RUNS_COLUMNS] for record in records)
+    if client is not None:
+        return clickhouse_batch_insert(client, PIPELINE_RUNS_TABLE, rows, PIPELINE_RUNS_COLUMNS)
+    with db_connections.get_clickhouse_connection() as ch_client:
+        return clickhouse_batch_insert(ch_client, PIPELINE_RUNS_TABLE, rows, PIPELINE_RUNS_COLUMNS)
+
+
+def record_pipeline_run(
+    metrics: ETLMetrics,
+    dag_id: str,
+    task_id: str,
+    context: Optional[Dict[str, Any]] = None,
+    partition: Optional[str] = None,
+    status: Optional[str] = None,
+    client=None
+) -> bool:
+    """Persist an ETLMetrics run record; never raises so it is safe in finally blocks"""
+    context = context or {}
+    run_id = context.get('run_id') or getattr(context.get('dag_run'), 'run_id', '') or ''
+    partition = partition if partition is not None else context.get('ds', '')
+
+    # Time between queueing and starting is mostly spent waiting for an Airflow pool slot
+    task_instance = context.get('task_instance')
+    queued_at = getattr(task_instance, 'queued_dttm', None)
+    started_at = getattr(task_instance, 'start_date', None)
+    if queued_at and started_at and started_at > queued_at:
+        metrics.record_stage_time('queue_wait.pool', (started_at - queued_at).total_seconds())
+    
+    try:
+        record = metrics.to_run_record(dag_id, task_id, run_id=run_id, partition=partition, status=status)
+        write_pipeline_runs([record], client=client)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to record pipeline run for {dag_id}.{task_id}: {e}")
+        return False
+
+
+def fetch_recent_runs(
+    client,
+    dag_id: Optional[str] = None,
+    task_id: Optional[str] = None,
+    lookback_days: int = 30
+) -> List[Dict[str, Any]]:
+    """Fetch successful runs ordered oldest-first per task"""
+    filters = ["status = 'success'", "run_date >= %(since)s"]
+    parameters: Dict[str, Any] = {'since': (datetime.now() - timedelta(days=lookback_days)).date()}
+    if dag_id:
+        filters.append('dag_id = %(dag_id)s')
+        parameters['dag_id'] = dag_id
+    if task_id:
+        filters.append('task_id = %(task_id)s')
+        parameters['task_id'] = task_id
+
+    query = f"""
+    SELECT dag_id, task_id, run_id, partition_key, started_at,
+           throughput_records_per_second, records_loaded, duration_seconds, peak_memory_bytes
+    FROM {PIPELINE_RUNS_TABLE}
+    WHERE {' AND '.join(filters)}
+    ORDER BY dag_id, task_id, started_at
+    """
+    result = client.query(query, parameters=parameters)
+    return [dict(zip(result.column_names, row)) for row in result.result_rows]
+
+
+def find_throughput_regressions(
+    runs: List[Dict[str, Any]],
+    threshold: float = 0.3,
+    window: int = 14,
+    min_history: int = 5,
+    min_duration_seconds: float = 10.0
+) -> List[Dict[str, Any]]:
+    """Flag runs whose throughput fell more than threshold below the trailing median.
+
+    Runs that loaded nothing are judged on duration: they regress when they take
+    more than threshold longer than their trailing median (ignoring baselines
+    under ``min_duration_seconds``). ``runs`` must be ordered oldest-first
+    within each (dag_id, task_id).
+    """
+    regressions = []
+    history: Dict[tuple, List[float]] = {}
+
+    for run in runs:
+        metric = 'throughput' if run['records_loaded'] > 0 else 'duration'
+        key = (run['dag_id'], run['task_id'], metric)
+        previous = history.setdefault(key, [])
+        value = run['throughput_records_per_second'] if metric == 'throughput' else run['duration_seconds']
+
+        if len(previous) >= min_history:
+            baseline = statistics.median(previous[-window:])
+            if metric == 'throughput':
+                regressed = baseline > 0 and value < baseline * (1 - threshold)
+            else:
+                regressed = baseline >= min_duration_seconds and value > baseline * (1 + threshold)
+            if regressed:
+                regressions.append({
+                    **run,
+                    'metric': metric,
+                    'trailing_median': baseline,
+                    'change': value / baseline - 1
+                })
+
+        previous.append(value)
+
+    return regressions
+
+
+def check_throughput_regressions(
+    dag_id: Optional[str] = None,
+    threshold: float = 0.3,
+    window: int = 14,
+    lookback_days: int = 30,
+    alert: bool = True
+) -> List[Dict[str, Any]]:
+    """Query run history, report regressions from the last day and optionally alert"""
+    with db_connections.get_clickhouse_connection() as client:
+        runs = fetch_recent_runs(client, dag_id=dag_id, lookback_days=lookback_days)
+
+    cutoff = datetime.now() - timedelta(days=1)
+    regressions = [
+        run for run in find_throughput_regressions(runs, threshold=threshold, window=window)
+        if run['started_at'].replace(tzinfo=None) >= cutoff
+    ]
+
+    if regressions and alert:
+        details = '\n'.join(
+            f"{run['dag_id']}.{run['task_id']} ({run['partition_key'] or run['run_id']}): "
+            + (
+                f"{run['throughput_records_per_second']:.1f} rec/s vs median {run['trailing_median']:.1f}"
+                if run['metric'] == 'throughput'
+                else f"{run['duration_seconds']:.1f}s vs median {run['trailing_median']:.1f}s"
+            )
+            + f" ({run['change']:+.0%})"
+            for run in regressions
+        )
+        send_pipeline_alert('Pipeline Throughput Regression', 'warning', details)
+
+    return regressions
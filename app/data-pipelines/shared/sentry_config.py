@@ -1,16 +1,30 @@
 """
 Sentry Configuration for ANDI Airflow Data Pipelines
 Python-based error tracking and performance monitoring for Airflow DAGs
+
+Pipeline metrics are aggregated in process: track_pipeline_metrics and
+track_stage only update per-stage counters and timings, and each task
+flushes them as one summarized span per stage. Task transactions are
+sampled up front at PIPELINE_TRACE_SAMPLE_RATE; an unsampled task that
+fails or runs longer than PIPELINE_SLOW_TASK_SECONDS is promoted when it
+finishes, so it is still sent with its stage summaries.
 """
 
 import os
 import logging
-from typing import Dict, Any, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Dict, Any, Optional, Tuple
 import sentry_sdk
 from sentry_sdk.integrations.logging import LoggingIntegration
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sentry_sdk.integrations.flask import FlaskIntegration
 
+from utils import setup_logging
+
 
 # Environment configuration
 SENTRY_DSN = os.getenv('SENTRY_DSN')
@@ -18,6 +32,18 @@ NODE_ENV = os.getenv('NODE_ENV', 'development')
 SENTRY_ENVIRONMENT = os.getenv('SENTRY_ENVIRONMENT', NODE_ENV)
 SENTRY_RELEASE = os.getenv('SENTRY_RELEASE', 'unknown')
 
+# Dynamic trace sampling
+TRACES_SAMPLE_RATE = 0.2 if NODE_ENV == 'production' else 1.0
+PIPELINE_TRACE_SAMPLE_RATE = float(os.getenv(
+    'PIPELINE_TRACE_SAMPLE_RATE', '0.05' if NODE_ENV == 'production' else '1.0'
+))
+SLOW_TASK_SECONDS = float(os.getenv('PIPELINE_SLOW_TASK_SECONDS', '300'))
+PIPELINE_TRANSACTION_OP = 'airflow_task'
+# Spans kept on a transaction promoted after it started unsampled (the SDK's default max_spans)
+PROMOTED_MAX_SPANS = 1000
+# Distinct warning messages a DAGLogger remembers for Sentry deduplication
+MAX_WARNED_MESSAGES = 256
+
 
 def initialize_sentry() -> None:
     """Initialize Sentry for Airflow data pipelines."""
@@ -44,8 +70,8 @@ def initialize_sentry() -> None:
         environment=SENTRY_ENVIRONMENT,
         release=SENTRY_RELEASE,
         
-        # Performance monitoring
-        traces_sample_rate=0.2 if NODE_ENV == 'production' else 1.0,
+        # Performance monitoring (task transactions are sampled when they finish)
+        traces_sampler=_traces_sampler,
         profiles_sample_rate=0.1 if NODE_ENV == 'production' else 1.0,
         
         # Integrations
@@ -69,6 +95,36 @@ def initialize_sentry() -> None:
     logging.info(f'Sentry initialized for Airflow pipelines ({SENTRY_ENVIRONMENT})')
 
 
+def _traces_sampler(sampling_context: Dict[str, Any]) -> float:
+    """Sample pipeline task transactions at PIPELINE_TRACE_SAMPLE_RATE, the rest at the base rate."""
+    parent_sampled = sampling_context.get('parent_sampled')
+    if parent_sampled is not None:
+        return float(parent_sampled)
+    
+    transaction_context = sampling_context.get('transaction_context') or {}
+    if transaction_context.get('op') == PIPELINE_TRANSACTION_OP:
+        return PIPELINE_TRACE_SAMPLE_RATE
+    return TRACES_SAMPLE_RATE
+
+
+def should_promote_trace(duration_seconds: float, failed: bool) -> bool:
+    """Tail sampling decision: an unsampled task run is still sent if it failed or was slow."""
+    return failed or duration_seconds >= SLOW_TASK_SECONDS
+
+
+def _promote_transaction(transaction) -> None:
+    # Unsampled transactions have no span recorder and are discarded on finish; spans started
+    # from here on (the stage summaries) are recorded, earlier ones were never kept
+    transaction.sampled = True
+    if getattr(transaction, '_span_recorder', None) is None:
+        transaction.init_span_recorder(maxlen=PROMOTED_MAX_SPANS)
+
+
+def _span_time(timestamp: float) -> datetime:
+    # sentry-sdk 1.x takes naive UTC datetimes for span start/end times
+    return datetime.utcfromtimestamp(timestamp)
+
+
 def _before_send_filter(event: Dict[str, Any], hint: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Filter Sentry events before sending."""
     
@@ -87,101 +143,205 @@ def _before_send_filter(event: Dict[str, Any], hint: Dict[str, Any]) -> Optional
     return event
 
 
+class StageStats:
+    """Counters and timing summary for one pipeline stage"""
+    
+    __slots__ = ('calls', 'total_ms', 'min_ms', 'max_ms', 'counters', 'first_seen', 'last_seen')
+    
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.min_ms = float('inf')
+        self.max_ms = 0.0
+        self.counters: Dict[str, float] = {}
+        self.first_seen = float('inf')
+        self.last_seen = 0.0
+    
+    def add(self, duration_ms: Optional[float], counters: Dict[str, Any]) -> None:
+        self.calls += 1
+        now = time.time()
+        # Timed calls are recorded when they end, so the stage began duration_ms earlier
+        self.first_seen = min(self.first_seen, now - (duration_ms or 0.0) / 1000)
+        self.last_seen = max(self.last_seen, now)
+        if duration_ms is not None:
+            self.total_ms += duration_ms
+            self.min_ms = min(self.min_ms, duration_ms)
+            self.max_ms = max(self.max_ms, duration_ms)
+        for key, value in counters.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.counters[key] = self.counters.get(key, 0) + value
+    
+    def summary(self) -> Dict[str, Any]:
+        timed = self.min_ms != float('inf')
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if timed else None,
+            'min_ms': round(self.min_ms, 3) if timed else None,
+            'max_ms': round(self.max_ms, 3),
+            **self.counters
+        }
+
+
+class MetricAggregator:
+    """In-process per-(dag, task, stage) accumulator flushed once per task"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[Tuple[str, str], Dict[str, StageStats]] = {}
+    
+    def record(self, dag_id: str, task_id: str, stage: str,
+               duration_ms: Optional[float] = None, counters: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            stages = self._stages.setdefault((dag_id, task_id), {})
+            stats = stages.get(stage)
+            if stats is None:
+                stats = stages[stage] = StageStats()
+            stats.add(duration_ms, counters or {})
+    
+    def drain(self, dag_id: str, task_id: str) -> Dict[str, StageStats]:
+        with self._lock:
+            return self._stages.pop((dag_id, task_id), {})
+    
+    def flush(self, dag_id: str, task_id: str, span=None) -> Dict[str, Dict[str, Any]]:
+        """Emit one span per stage under ``span`` (default: the current span) and reset."""
+        stages = self.drain(dag_id, task_id)
+        if not stages:
+            return {}
+        
+        summaries = {stage: stats.summary() for stage, stats in stages.items()}
+        span = span or sentry_sdk.get_current_span()
+        if span is not None:
+            for stage, stats in stages.items():
+                child = span.start_child(
+                    op='pipeline.stage',
+                    description=f'{dag_id}.{task_id}.{stage}',
+                    start_timestamp=_span_time(stats.first_seen)
+                )
+                for key, value in summaries[stage].items():
+                    child.set_data(key, value)
+                child.finish(end_timestamp=_span_time(stats.last_seen))
+            
+            transaction = getattr(span, 'containing_transaction', None) or span
+            if hasattr(transaction, 'set_measurement'):
+                for stage, summary in summaries.items():
+                    transaction.set_measurement(f'pipeline_{stage}_ms', summary['total_ms'], 'millisecond')
+        
+        sentry_sdk.add_breadcrumb(
+            message=f'Pipeline metrics flushed for {dag_id}:{task_id}',
+            level='info',
+            data={'dag_id': dag_id, 'task_id': task_id, 'stages': len(summaries)}
+        )
+        return summaries
+
+
+_aggregator = MetricAggregator()
+
+
 class DAGLogger:
-    """Enhanced logger for Airflow DAGs with Sentry integration."""
+    """Enhanced logger for Airflow DAGs with Sentry integration.
+
+    Messages are %-formatted lazily by the queue listener. Pass
+    breadcrumb=False on info/debug calls inside per-batch loops to skip the
+    Sentry breadcrumb for high-frequency messages. Repeated warnings are
+    sent to Sentry once and counted after that; the last
+    MAX_WARNED_MESSAGES distinct messages are remembered.
+    """
     
     def __init__(self, dag_id: str, task_id: Optional[str] = None):
         self.dag_id = dag_id
         self.task_id = task_id
-        self.logger = logging.getLogger(f'airflow.dag.{dag_id}')
+        self.logger = setup_logging(f'airflow.dag.{dag_id}', 'DEBUG' if NODE_ENV == 'development' else 'INFO')
+        self._prefix = f"{dag_id}:{task_id}" if task_id else dag_id
+        self._context = {'dag_id': dag_id, 'task_id': task_id}
+        # Insertion-ordered so the oldest message is forgotten first
+        self._warned: Dict[str, None] = {}
         
         # Set context tags
         sentry_sdk.set_tag('dag_id', dag_id)
         if task_id:
             sentry_sdk.set_tag('task_id', task_id)
     
-    def info(self, message: str, extra: Optional[Dict[str, Any]] = None) -> None:
+    def _context_with(self, extra: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # Reuse the shared context dict when there is nothing to merge
+        return {**self._context, **extra} if extra else self._context
+    
+    def _log(self, level: int, message: str, extra: Optional[Dict[str, Any]], **kwargs) -> None:
+        # stacklevel=3 attributes the record to the caller of info()/debug()/..., not this wrapper
+        self.logger.log(level, '[%s] %s', self._prefix, message,
+                        extra={'fields': self._context_with(extra)}, stacklevel=3, **kwargs)
+    
+    def info(self, message: str, extra: Optional[Dict[str, Any]] = None, breadcrumb: bool = True) -> None:
         """Log info message with Sentry breadcrumb."""
-        log_msg = f"[{self.dag_id}{f':{self.task_id}' if self.task_id else ''}] {message}"
-        self.logger.info(log_msg, extra=extra)
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, message, extra)
         
-        sentry_sdk.add_breadcrumb(
-            message=message,
-            level='info',
-            data={
-                'dag_id': self.dag_id,
-                'task_id': self.task_id,
-                **(extra or {})
-            }
-        )
+        if breadcrumb:
+            sentry_sdk.add_breadcrumb(
+                message=message,
+                level='info',
+                data=self._context_with(extra)
+            )
     
     def warning(self, message: str, extra: Optional[Dict[str, Any]] = None) -> None:
-        """Log warning with Sentry capture."""
-        log_msg = f"[{self.dag_id}{f':{self.task_id}' if self.task_id else ''}] {message}"
-        self.logger.warning(log_msg, extra=extra)
+        """Log warning; only the first occurrence of a message per logger is sent to Sentry."""
+        self._log(logging.WARNING, message, extra)
         
-        with sentry_sdk.push_scope() as scope:
-            scope.set_level('warning')
-            scope.set_context('warning_context', {
-                'dag_id': self.dag_id,
-                'task_id': self.task_id,
-                **(extra or {})
-            })
-            sentry_sdk.capture_message(message, level='warning')
+        # Repeats (e.g. one per batch) are counted and reported with the task's stage summary
+        if message in self._warned:
+            _aggregator.record(self.dag_id, self.task_id or 'unknown_task', 'repeated_warnings',
+                               counters={'count': 1})
+            return
+        if len(self._warned) >= MAX_WARNED_MESSAGES:
+            del self._warned[next(iter(self._warned))]
+        self._warned[message] = None
+        sentry_sdk.capture_message(
+            message, level='warning',
+            contexts={'warning_context': self._context_with(extra)}
+        )
     
     def error(self, message: str, error: Optional[Exception] = None, 
               extra: Optional[Dict[str, Any]] = None) -> None:
         """Log error with Sentry capture."""
-        log_msg = f"[{self.dag_id}{f':{self.task_id}' if self.task_id else ''}] {message}"
-        
         if error:
-            self.logger.error(log_msg, exc_info=error, extra=extra)
+            self._log(logging.ERROR, message, extra, exc_info=error)
         else:
-            self.logger.error(log_msg, extra=extra)
+            self._log(logging.ERROR, message, extra)
         
-        with sentry_sdk.push_scope() as scope:
-            scope.set_level('error')
-            scope.set_context('error_context', {
-                'dag_id': self.dag_id,
-                'task_id': self.task_id,
-                'message': message,
-                **(extra or {})
-            })
-            
+        # Scope arguments apply to this event only, without pushing a scope
+        scope_kwargs = {
+            'contexts': {'error_context': {**self._context, 'message': message, **(extra or {})}},
             # Set fingerprinting for similar DAG errors
-            scope.set_fingerprint([
+            'fingerprint': [
                 'dag_error',
                 self.dag_id,
                 self.task_id or 'unknown_task',
                 error.__class__.__name__ if error else 'unknown_error'
-            ])
-            
-            if error:
-                sentry_sdk.capture_exception(error)
-            else:
-                sentry_sdk.capture_message(message, level='error')
+            ]
+        }
+        if error:
+            sentry_sdk.capture_exception(error, **scope_kwargs)
+        else:
+            sentry_sdk.capture_message(message, level='error', **scope_kwargs)
     
-    def debug(self, message: str, extra: Optional[Dict[str, Any]] = None) -> None:
-        """Log debug message with breadcrumb."""
-        if NODE_ENV == 'development':
-            log_msg = f"[{self.dag_id}{f':{self.task_id}' if self.task_id else ''}] {message}"
-            self.logger.debug(log_msg, extra=extra)
+    def debug(self, message: str, extra: Optional[Dict[str, Any]] = None, breadcrumb: bool = True) -> None:
+        """Log debug message with breadcrumb (rate-limited per call site)."""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, message, extra)
         
-        sentry_sdk.add_breadcrumb(
-            message=message,
-            level='debug',
-            data={
-                'dag_id': self.dag_id,
-                'task_id': self.task_id,
-                **(extra or {})
-            }
-        )
+        if breadcrumb:
+            sentry_sdk.add_breadcrumb(
+                message=message,
+                level='debug',
+                data=self._context_with(extra)
+            )
 
 
 def with_dag_context(dag_id: str, task_id: Optional[str] = None):
-    """Decorator for DAG tasks with Sentry context."""
+    """Decorator for DAG tasks with Sentry context, stage summaries and tail sampling."""
     
     def decorator(func):
+        @wraps(func)
         def wrapper(*args, **kwargs):
             with sentry_sdk.push_scope() as scope:
                 # Set DAG context
@@ -199,8 +359,10 @@ def with_dag_context(dag_id: str, task_id: Optional[str] = None):
                 # Create transaction for performance tracking
                 with sentry_sdk.start_transaction(
                     name=f'dag.{dag_id}.{task_id or "unknown"}',
-                    op='airflow_task'
+                    op=PIPELINE_TRANSACTION_OP
                 ) as transaction:
+                    started = time.monotonic()
+                    failed = False
                     
                     try:
                         # Add breadcrumb for task start
@@ -223,6 +385,7 @@ def with_dag_context(dag_id: str, task_id: Optional[str] = None):
                         return result
                         
                     except Exception as e:
+                        failed = True
                         transaction.set_status('internal_error')
                         
                         # Enhanced error context for Airflow tasks
@@ -235,6 +398,11 @@ def with_dag_context(dag_id: str, task_id: Optional[str] = None):
                         })
                         
                         raise
+                    finally:
+                        # Promote before flushing so the stage spans are recorded on the transaction
+                        if not transaction.sampled and should_promote_trace(time.monotonic() - started, failed):
+                            _promote_transaction(transaction)
+                        _aggregator.flush(dag_id, task_id or 'unknown_task', transaction)
         
         return wrapper
     return decorator
@@ -243,45 +411,32 @@ def with_dag_context(dag_id: str, task_id: Optional[str] = None):
 def track_pipeline_metrics(
     dag_id: str,
     task_id: str,
-    metrics: Dict[str, Any]
+    metrics: Dict[str, Any],
+    stage: str = 'task'
 ) -> None:
-    """Track pipeline metrics with Sentry."""
+    """Accumulate pipeline metrics for a stage; sent as one span when the task flushes.
     
-    with sentry_sdk.push_scope() as scope:
-        scope.set_tag('metric_type', 'pipeline_performance')
-        scope.set_tag('dag_id', dag_id)
-        scope.set_tag('task_id', task_id)
-        
-        scope.set_context('pipeline_metrics', {
-            'dag_id': dag_id,
-            'task_id': task_id,
-            **metrics
-        })
-        
-        # Set measurements for numeric metrics
-        for key, value in metrics.items():
-            if isinstance(value, (int, float)):
-                # Determine unit based on metric name
-                unit = 'none'
-                if 'duration' in key.lower() or 'time' in key.lower():
-                    unit = 'millisecond'
-                elif 'count' in key.lower() or 'records' in key.lower():
-                    unit = 'none'
-                elif 'rate' in key.lower() or 'percent' in key.lower():
-                    unit = 'percent'
-                
-                sentry_sdk.set_measurement(f'pipeline_{key}', value, unit)
-        
-        # Add breadcrumb for metrics tracking
-        sentry_sdk.add_breadcrumb(
-            message=f'Pipeline metrics recorded for {dag_id}:{task_id}',
-            level='info',
-            data={
-                'dag_id': dag_id,
-                'task_id': task_id,
-                'metrics_count': len(metrics)
-            }
-        )
+    Cheap enough to call per batch: a ``duration_ms`` value is summarized as a
+    timing, other numeric values are summed.
+    """
+    counters = dict(metrics)
+    duration_ms = counters.pop('duration_ms', None)
+    _aggregator.record(dag_id, task_id, stage, duration_ms, counters)
+
+
+@contextmanager
+def track_stage(dag_id: str, task_id: str, stage: str, **counters):
+    """Time a block into the stage aggregate (plus any numeric counters)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _aggregator.record(dag_id, task_id, stage, (time.perf_counter() - started) * 1000, counters)
+
+
+def flush_pipeline_metrics(dag_id: str, task_id: str) -> Dict[str, Dict[str, Any]]:
+    """Flush a task's stage summaries now (with_dag_context does this automatically)."""
+    return _aggregator.flush(dag_id, task_id)
 
 
 def create_dag_logger(dag_id: str, task_id: Optional[str] = None) -> DAGLogger:
@@ -0,0 +1,65 @@
+"""
+Source freshness checks served from the session activity rollup
+
+``analytics.session_activity_hourly`` is maintained by triggers on
+``core.audio_sessions`` and ``analytics.ciq_metrics`` (migrations v1.2.4 and
+v1.2.8), so volume and freshness over a window is a sum over a fixed number
+of hourly buckets regardless of how many schools are writing sessions. Each
+hour is split into per-backend slot rows so concurrent writers do not queue
+on one row; the queries sum over them. Distinct active teachers come from
+``latest_teachers``, which counts each teacher only in the bucket of their
+most recent session.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from utils import setup_logging
+
+
+WINDOW_QUERY = """
+SELECT
+    COALESCE(SUM(sessions_created), 0) as total_sessions,
+    MAX(latest_session_at) as latest_session,
+    COALESCE(SUM(latest_teachers), 0) as active_teachers
+FROM analytics.session_activity_hourly
+WHERE bucket_start >= date_trunc('hour', NOW() - %s * INTERVAL '1 hour')
+"""
+
+CHANGES_QUERY = """
+SELECT
+    COALESCE(SUM(sessions_created), 0) as sessions_created,
+    COALESCE(SUM(metrics_changed), 0) as metrics_changed
+FROM analytics.session_activity_hourly
+WHERE bucket_start >= date_trunc('hour', %s::timestamptz)
+"""
+
+logger = setup_logging('source_freshness')
+
+
+def get_source_freshness(pg_hook, window: timedelta = timedelta(days=7)) -> Dict[str, Any]:
+    """Sessions, latest session time and distinct active teachers over the trailing window"""
+    hours = int(window.total_seconds() // 3600)
+    total_sessions, latest_session, active_teachers = pg_hook.get_first(WINDOW_QUERY, parameters=[hours])
+    return {
+        'total_sessions': int(total_sessions),
+        'latest_session': latest_session,
+        'active_teachers': int(active_teachers),
+    }
+
+
+def count_changes_since(pg_hook, since: datetime) -> Dict[str, int]:
+    """Session inserts and CIQ metric writes since ``since``.
+
+    Buckets are whole hours, so the count can include writes from earlier in
+    the hour ``since`` falls in; callers use it to skip work when it is zero.
+    """
+    sessions_created, metrics_changed = pg_hook.get_first(CHANGES_QUERY, parameters=[since])
+    return {'sessions_created': int(sessions_created), 'metrics_changed': int(metrics_changed)}
+
+
+def hours_since(timestamp: Optional[datetime], now: Optional[datetime] = None) -> Optional[float]:
+    if timestamp is None:
+        return None
+    now = now or (datetime.now(timestamp.tzinfo) if timestamp.tzinfo else datetime.now())
+    return (now - timestamp).total_seconds() / 3600
@@ -0,0 +1,215 @@
+"""
+Non-blocking structured logging for ANDI data pipelines
+
+Log calls only enqueue the LogRecord; a single QueueListener thread per
+process does the formatting and I/O (forked task processes start their own). Records are rendered as JSON with any
+``extra={'fields': {...}}`` merged in, and field values that are callables
+are evaluated lazily by the listener, so expensive context is only built
+for records that are actually emitted. Debug records are rate-limited and
+sampled per call site to keep per-batch loops cheap.
+
+Environment:
+    ANDI_LOG_FORMAT        json (default) or text
+    ANDI_LOG_DEBUG_RATE    max debug records per call site per second (default 5)
+    ANDI_LOG_DEBUG_SAMPLE  fraction of debug records kept before rate limiting (default 1.0)
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Any, Optional, Tuple
+
+
+LOG_FORMAT = os.getenv('ANDI_LOG_FORMAT', 'json').lower()
+DEBUG_RATE_PER_SECOND = float(os.getenv('ANDI_LOG_DEBUG_RATE', '5'))
+DEBUG_SAMPLE_RATE = float(os.getenv('ANDI_LOG_DEBUG_SAMPLE', '1.0'))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'fields', 'suppressed'}
+
+
+def _resolve(value: Any) -> Any:
+    """Evaluate lazy (callable) field values"""
+    if callable(value):
+        try:
+            return value()
+        except Exception as e:
+            return f'<lazy field failed: {e}>'
+    return value
+
+
+class JSONFormatter(logging.Formatter):
+    """Render records as single-line JSON documents"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            'timestamp': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        fields = getattr(record, 'fields', None)
+        if fields:
+            for key, value in fields.items():
+                payload[key] = _resolve(value)
+
+        # Plain extra={...} keys are kept too, for callers that predate 'fields'
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and key not in payload:
+                payload[key] = _resolve(value)
+
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            payload['suppressed_since_last'] = suppressed
+
+        if record.exc_text:
+            payload['exception'] = record.exc_text
+        elif record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, default=str)
+
+
+class DebugRateLimitFilter(logging.Filter):
+    """Sample and rate-limit low-level records per call site (source file, line)"""
+
+    def __init__(self, max_per_second: float = DEBUG_RATE_PER_SECOND, sample_rate: float = DEBUG_SAMPLE_RATE,
+                 max_level: int = logging.DEBUG):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.sample_rate = sample_rate
+        self.max_level = max_level
+        self._lock = threading.Lock()
+        # call site -> (window start, emitted in window, suppressed since last emit)
+        self._windows: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.max_per_second <= 0:
+            return True
+
+        # Not the template: wrappers such as DAGLogger route every message through '[%s] %s'
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.max_per_second:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that defers message formatting to the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks are rendered eagerly so frames are not kept alive in the queue
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self) -> None:
+        # Airflow's forked task runner exits via logging.shutdown() and os._exit(), skipping atexit
+        stop_logging()
+        super().close()
+
+
+class _ListenerState:
+    log_queue: Optional[queue.SimpleQueue] = None
+    listener: Optional[QueueListener] = None
+    handler: Optional[NonBlockingQueueHandler] = None
+    rate_limit = DebugRateLimitFilter()
+    lock = threading.Lock()
+
+
+def _build_output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == 'text':
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def get_queue_handler() -> NonBlockingQueueHandler:
+    """Return the process-wide queue handler, starting the listener on first use"""
+    if _ListenerState.handler is not None:
+        return _ListenerState.handler
+
+    with _ListenerState.lock:
+        if _ListenerState.handler is None:
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, _build_output_handler(), respect_handler_level=True)
+            listener.start()
+            atexit.register(stop_logging)
+
+            handler = NonBlockingQueueHandler(log_queue)
+            _ListenerState.log_queue = log_queue
+            _ListenerState.listener = listener
+            _ListenerState.handler = handler
+    return _ListenerState.handler
+
+
+def _restart_after_fork() -> None:
+    """Give a forked child (e.g. Airflow's task runner) its own queue and listener thread.
+
+    The child inherits the handler already attached to module loggers, but not
+    the parent's listener thread, so records would queue up and never be written.
+    """
+    _ListenerState.lock = threading.Lock()
+    _ListenerState.rate_limit._lock = threading.Lock()
+    if _ListenerState.handler is None:
+        return
+    # A fresh queue: records the parent had not written yet are the parent's to write
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, _build_output_handler(), respect_handler_level=True)
+    listener.start()
+    _ListenerState.handler.queue = log_queue
+    _ListenerState.log_queue = log_queue
+    _ListenerState.listener = listener
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    with _ListenerState.lock:
+        if _ListenerState.listener is not None:
+            _ListenerState.listener.stop()
+            _ListenerState.listener = None
+            _ListenerState.handler = None
+            _ListenerState.log_queue = None
+
+
+def configure_logger(logger: logging.Logger) -> logging.Logger:
+    """Attach the shared queue handler and debug rate limit to a logger once"""
+    handler = get_queue_handler()
+    if not any(isinstance(existing, NonBlockingQueueHandler) for existing in logger.handlers):
+        logger.addHandler(handler)
+    # Filtering on the logger (not the handler) also throttles records propagated to Airflow's handlers
+    if _ListenerState.rate_limit not in logger.filters:
+        logger.addFilter(_ListenerState.rate_limit)
+    return logger
@@ -0,0 +1,222 @@
+"""
+Surrogate key assignment for ANDI data pipelines
+
+Maps UUID natural keys (session, teacher, classroom, ...) to dense UInt64
+surrogates for the warehouse ``*_sk`` columns. The mapping for a key type
+is held in memory as two sorted numpy arrays (16-byte keys, uint64 values)
+so whole batch columns are resolved with one vectorized searchsorted.
+``dims_surrogate_keys`` in ClickHouse is the source of truth: new keys are
+written there before they are used, and assignment is serialized across
+workers with a PostgreSQL advisory lock so two tasks never hand out the
+same surrogate.
+"""
+
+import threading
+import uuid
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+from utils import setup_logging
+from connections import db_connections
+from batching import clickhouse_batch_insert
+
+
+SURROGATE_KEYS_TABLE = 'dims_surrogate_keys'
+SURROGATE_KEYS_COLUMNS = ['key_type', 'natural_key', 'surrogate_key', 'etl_batch_id']
+
+KEY_TYPES = ('session', 'teacher', 'classroom', 'student', 'school', 'district')
+
+logger = setup_logging('surrogate_keys')
+
+
+def uuids_to_keys(values: Iterable[Any]) -> np.ndarray:
+    """Convert UUIDs (objects, strings or 16-byte values) to a fixed-width 'S16' array"""
+    hex_parts = []
+    for value in values:
+        if isinstance(value, uuid.UUID):
+            hex_parts.append(value.hex)
+        elif isinstance(value, (bytes, bytearray)) and len(value) == 16:
+            hex_parts.append(bytes(value).hex())
+        else:
+            hex_parts.append(str(value).replace('-', ''))
+
+    raw = bytes.fromhex(''.join(hex_parts))
+    if len(raw) != 16 * len(hex_parts):
+        raise ValueError('Natural keys must all be UUIDs')
+    return np.frombuffer(raw, dtype='S16')
+
+
+def keys_to_uuids(keys: np.ndarray) -> list:
+    """Inverse of uuids_to_keys, for writing mappings back to ClickHouse"""
+    raw = keys.tobytes()
+    return [uuid.UUID(bytes=raw[offset:offset + 16]) for offset in range(0, len(raw), 16)]
+
+
+class SurrogateKeyMap:
+    """Sorted in-memory natural key -> surrogate mapping for one key type"""
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype='S16')
+        self.values = np.empty(0, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def max_value(self) -> int:
+        return int(self.values.max()) if len(self.values) else 0
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (surrogates, found mask); surrogates are 0 where not found"""
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.uint64), np.zeros(len(keys), dtype=bool)
+
+        positions = np.searchsorted(self.keys, keys)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = self.keys[positions] == keys
+        return np.where(found, self.values[positions], np.uint64(0)), found
+
+    def add(self, keys: np.ndarray, values: np.ndarray) -> None:
+        """Merge new mappings, keeping the existing surrogate for keys already present"""
+        if not len(keys):
+            return
+        _, found = self.lookup(keys)
+        keys, values = keys[~found], values[~found]
+
+        merged_keys = np.concatenate([self.keys, keys])
+        merged_values = np.concatenate([self.values, values.astype(np.uint64)])
+        order = np.argsort(merged_keys, kind='stable')
+        merged_keys, merged_values = merged_keys[order], merged_values[order]
+
+        # Duplicates within one add() keep their first occurrence
+        unique = np.ones(len(merged_keys), dtype=bool)
+        unique[1:] = merged_keys[1:] != merged_keys[:-1]
+        self.keys = merged_keys[unique]
+        self.values = merged_values[unique]
+
+
+class SurrogateKeyService:
+    """Resolve and assign dense surrogate keys for one natural key type"""
+
+    def __init__(self, key_type: str, client=None, connections=None):
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Unknown surrogate key type: {key_type}")
+        self.key_type = key_type
+        self.client = client
+        self.connections = connections or db_connections
+        self.mapping = SurrogateKeyMap()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _query_mappings(self, client, above: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        result = client.query(
+            f"""
+            SELECT toString(natural_key), min(surrogate_key)
+            FROM {SURROGATE_KEYS_TABLE}
+            WHERE key_type = %(key_type)s AND surrogate_key > %(above)s
+            GROUP BY natural_key
+            """,
+            parameters={'key_type': self.key_type, 'above': above}
+        )
+        if not result.result_rows:
+            return np.empty(0, dtype='S16'), np.empty(0, dtype=np.uint64)
+        natural_keys, surrogates = result.result_columns
+        return uuids_to_keys(natural_keys), np.asarray(surrogates, dtype=np.uint64)
+
+    def _with_client(self, func):
+        if self.client is not None:
+            return func(self.client)
+        with self.connections.get_clickhouse_connection() as client:
+            return func(client)
+
+    def load(self) -> int:
+        """(Re)load the full mapping for this key type from ClickHouse"""
+        keys, values = self._with_client(self._query_mappings)
+        mapping = SurrogateKeyMap()
+        mapping.add(keys, values)
+        with self._lock:
+            self.mapping = mapping
+            self._loaded = True
+        logger.info(f"Loaded {len(mapping):,} {self.key_type} surrogate keys (max {mapping.max_value})")
+        return len(mapping)
+
+    def resolve(self, natural_keys: Iterable[Any], batch_id: str = '') -> np.ndarray:
+        """Return surrogates for a column of natural keys, assigning new ones as needed"""
+        keys = uuids_to_keys(natural_keys)
+        if not self._loaded:
+            self.load()
+
+        values, found = self.mapping.lookup(keys)
+        if found.all():
+            return values
+
+        self._assign(np.unique(keys[~found]), batch_id)
+        values, found = self.mapping.lookup(keys)
+        if not found.all():
+            raise RuntimeError(f"Unresolved {self.key_type} surrogate keys after assignment")
+        return values
+
+    def _assign(self, missing: np.ndarray, batch_id: str) -> None:
+        with self._lock, self.connections.get_postgres_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_lock(hashtext(%s))', (f'andi_sk:{self.key_type}',))
+            try:
+                self._with_client(lambda client: self._assign_locked(client, missing, batch_id))
+            finally:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', (f'andi_sk:{self.key_type}',))
+                conn.commit()
+
+    def _assign_locked(self, client, missing: np.ndarray, batch_id: str) -> None:
+        # Catch up with keys other workers assigned since our last load
+        keys, values = self._query_mappings(client, above=self.mapping.max_value)
+        self.mapping.add(keys, values)
+
+        _, found = self.mapping.lookup(missing)
+        missing = missing[~found]
+        if not len(missing):
+            return
+
+        start = self.mapping.max_value + 1
+        new_values = np.arange(start, start + len(missing), dtype=np.uint64)
+        rows = (
+            [self.key_type, natural_key, int(surrogate), batch_id]
+            for natural_key, surrogate in zip(keys_to_uuids(missing), new_values)
+        )
+        # Persist before use so a crashed task can never leave facts pointing at unrecorded keys
+        clickhouse_batch_insert(client, SURROGATE_KEYS_TABLE, rows, SURROGATE_KEYS_COLUMNS)
+        self.mapping.add(missing, new_values)
+        logger.info(f"Assigned {len(missing):,} new {self.key_type} surrogate keys ({start}-{start + len(missing) - 1})")
+
+
+_services: Dict[str, SurrogateKeyService] = {}
+_services_lock = threading.Lock()
+
+
+def get_key_service(key_type: str) -> SurrogateKeyService:
+    """Process-wide service per key type, so mappings are loaded once per worker"""
+    with _services_lock:
+        if key_type not in _services:
+            _services[key_type] = SurrogateKeyService(key_type)
+        return _services[key_type]
+
+
+def resolve_surrogate_columns(
+    columns: Dict[str, Iterable[Any]],
+    key_columns: Dict[str, str],
+    batch_id: str = '',
+    services: Optional[Dict[str, SurrogateKeyService]] = None
+) -> Dict[str, np.ndarray]:
+    """Resolve several natural key columns of a batch at once.
+
+    ``key_columns`` maps source column name -> key type, e.g.
+    ``{'session_id': 'session', 'teacher_id': 'teacher'}``; results are
+    keyed ``<key_type>_sk``.
+    """
+    services = services or {}
+    resolved = {}
+    for column, key_type in key_columns.items():
+        service = services.get(key_type) or get_key_service(key_type)
+        resolved[f'{key_type}_sk'] = service.resolve(columns[column], batch_id=batch_id)
+    return resolved
@@ -5,26 +5,30 @@ Shared utilities for ANDI data pipelines
 import os
 import json
 import logging
+import random
+import resource
+import socket
 import requests
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable
 from functools import wraps
 
+from structured_logging import configure_logger
+
 
 def setup_logging(name: str, level: str = 'INFO') -> logging.Logger:
-    """Set up structured logging for ETL processes"""
+    """Set up structured logging for ETL processes.
+
+    Records are handed to a background queue listener and rendered as JSON
+    (see structured_logging); pass context as extra={'fields': {...}} and use
+    callables for values that are expensive to compute.
+    """
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, level.upper()))
     
-    if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-    
-    return logger
+    return configure_logger(logger)
 
 
 def send_slack_notification(message: str, channel: str = '#andi-alerts', username: str = 'ANDI ETL Bot') -> bool:
@@ -73,7 +77,11 @@ def send_pipeline_alert(pipeline_name: str, status: str, details: str = "", cont
 
 
 def retry_with_backoff(max_retries: int = 3, backoff_factor: float = 2.0, exceptions: tuple = (Exception,)):
-    """Decorator for retrying functions with exponential backoff"""
+    """Decorator for retrying functions with jittered exponential backoff.
+
+    For database calls prefer resilience.call_with_retries, which classifies
+    errors, honours the task deadline and shares a circuit breaker per endpoint.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -87,8 +95,9 @@ def retry_with_backoff(max_retries: int = 3, backoff_factor: float = 2.0, except
                     if attempt == max_retries:
                         break
                     
-                    wait_time = backoff_factor ** attempt
-                    print(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait_time}s...")
+                    # Full jitter keeps concurrent callers from retrying in lockstep
+                    wait_time = random.uniform(0, backoff_factor ** attempt)
+                    print(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait_time:.1f}s...")
                     time.sleep(wait_time)
             
             raise last_exception
@@ -96,10 +105,33 @@ def retry_with_backoff(max_retries: int = 3, backoff_factor: float = 2.0, except
     return decorator
 
 
-def batch_processor(items: List[Any], batch_size: int = 1000):
-    """Process items in batches"""
-    for i in range(0, len(items), batch_size):
-        yield items[i:i + batch_size]
+def batch_processor(items: Iterable[Any], batch_size: int = 1000):
+    """Process items in fixed-size batches from any iterable.
+
+    For budget-driven, self-tuning batch sizes use batching.stream_batches.
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
+def get_rss_bytes() -> int:
+    """Current resident set size of this process in bytes (peak RSS if /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_bytes()
+
+
+def get_peak_rss_bytes() -> int:
+    """Peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
 
 
 def get_date_range(start_date: str, end_date: str = None) -> List[datetime]:
@@ -195,8 +227,11 @@ class ETLMetrics:
             'records_loaded': 0,
             'records_failed': 0,
             'bytes_processed': 0,
+            'retries': 0,
             'errors': []
         }
+        self.batches: Dict[str, List[Dict[str, Any]]] = {}
+        self.stage_durations: Dict[str, float] = {}
     
     def record_extraction(self, count: int):
         """Record extraction metrics"""
@@ -211,6 +246,46 @@ class ETLMetrics:
         self.metrics['records_loaded'] = count
         self.metrics['bytes_processed'] += bytes_processed
     
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage (extract, transform, validate, load, ...)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage_time(name, time.perf_counter() - started)
+    
+    def record_stage_time(self, name: str, seconds: float):
+        """Add time spent in a stage measured elsewhere (e.g. queue waits)"""
+        self.stage_durations[name] = self.stage_durations.get(name, 0.0) + seconds
+    
+    def record_retry(self):
+        """Record a retried operation"""
+        self.metrics['retries'] += 1
+    
+    def record_batch(self, name: str, rows: int, bytes_processed: int = 0, duration_seconds: float = 0.0):
+        """Record one batch chosen by a batch controller"""
+        self.batches.setdefault(name, []).append({
+            'rows': rows,
+            'bytes': bytes_processed,
+            'duration_seconds': duration_seconds
+        })
+    
+    def get_batch_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Summarize batch sizes per controller"""
+        summary = {}
+        for name, batches in self.batches.items():
+            sizes = [batch['rows'] for batch in batches]
+            summary[name] = {
+                'batches': len(sizes),
+                'min_batch_size': min(sizes),
+                'max_batch_size': max(sizes),
+                'avg_batch_size': sum(sizes) / len(sizes),
+                'last_batch_size': sizes[-1],
+                'total_seconds': sum(batch['duration_seconds'] for batch in batches)
+            }
+        return summary
+    
     def record_error(self, error: str):
         """Record error"""
         self.metrics['records_failed'] += 1
@@ -232,10 +307,51 @@ class ETLMetrics:
             'bytes_processed': format_bytes(self.metrics['bytes_processed']),
             'success_rate': (self.metrics['records_loaded'] / max(self.metrics['records_extracted'], 1)) * 100,
             'throughput_records_per_second': self.metrics['records_loaded'] / max(duration, 1),
+            'batch_sizes': self.get_batch_summary(),
+            'stage_durations': {name: round(seconds, 3) for name, seconds in self.stage_durations.items()},
+            'retries': self.metrics['retries'],
+            'peak_memory': format_bytes(get_peak_rss_bytes()),
             'error_count': len(self.metrics['errors']),
             'errors': self.metrics['errors'][:10]  # Limit to first 10 errors
         }
     
+    def to_run_record(self, dag_id: str, task_id: str, run_id: str = '', partition: str = '',
+                      status: Optional[str] = None) -> Dict[str, Any]:
+        """Build a structured pipeline_runs record from the collected metrics"""
+        finished = datetime.now()
+        duration = (finished - self.start_time).total_seconds()
+        batch_sizes = [batch['rows'] for batches in self.batches.values() for batch in batches]
+        
+        if status is None:
+            status = 'success' if not self.metrics['errors'] else 'failed'
+        
+        return {
+            'run_date': self.start_time.date(),
+            'started_at': self.start_time,
+            'finished_at': finished,
+            'dag_id': dag_id,
+            'task_id': task_id,
+            'run_id': run_id or '',
+            'pipeline': self.pipeline_name,
+            'partition_key': partition or '',
+            'status': status,
+            'duration_seconds': duration,
+            'stage_seconds': dict(self.stage_durations),
+            'records_extracted': self.metrics['records_extracted'],
+            'records_transformed': self.metrics['records_transformed'],
+            'records_loaded': self.metrics['records_loaded'],
+            'records_failed': self.metrics['records_failed'],
+            'bytes_processed': self.metrics['bytes_processed'],
+            'batch_count': len(batch_sizes),
+            'avg_batch_size': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'max_batch_size': max(batch_sizes) if batch_sizes else 0,
+            'retries': self.metrics['retries'],
+            'peak_memory_bytes': get_peak_rss_bytes(),
+            'throughput_records_per_second': self.metrics['records_loaded'] / max(duration, 1),
+            'error_count': len(self.metrics['errors']),
+            'hostname': socket.gethostname()
+        }
+    
     def send_completion_alert(self):
         """Send pipeline completion alert"""
         summary = self.get_summary()
@@ -254,5 +370,5 @@ class ETLMetrics:
         send_pipeline_alert(self.pipeline_name, status, details, summary)
 
 
-# Import time for the retry decorator
+# Import time for the retry decorator and stage timings
 import time
\ No newline at end of file
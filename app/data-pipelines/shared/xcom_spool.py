@@ -0,0 +1,199 @@
+"""
+Spool for large inter-task payloads in ANDI data pipelines
+
+XCom values live in the Airflow metadata database as JSON, which is fine for
+small dicts like ``sync_info`` but not for id sets or partition manifests.
+Tasks store such payloads here instead, in a compact binary file on the
+spool volume shared by all workers, and push only a small reference dict
+through XCom::
+
+    ref = store_uuids(context, 'affected_sessions', session_ids)
+    ...
+    session_ids = pull_uuids(context, 'affected_sessions', task_ids='check_new_data')
+
+File layout: a 16-byte header (magic, version, kind, item count) followed by
+a zlib-compressed body. UUID sets are stored sorted and byte-plane
+transposed (all first bytes, then all second bytes, ...) so their shared
+prefixes compress; integer sets are sorted and delta-encoded; anything else
+is compact JSON. The reference carries the body checksum, which is verified
+on load.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+import uuid
+import zlib
+from typing import Dict, Any, Iterable, List, Optional
+
+import numpy as np
+
+from utils import setup_logging
+
+
+SPOOL_ROOT = os.getenv('XCOM_SPOOL_DIR', '/opt/airflow/spool')
+SPOOL_RETENTION_HOURS = 48
+COMPRESSION_LEVEL = 6
+
+MAGIC = b'AXS1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sBB2xQ')
+
+KIND_UUIDS = 1
+KIND_INTS = 2
+KIND_JSON = 3
+KIND_NAMES = {KIND_UUIDS: 'uuids', KIND_INTS: 'ints', KIND_JSON: 'json'}
+
+logger = setup_logging('xcom_spool')
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', value)
+
+
+def spool_path(dag_id: str, run_id: str, task_id: str, key: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or SPOOL_ROOT, _safe_name(dag_id), _safe_name(run_id), f'{_safe_name(task_id)}.{_safe_name(key)}.axs')
+
+
+def encode_uuids(values: Iterable[Any]) -> bytes:
+    """Sorted, de-duplicated UUIDs as a byte-plane transposed (n, 16) matrix"""
+    raw = sorted({uuid.UUID(str(value)).bytes for value in values if value is not None})
+    matrix = np.frombuffer(b''.join(raw), dtype=np.uint8).reshape(len(raw), 16)
+    return np.ascontiguousarray(matrix.T).tobytes()
+
+
+def decode_uuids(body: bytes, count: int) -> List[str]:
+    matrix = np.frombuffer(body, dtype=np.uint8).reshape(16, count).T
+    return [str(uuid.UUID(bytes=row.tobytes())) for row in matrix]
+
+
+def encode_ints(values: Iterable[int]) -> bytes:
+    """Sorted, de-duplicated int64s as first value + deltas"""
+    array = np.unique(np.fromiter((int(value) for value in values), dtype=np.int64))
+    return np.diff(array, prepend=np.int64(0)).astype('<i8').tobytes()
+
+
+def decode_ints(body: bytes, count: int) -> List[int]:
+    return np.cumsum(np.frombuffer(body, dtype='<i8', count=count)).tolist()
+
+
+def _encode(kind: int, value: Any) -> tuple:
+    if kind == KIND_UUIDS:
+        body = encode_uuids(value)
+        return body, len(body) // 16
+    if kind == KIND_INTS:
+        body = encode_ints(value)
+        return body, len(body) // 8
+    body = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+    return body, len(value) if hasattr(value, '__len__') else 1
+
+
+def _decode(kind: int, body: bytes, count: int) -> Any:
+    if kind == KIND_UUIDS:
+        return decode_uuids(body, count)
+    if kind == KIND_INTS:
+        return decode_ints(body, count)
+    return json.loads(body.decode('utf-8'))
+
+
+def store_payload(context: Dict[str, Any], key: str, kind: int, value: Any,
+                  root: Optional[str] = None, push: bool = True) -> Dict[str, Any]:
+    """Write a payload to the spool and (by default) push its reference to XCom under ``key``"""
+    task_instance = context['task_instance']
+    path = spool_path(task_instance.dag_id, context['run_id'], task_instance.task_id, key, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    body, count = _encode(kind, value)
+    compressed = zlib.compress(body, COMPRESSION_LEVEL)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as spool_file:
+        spool_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, kind, count))
+        spool_file.write(compressed)
+    # Retried tasks overwrite their previous payload atomically
+    os.replace(temp_path, path)
+
+    ref = {
+        'spool_path': path,
+        'kind': KIND_NAMES[kind],
+        'count': count,
+        'bytes': HEADER.size + len(compressed),
+        'checksum': hashlib.blake2b(compressed, digest_size=8).hexdigest()
+    }
+    if push:
+        task_instance.xcom_push(key=key, value=ref)
+    logger.info(f"Spooled {key}: {count:,} {KIND_NAMES[kind]} in {ref['bytes']:,} bytes ({len(body):,} raw)")
+    return ref
+
+
+def load_payload(ref: Dict[str, Any]) -> Any:
+    """Read and verify the payload a spool reference points to"""
+    with open(ref['spool_path'], 'rb') as spool_file:
+        magic, version, kind, count = HEADER.unpack(spool_file.read(HEADER.size))
+        compressed = spool_file.read()
+
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{ref['spool_path']} is not a version {FORMAT_VERSION} spool file")
+    if KIND_NAMES.get(kind) != ref['kind']:
+        raise ValueError(f"{ref['spool_path']} holds {KIND_NAMES.get(kind)}, reference expects {ref['kind']}")
+    if hashlib.blake2b(compressed, digest_size=8).hexdigest() != ref['checksum']:
+        raise ValueError(f"{ref['spool_path']} checksum mismatch (overwritten by a later try?)")
+    return _decode(kind, zlib.decompress(compressed), count)
+
+
+def _pull_ref(context: Dict[str, Any], key: str, task_ids: str, kind: int) -> Optional[Dict[str, Any]]:
+    ref = context['task_instance'].xcom_pull(key=key, task_ids=task_ids)
+    if ref is not None and ref.get('kind') != KIND_NAMES[kind]:
+        raise TypeError(f"XCom {task_ids}.{key} is a {ref.get('kind')} payload, not {KIND_NAMES[kind]}")
+    return ref
+
+
+def store_uuids(context: Dict[str, Any], key: str, values: Iterable[Any], root: Optional[str] = None) -> Dict[str, Any]:
+    return store_payload(context, key, KIND_UUIDS, values, root)
+
+
+def store_ints(context: Dict[str, Any], key: str, values: Iterable[int], root: Optional[str] = None) -> Dict[str, Any]:
+    return store_payload(context, key, KIND_INTS, values, root)
+
+
+def store_json(context: Dict[str, Any], key: str, value: Any, root: Optional[str] = None) -> Dict[str, Any]:
+    return store_payload(context, key, KIND_JSON, value, root)
+
+
+def pull_uuids(context: Dict[str, Any], key: str, task_ids: str) -> Optional[List[str]]:
+    """Sorted UUID strings pushed by ``task_ids`` under ``key``, or None if nothing was pushed"""
+    ref = _pull_ref(context, key, task_ids, KIND_UUIDS)
+    return load_payload(ref) if ref is not None else None
+
+
+def pull_ints(context: Dict[str, Any], key: str, task_ids: str) -> Optional[List[int]]:
+    ref = _pull_ref(context, key, task_ids, KIND_INTS)
+    return load_payload(ref) if ref is not None else None
+
+
+def pull_json(context: Dict[str, Any], key: str, task_ids: str) -> Any:
+    ref = _pull_ref(context, key, task_ids, KIND_JSON)
+    return load_payload(ref) if ref is not None else None
+
+
+def purge_spool(max_age_hours: float = SPOOL_RETENTION_HOURS, root: Optional[str] = None) -> int:
+    """Delete spool files (and emptied run directories) older than ``max_age_hours``"""
+    root = root or SPOOL_ROOT
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for directory, subdirectories, files in os.walk(root, topdown=False):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+    if removed:
+        logger.info(f"Purged {removed} spool files older than {max_age_hours}h from {root}")
+    return removed
@@ -0,0 +1,7 @@
+-- ANDI Data Warehouse - Cluster Database Setup
+-- Replicated database engine: DDL run on any node is applied on every shard/replica,
+-- and MergeTree-family tables are created as their Replicated* variants automatically,
+-- so the regular schema files can be applied unchanged.
+
+CREATE DATABASE IF NOT EXISTS andi_warehouse ON CLUSTER andi_cluster
+ENGINE = Replicated('/clickhouse/databases/andi_warehouse', '{shard}', '{replica}');
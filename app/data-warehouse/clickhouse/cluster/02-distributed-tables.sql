@@ -0,0 +1,15 @@
+-- ANDI Data Warehouse - Distributed Read Tables
+-- Shard-local fact tables keep their regular names (loaders write them directly on the owning shard);
+-- these Distributed tables fan queries out across all shards.
+-- Sharding keys must match SHARDED_TABLES in data-pipelines/shared/cluster.py.
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS facts_ciq_sessions_distributed AS facts_ciq_sessions
+ENGINE = Distributed(andi_cluster, andi_warehouse, facts_ciq_sessions, cityHash64(district_id));
+
+CREATE TABLE IF NOT EXISTS facts_resource_usage_distributed AS facts_resource_usage
+ENGINE = Distributed(andi_cluster, andi_warehouse, facts_resource_usage, cityHash64(user_district_id));
+
+CREATE TABLE IF NOT EXISTS facts_community_activity_distributed AS facts_community_activity
+ENGINE = Distributed(andi_cluster, andi_warehouse, facts_community_activity, cityHash64(user_district_id));
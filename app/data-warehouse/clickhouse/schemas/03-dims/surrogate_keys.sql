@@ -0,0 +1,37 @@
+-- ANDI Data Warehouse - Surrogate Key Registry
+-- Source of truth for dense UInt64 surrogates (session_sk, teacher_sk, classroom_sk, ...)
+-- assigned by the pipeline's key service (shared/surrogate_keys.py)
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS dims_surrogate_keys
+(
+    key_type String, -- 'session', 'teacher', 'classroom', 'student', 'school', 'district'
+    natural_key UUID,
+    surrogate_key UInt64,
+    
+    -- Metadata
+    assigned_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = MergeTree()
+ORDER BY (key_type, natural_key)
+SETTINGS index_granularity = 8192;
+
+-- Assignment is serialized by the key service, so duplicates should never occur;
+-- readers still take min(surrogate_key) per natural key so the first assignment always wins.
+CREATE VIEW IF NOT EXISTS v_surrogate_keys AS
+SELECT 
+    key_type,
+    natural_key,
+    min(surrogate_key) as surrogate_key
+FROM dims_surrogate_keys
+GROUP BY key_type, natural_key;
+
+-- Key space summary per type
+SELECT 
+    key_type,
+    count() as keys_assigned,
+    max(surrogate_key) as max_surrogate_key
+FROM dims_surrogate_keys
+GROUP BY key_type;
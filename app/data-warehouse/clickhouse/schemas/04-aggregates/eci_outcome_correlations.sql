@@ -0,0 +1,75 @@
+-- ANDI Data Warehouse - ECI vs Student Outcome Correlations
+-- Sufficient statistics relating ECI component scores to student academic performance,
+-- maintained incrementally by the pipeline (shared/outcome_correlations.py). Each observation
+-- is a classroom-week: mean ECI scores from facts_ciq_comprehensive paired with mean outcomes
+-- from facts_student_academic_performance. New batches only touch their own classroom-weeks.
+
+USE andi_warehouse;
+
+-- One paired observation per classroom-week, kept so a re-scored week can be replaced exactly
+CREATE TABLE IF NOT EXISTS agg_eci_outcome_cells
+(
+    classroom_id String,
+    week_start_date Date,
+    teacher_id String,
+    academic_year String,
+    semester String,
+    sessions UInt32,
+    outcome_records UInt32,
+    predictors Array(Float64), -- 15 ECI components then overall_ciq_score
+    outcomes Array(Float64),   -- grade, mastery, attendance, behavior score
+    updated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(updated_at)
+PARTITION BY academic_year
+ORDER BY (classroom_id, week_start_date)
+SETTINGS index_granularity = 8192;
+
+-- Augmented moment matrix sum(v * v') with v = [1, predictors, outcomes], flattened row-major.
+-- Holds the count, sums and all cross-products; one row per scope entity and term.
+CREATE TABLE IF NOT EXISTS agg_eci_outcome_stats
+(
+    scope LowCardinality(String), -- 'classroom', 'teacher', 'global'
+    entity_id String,             -- empty for global
+    academic_year String,
+    semester String,
+    observations Float64,
+    moments Array(Float64),
+    updated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (scope, academic_year, semester, entity_id)
+SETTINGS index_granularity = 1024;
+
+-- Served coefficients, rewritten for every entity whose statistics changed.
+-- pearson_r / slope / intercept: simple regression of the outcome on one predictor.
+-- joint_coefficient / joint_r_squared: outcome regressed on equity_avg, creativity_avg and innovation_avg together.
+CREATE TABLE IF NOT EXISTS agg_eci_outcome_correlations
+(
+    scope LowCardinality(String),
+    entity_id String,
+    academic_year String,
+    semester String,
+    outcome LowCardinality(String),
+    predictor LowCardinality(String),
+    observations UInt32,
+    pearson_r Nullable(Float64),
+    slope Nullable(Float64),
+    intercept Nullable(Float64),
+    joint_coefficient Nullable(Float64),
+    joint_r_squared Nullable(Float64),
+    updated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (scope, academic_year, semester, entity_id, outcome, predictor)
+SETTINGS index_granularity = 1024;
+
+-- Latest coefficients, e.g.
+-- SELECT predictor, pearson_r FROM v_eci_outcome_correlations
+-- WHERE scope = 'teacher' AND entity_id = {teacher_id:String} AND outcome = 'current_grade_percentage'
+CREATE VIEW IF NOT EXISTS v_eci_outcome_correlations AS
+SELECT *
+FROM agg_eci_outcome_correlations FINAL;
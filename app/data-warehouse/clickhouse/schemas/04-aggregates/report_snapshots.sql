@@ -0,0 +1,30 @@
+-- ANDI Data Warehouse - Report Snapshots
+-- Precomputed JSON payloads for the Coach "My Teachers" / "Reports" and Teacher Performance
+-- screens, written by the pipeline (shared/report_snapshots.py) after aggregations update.
+-- A page load is a single primary-key lookup on (report_type, subject_id).
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS report_snapshots
+(
+    report_type String, -- 'teacher_performance', 'coach_my_teachers'
+    subject_id UUID,    -- teacher_id or coach_id
+    payload String,     -- JSON document
+    input_hash UInt64,  -- fingerprint of the payload inputs; unchanged inputs are not rewritten
+    generated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(generated_at)
+ORDER BY (report_type, subject_id)
+SETTINGS index_granularity = 1024;
+
+-- Latest payload per key, e.g.
+-- SELECT payload FROM v_report_snapshots WHERE report_type = 'coach_my_teachers' AND subject_id = {coach_id:UUID}
+CREATE VIEW IF NOT EXISTS v_report_snapshots AS
+SELECT 
+    report_type,
+    subject_id,
+    argMax(payload, generated_at) as payload,
+    max(generated_at) as generated_at
+FROM report_snapshots
+GROUP BY report_type, subject_id;
@@ -0,0 +1,80 @@
+-- ANDI Data Warehouse - Rolling Trend Tables
+-- Precomputed rolling 4/12-week averages, deltas and ranks per teacher and school,
+-- maintained incrementally by the pipeline (shared/rolling_trends.py) so coach
+-- dashboards read stored rows instead of evaluating window functions per request
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS agg_rolling_teacher_trends
+(
+    week_start_date Date,
+    teacher_id UUID,
+    school_id UUID,
+    district_id UUID,
+    
+    -- Week on its own
+    week_sessions UInt32,
+    week_avg_score Float32,
+    
+    -- Session-weighted rolling windows ending at this week
+    rolling_4w_sessions UInt32,
+    rolling_4w_avg_score Float32,
+    rolling_12w_sessions UInt32,
+    rolling_12w_avg_score Float32,
+    
+    -- Change versus the window ending 4 / 12 weeks earlier
+    rolling_4w_delta Float32,
+    rolling_12w_delta Float32,
+    
+    -- Ranks on rolling_4w_avg_score (1 = best)
+    school_rank UInt16,
+    district_rank UInt32,
+    district_percentile Float32,
+    
+    -- Metadata
+    updated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(updated_at)
+PARTITION BY toYYYYMM(week_start_date)
+-- school_id is not part of the key, so a teacher who moves school is replaced rather than listed under both
+ORDER BY (district_id, teacher_id, week_start_date)
+SETTINGS index_granularity = 8192;
+
+CREATE TABLE IF NOT EXISTS agg_rolling_school_trends
+(
+    week_start_date Date,
+    school_id UUID,
+    district_id UUID,
+    
+    week_sessions UInt32,
+    week_avg_score Float32,
+    
+    rolling_4w_sessions UInt32,
+    rolling_4w_avg_score Float32,
+    rolling_12w_sessions UInt32,
+    rolling_12w_avg_score Float32,
+    
+    rolling_4w_delta Float32,
+    rolling_12w_delta Float32,
+    
+    district_rank UInt32,
+    district_percentile Float32,
+    
+    -- Metadata
+    updated_at DateTime64(3) DEFAULT now64(3),
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = ReplacingMergeTree(updated_at)
+PARTITION BY toYYYYMM(week_start_date)
+ORDER BY (district_id, school_id, week_start_date)
+SETTINGS index_granularity = 8192;
+
+-- Deduplicated read views for dashboards
+CREATE VIEW IF NOT EXISTS v_teacher_rolling_trends AS
+SELECT *
+FROM agg_rolling_teacher_trends FINAL;
+
+CREATE VIEW IF NOT EXISTS v_school_rolling_trends AS
+SELECT *
+FROM agg_rolling_school_trends FINAL;
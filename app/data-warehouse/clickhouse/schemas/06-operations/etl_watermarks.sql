@@ -0,0 +1,28 @@
+-- ANDI Data Warehouse - Incremental Load Watermarks
+-- Keyset position (timestamp, id) of the last row loaded per source event stream
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS etl_watermarks
+(
+    stream String, -- e.g. 'core.resource_interactions', 'community.forum_votes'
+    watermark_ts DateTime64(6, 'UTC'),
+    watermark_id String,
+    rows_loaded UInt64, -- rows loaded by the batch that advanced the watermark
+    etl_batch_id String DEFAULT '',
+    updated_at DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY stream
+SETTINGS index_granularity = 8192;
+
+-- Current position and lag per stream
+CREATE VIEW IF NOT EXISTS v_etl_watermarks AS
+SELECT 
+    stream,
+    argMax(watermark_ts, updated_at) as watermark_ts,
+    argMax(watermark_id, updated_at) as watermark_id,
+    max(updated_at) as last_advanced_at,
+    dateDiff('minute', argMax(watermark_ts, updated_at), now64(6, 'UTC')) as lag_minutes
+FROM etl_watermarks
+GROUP BY stream;
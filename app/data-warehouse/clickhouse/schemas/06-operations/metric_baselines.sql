@@ -0,0 +1,57 @@
+-- ANDI Data Warehouse - CIQ Metric Baselines and Anomalies
+-- Running distribution state per metric (global, per school, per teacher) and the batches flagged against it
+
+USE andi_warehouse;
+
+-- Mergeable running statistics: Welford weight/mean/M2 plus a fixed-bin histogram sketch.
+-- Rewritten per entity after each sync batch; the latest row wins.
+CREATE TABLE IF NOT EXISTS metric_baselines
+(
+    scope LowCardinality(String), -- 'global', 'school', 'teacher'
+    entity_id String, -- empty for global
+    metric LowCardinality(String), -- 'overall_score', 'equity_score', 'student_talk_percentage', ...
+    weight Float64,
+    mean Float64,
+    m2 Float64,
+    histogram Array(Float64),
+    flagged_batches UInt32 DEFAULT 0, -- consecutive batches held back by a failed check; restarts the baseline at 6
+    etl_batch_id String DEFAULT '',
+    updated_at DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (scope, metric, entity_id)
+SETTINGS index_granularity = 8192;
+
+-- One row per failed check
+CREATE TABLE IF NOT EXISTS metric_anomalies
+(
+    detected_at DateTime DEFAULT now(),
+    scope LowCardinality(String),
+    entity_id String,
+    metric LowCardinality(String),
+    check_name LowCardinality(String), -- 'mean_shift', 'distribution_shift', 'floor_spike'
+    batch_count UInt32,
+    batch_value Float64,
+    baseline_value Float64,
+    statistic Float64,
+    threshold Float64,
+    etl_batch_id String DEFAULT ''
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(detected_at)
+ORDER BY (detected_at, scope, metric)
+TTL detected_at + INTERVAL 180 DAY
+SETTINGS index_granularity = 8192;
+
+-- Baseline summary per metric and scope
+CREATE VIEW IF NOT EXISTS v_metric_baselines AS
+SELECT
+    scope,
+    entity_id,
+    metric,
+    argMax(weight, updated_at) as weight,
+    argMax(mean, updated_at) as mean,
+    sqrt(argMax(m2, updated_at) / greatest(argMax(weight, updated_at) - 1, 1)) as std_dev,
+    max(updated_at) as updated_at
+FROM metric_baselines
+GROUP BY scope, entity_id, metric;
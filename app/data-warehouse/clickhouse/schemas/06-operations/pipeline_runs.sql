@@ -0,0 +1,70 @@
+-- ANDI Data Warehouse - Pipeline Run History
+-- One row per pipeline task run for performance regression tracking and capacity planning
+
+USE andi_warehouse;
+
+CREATE TABLE IF NOT EXISTS pipeline_runs
+(
+    -- Run identity
+    run_date Date,
+    started_at DateTime64(3),
+    finished_at DateTime64(3),
+    dag_id String,
+    task_id String,
+    run_id String,
+    pipeline String,
+    partition_key String DEFAULT '', -- e.g. execution date or district-month being processed
+    status String, -- 'success', 'failed'
+    
+    -- Timings
+    duration_seconds Float64,
+    stage_seconds Map(String, Float64), -- extract/transform/validate/load wall time
+    
+    -- Volume
+    records_extracted UInt64,
+    records_transformed UInt64,
+    records_loaded UInt64,
+    records_failed UInt64,
+    bytes_processed UInt64,
+    
+    -- Batching and resilience
+    batch_count UInt32,
+    avg_batch_size Float64,
+    max_batch_size UInt32,
+    retries UInt16,
+    
+    -- Resources
+    peak_memory_bytes UInt64,
+    throughput_records_per_second Float64,
+    error_count UInt32,
+    hostname String DEFAULT '',
+    
+    -- Metadata
+    created_at DateTime DEFAULT now()
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(run_date)
+ORDER BY (dag_id, task_id, started_at)
+SETTINGS index_granularity = 8192;
+
+-- Keep two years of run history
+ALTER TABLE pipeline_runs 
+MODIFY TTL run_date + INTERVAL 2 YEAR;
+
+-- Daily throughput per task for dashboards
+CREATE VIEW IF NOT EXISTS v_pipeline_daily_throughput AS
+SELECT 
+    run_date,
+    dag_id,
+    task_id,
+    count() as runs,
+    countIf(status = 'failed') as failed_runs,
+    sum(records_loaded) as records_loaded,
+    median(throughput_records_per_second) as median_throughput,
+    quantile(0.95)(duration_seconds) as p95_duration_seconds,
+    max(peak_memory_bytes) as max_peak_memory_bytes,
+    sum(retries) as retries
+FROM pipeline_runs
+GROUP BY run_date, dag_id, task_id;
+
+DESCRIBE pipeline_runs;